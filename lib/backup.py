@@ -5,15 +5,146 @@ Backup and restore functionality for nginx configurations.
 Provides automated backup creation, restoration, and cleanup of nginx configuration files.
 """
 
+import os
+import re
+import json
+import atexit
+import hashlib
 import tarfile
 import shutil
+import subprocess
+from stat import S_ISDIR
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List, Set
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Buffer size for archive file objects; the 8 KiB default means a write or
+# read syscall for every few tar records
+_IO_BUFFER_SIZE = 1 << 20
+
+# Top-level archive entries that restore_backup puts back under /etc/nginx;
+# the two site directories are replaced wholesale
+_RESTORE_PATHS = ('sites-available', 'sites-enabled', 'nginx.conf')
+
+# Archive contents cached across runs, keyed by path and validated by size/mtime
+_INFO_CACHE_FILE = '.info_cache.json'
+
+# Loaded archive content caches by backup directory, shared by every manager
+# for that directory; changed ones are written back once at exit
+_INFO_CACHES: Dict[str, dict] = {}
+_DIRTY_INFO_CACHES: Set[str] = set()
+
+# Fingerprint of the nginx config captured by the most recent backup
+_FINGERPRINT_FILE = '.last_fingerprint'
+
+# nginx_backup_<YYYYMMDD_HHMMSS>[_<description>] with the .tar.gz/.tar stem
+_NAME_RE = re.compile(r'^nginx_backup_(\d{8}_\d{6})(?:_(.+?))?(?:\.tar)?$')
+
+
+def _find_compressor(compresslevel: int = 6) -> Optional[List[str]]:
+    """
+    Find a native gzip implementation, preferring multi-threaded pigz.
+    
+    Args:
+        compresslevel: Deflate level (1-9)
+        
+    Returns:
+        Command list for the compressor, or None if neither pigz nor gzip is installed
+    """
+    pigz = shutil.which('pigz')
+    if pigz:
+        return [pigz, '-p', str(os.cpu_count() or 1), f'-{compresslevel}']
+    
+    gzip = shutil.which('gzip')
+    if gzip:
+        return [gzip, f'-{compresslevel}']
+    
+    return None
+
+
+def _fingerprint(sources: List[tuple]) -> str:
+    """
+    Hash the name, size, mtime and mode of every path under the backup sources.
+    
+    Args:
+        sources: (path, arcname) pairs that would be archived
+        
+    Returns:
+        Hex digest that changes whenever any archived entry changes
+    """
+    digest = hashlib.sha1()
+    pending = []
+    
+    for path, arcname in sources:
+        st = os.lstat(path)
+        digest.update(f"{arcname}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_mode}\n".encode())
+        if S_ISDIR(st.st_mode):
+            pending.append((str(path), arcname))
+    
+    while pending:
+        dir_path, dir_arcname = pending.pop()
+        with os.scandir(dir_path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        
+        for entry in entries:
+            st = entry.stat(follow_symlinks=False)
+            arcname = f"{dir_arcname}/{entry.name}"
+            digest.update(f"{arcname}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_mode}\n".encode())
+            if entry.is_dir(follow_symlinks=False):
+                pending.append((entry.path, arcname))
+    
+    return digest.hexdigest()
+
+
+def _iter_tree(path: Path, arcname: str):
+    """
+    Yield (path, arcname) for path and everything below it, parents first.
+    
+    Uses os.scandir so entry types come from the directory listing; symlinks
+    are yielded but never followed.
+    
+    Args:
+        path: File or directory to walk
+        arcname: Name of path inside the archive
+    """
+    yield str(path), arcname
+    
+    if path.is_symlink() or not path.is_dir():
+        return
+    
+    pending = [(str(path), arcname)]
+    while pending:
+        dir_path, dir_arcname = pending.pop()
+        with os.scandir(dir_path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        
+        subdirs = []
+        for entry in entries:
+            entry_arcname = f"{dir_arcname}/{entry.name}"
+            yield entry.path, entry_arcname
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append((entry.path, entry_arcname))
+        
+        # Reversed so the stack visits subdirectories in name order
+        pending.extend(reversed(subdirs))
+
+
+def _save_info_caches():
+    """Persist every changed archive contents cache; registered once with atexit."""
+    for backup_dir in list(_DIRTY_INFO_CACHES):
+        try:
+            with open(Path(backup_dir) / _INFO_CACHE_FILE, 'w') as f:
+                json.dump(_INFO_CACHES[backup_dir], f)
+            _DIRTY_INFO_CACHES.discard(backup_dir)
+        except OSError as e:
+            logger.debug(f"Failed to save backup info cache: {e}")
+
+
+atexit.register(_save_info_caches)
+
 
 class BackupManager:
     """Manage configuration backups for nginx sites."""
@@ -27,20 +158,79 @@ class BackupManager:
         """
         self.backup_dir = backup_dir
         self.backup_dir.mkdir(parents=True, exist_ok=True)
+        
+        cache_key = str(self.backup_dir)
+        if cache_key not in _INFO_CACHES:
+            _INFO_CACHES[cache_key] = self._load_info_cache()
+        self._info_cache = _INFO_CACHES[cache_key]
+    
+    def _load_info_cache(self) -> dict:
+        """
+        Load cached archive contents, dropping entries for deleted backups.
+        
+        Returns:
+            Dictionary mapping backup path to its size, mtime and contents
+        """
+        try:
+            with open(self.backup_dir / _INFO_CACHE_FILE) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        
+        if not isinstance(cache, dict):
+            return {}
+        
+        return {path: entry for path, entry in cache.items() if os.path.exists(path)}
+    
+    def _read_fingerprint(self) -> Optional[dict]:
+        """Load the fingerprint recorded by the last backup, if any."""
+        try:
+            with open(self.backup_dir / _FINGERPRINT_FILE) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        return state if isinstance(state, dict) else None
     
-    def create_backup(self, description: str = "") -> Path:
+    def _write_fingerprint(self, fingerprint: str, backup_path: Path, compress: bool):
+        """Atomically record the fingerprint and format of the backup just written."""
+        state_path = self.backup_dir / _FINGERPRINT_FILE
+        tmp_path = state_path.with_name(state_path.name + '.tmp')
+        
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'fingerprint': fingerprint, 'backup': backup_path.name,
+                           'compress': compress}, f)
+            os.replace(tmp_path, state_path)
+        except OSError as e:
+            logger.debug(f"Failed to record backup fingerprint: {e}")
+    
+    def create_backup(self, description: str = "", compresslevel: int = 6,
+                      compress: bool = True, force: bool = False) -> Path:
         """
         Create timestamped backup of nginx configs.
         
+        If nothing has changed since the last unforced backup written in the
+        same format, that backup is returned instead of writing an identical
+        archive. Forced backups are never reused.
+        
         Args:
             description: Optional description to include in backup name
+            compresslevel: Gzip compression level (1-9)
+            compress: Write a gzipped .tar.gz archive; when False a plain .tar
+                is written, which is much faster for short-lived backups
+            force: Always write a new archive, even if nothing changed
             
         Returns:
-            Path to created backup file
+            Path to created (or reused) backup file
             
         Raises:
+            ValueError: If compresslevel is out of range
             IOError: If backup creation fails
         """
+        if not 1 <= compresslevel <= 9:
+            raise ValueError(f"Invalid compression level {compresslevel}, expected 1-9")
+        
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_name = f"nginx_backup_{timestamp}"
         if description:
@@ -48,35 +238,84 @@ class BackupManager:
             safe_description = description.replace(' ', '_').replace('/', '_')
             backup_name += f"_{safe_description}"
         
-        backup_path = self.backup_dir / f"{backup_name}.tar.gz"
+        suffix = '.tar.gz' if compress else '.tar'
+        backup_path = self.backup_dir / f"{backup_name}{suffix}"
+        # Write under a temporary name and rename into place once complete, so
+        # an interrupted backup never shows up as a truncated archive
+        tmp_path = backup_path.with_name(backup_path.name + '.tmp')
+        
+        # Collect the nginx paths that exist on this host
+        sources = []
+        for path_str, arcname in (('/etc/nginx/sites-available', 'sites-available'),
+                                  ('/etc/nginx/sites-enabled', 'sites-enabled'),
+                                  ('/etc/nginx/nginx.conf', 'nginx.conf')):
+            path = Path(path_str)
+            if path.exists():
+                sources.append((path, arcname))
+        
+        # Forced backups neither reuse nor record a fingerprint, so skip hashing
+        fingerprint = None
+        if not force:
+            try:
+                fingerprint = _fingerprint(sources)
+            except OSError as e:
+                logger.debug(f"Failed to fingerprint nginx config: {e}")
+        
+        if fingerprint:
+            last = self._read_fingerprint()
+            if (last and last.get('fingerprint') == fingerprint
+                    and last.get('compress') == compress):
+                previous = self.backup_dir / str(last.get('backup'))
+                if previous.is_file():
+                    logger.info(f"No changes since last backup, reusing {previous}")
+                    return previous
         
         try:
-            with tarfile.open(backup_path, 'w:gz') as tar:
-                # Backup sites-available
-                sites_available = Path('/etc/nginx/sites-available')
-                if sites_available.exists():
-                    tar.add(sites_available, arcname='sites-available')
-                    logger.info(f"Backed up {sites_available}")
-                
-                # Backup sites-enabled (preserving symlinks)
-                sites_enabled = Path('/etc/nginx/sites-enabled')
-                if sites_enabled.exists():
-                    tar.add(sites_enabled, arcname='sites-enabled')
-                    logger.info(f"Backed up {sites_enabled}")
+            compressor = _find_compressor(compresslevel=compresslevel) if compress else None
+            tar_binary = shutil.which('tar')
+            
+            if tar_binary and sources and (compressor or not compress):
+                # Let tar stream into a native (multi-threaded if pigz) compressor
+                cmd = [tar_binary]
+                if compressor:
+                    cmd.extend(['--use-compress-program', ' '.join(compressor)])
+                cmd.extend(['-cf', str(tmp_path)])
+                for path, arcname in sources:
+                    cmd.extend(['-C', str(path.parent), arcname])
                 
-                # Backup main nginx.conf
-                nginx_conf = Path('/etc/nginx/nginx.conf')
-                if nginx_conf.exists():
-                    tar.add(nginx_conf, arcname='nginx.conf')
-                    logger.info(f"Backed up {nginx_conf}")
+                result = subprocess.run(cmd, capture_output=True, text=True)
+                if result.returncode != 0:
+                    raise IOError(result.stderr.strip() or f"tar exited with {result.returncode}")
+            else:
+                # Fall back to Python's tarfile when no native tools are available
+                with open(tmp_path, 'wb', buffering=_IO_BUFFER_SIZE) as fileobj:
+                    if compress:
+                        tar = tarfile.open(fileobj=fileobj, mode='w:gz',
+                                           compresslevel=compresslevel)
+                    else:
+                        tar = tarfile.open(fileobj=fileobj, mode='w')
+                    with tar:
+                        for path, arcname in sources:
+                            for entry_path, entry_arcname in _iter_tree(path, arcname):
+                                tar.add(entry_path, arcname=entry_arcname, recursive=False)
+            
+            os.replace(tmp_path, backup_path)
+            
+            for path, _ in sources:
+                logger.info(f"Backed up {path}")
+            
+            # Forced backups (e.g. the pre-restore safety copy) are one-offs
+            # and must not be handed back to later callers
+            if fingerprint:
+                self._write_fingerprint(fingerprint, backup_path, compress)
             
             logger.info(f"Created backup: {backup_path}")
             return backup_path
             
         except Exception as e:
             logger.error(f"Failed to create backup: {e}")
-            if backup_path.exists():
-                backup_path.unlink()
+            if tmp_path.exists():
+                tmp_path.unlink()
             raise IOError(f"Backup creation failed: {e}")
     
     def restore_backup(self, backup_path: Path) -> bool:
@@ -96,45 +335,36 @@ class BackupManager:
         if not backup_path.exists():
             raise FileNotFoundError(f"Backup not found: {backup_path}")
         
-        # Extract to temporary directory first for safety
-        temp_dir = Path('/tmp/nginx_restore')
-        temp_dir.mkdir(exist_ok=True)
+        nginx_dir = Path('/etc/nginx')
         
         try:
-            # Extract backup
-            with tarfile.open(backup_path, 'r:gz') as tar:
-                tar.extractall(temp_dir)
-            
-            logger.info(f"Extracted backup to temporary directory: {temp_dir}")
-            
-            # Create safety backup of current config before restore
-            safety_backup = self.create_backup('pre_restore_safety')
-            logger.info(f"Created safety backup before restore: {safety_backup}")
-            
-            # Restore sites-available
-            sites_available_backup = temp_dir / 'sites-available'
-            if sites_available_backup.exists():
-                sites_available = Path('/etc/nginx/sites-available')
-                if sites_available.exists():
-                    shutil.rmtree(sites_available)
-                shutil.copytree(sites_available_backup, sites_available)
-                logger.info(f"Restored {sites_available}")
-            
-            # Restore sites-enabled
-            sites_enabled_backup = temp_dir / 'sites-enabled'
-            if sites_enabled_backup.exists():
-                sites_enabled = Path('/etc/nginx/sites-enabled')
-                if sites_enabled.exists():
-                    shutil.rmtree(sites_enabled)
-                shutil.copytree(sites_enabled_backup, sites_enabled, symlinks=True)
-                logger.info(f"Restored {sites_enabled}")
+            with open(backup_path, 'rb', buffering=_IO_BUFFER_SIZE) as fileobj, \
+                 tarfile.open(fileobj=fileobj, mode='r:*') as tar:
+                # Reading the member list validates the whole archive before
+                # anything in the live configuration is touched; only the
+                # managed paths are extracted, anything else in it is skipped
+                members = [
+                    member for member in tar.getmembers()
+                    if member.name.split('/', 1)[0] in _RESTORE_PATHS
+                ]
+                top_level = {member.name.split('/', 1)[0] for member in members}
+                
+                # Create safety backup of current config before restore; it is
+                # read back moments later if anything goes wrong, so skip compression
+                safety_backup = self.create_backup('pre_restore_safety', compress=False, force=True)
+                logger.info(f"Created safety backup before restore: {safety_backup}")
+                
+                # Replace the site directories wholesale so removed sites stay removed
+                for name in _RESTORE_PATHS[:2]:
+                    if name in top_level:
+                        shutil.rmtree(nginx_dir / name, ignore_errors=True)
+                
+                # Extract straight into place (symlinks in sites-enabled are preserved)
+                tar.extractall(nginx_dir, members=members, filter='tar')
             
-            # Restore nginx.conf if present
-            nginx_conf_backup = temp_dir / 'nginx.conf'
-            if nginx_conf_backup.exists():
-                nginx_conf = Path('/etc/nginx/nginx.conf')
-                shutil.copy2(nginx_conf_backup, nginx_conf)
-                logger.info(f"Restored {nginx_conf}")
+            for name in _RESTORE_PATHS:
+                if name in top_level:
+                    logger.info(f"Restored {nginx_dir / name}")
             
             logger.info(f"Successfully restored from backup: {backup_path}")
             return True
@@ -142,11 +372,6 @@ class BackupManager:
         except Exception as e:
             logger.error(f"Failed to restore backup: {e}")
             raise IOError(f"Restore operation failed: {e}")
-            
-        finally:
-            # Clean up temporary directory
-            if temp_dir.exists():
-                shutil.rmtree(temp_dir, ignore_errors=True)
     
     def list_backups(self) -> List[Path]:
         """
@@ -155,12 +380,19 @@ class BackupManager:
         Returns:
             List of Path objects for backup files
         """
-        backups = sorted(
-            self.backup_dir.glob('nginx_backup_*.tar.gz'),
-            key=lambda p: p.stat().st_mtime,
-            reverse=True
-        )
-        return backups
+        # DirEntry caches its stat result, so each backup costs one syscall;
+        # in-progress '.tmp' files fail the suffix check and are never listed
+        with os.scandir(self.backup_dir) as it:
+            entries = [
+                (entry.stat().st_mtime, entry.path)
+                for entry in it
+                if entry.name.startswith('nginx_backup_')
+                and entry.name.endswith(('.tar.gz', '.tar'))
+                and entry.is_file(follow_symlinks=False)
+            ]
+        
+        entries.sort(reverse=True)
+        return [Path(path) for _, path in entries]
     
     def cleanup_old_backups(self, keep: int = 10):
         """
@@ -182,7 +414,7 @@ class BackupManager:
         # Remove old backups
         for backup in backups[keep:]:
             try:
-                backup.unlink()
+                os.unlink(backup)
                 logger.info(f"Removed old backup: {backup.name}")
             except Exception as e:
                 logger.error(f"Failed to remove backup {backup.name}: {e}")
@@ -203,14 +435,8 @@ class BackupManager:
         stat = backup_path.stat()
         
         # Extract timestamp from filename
-        name_parts = backup_path.stem.replace('.tar', '').split('_')
-        timestamp_str = None
-        description = None
-        
-        if len(name_parts) >= 3:
-            timestamp_str = f"{name_parts[2]}_{name_parts[3]}"
-            if len(name_parts) > 4:
-                description = '_'.join(name_parts[4:])
+        match = _NAME_RE.match(backup_path.stem)
+        timestamp_str, description = match.groups() if match else (None, None)
         
         info = {
             'path': backup_path,
@@ -221,12 +447,27 @@ class BackupManager:
             'description': description
         }
         
-        # List contents
+        # List contents, reusing the cached listing while the archive is unchanged
+        key = str(backup_path)
+        cached = self._info_cache.get(key)
+        if (cached and cached.get('size') == stat.st_size
+                and cached.get('mtime') == stat.st_mtime):
+            info['contents'] = list(cached['contents'])
+            return info
+        
         try:
-            with tarfile.open(backup_path, 'r:gz') as tar:
+            with open(backup_path, 'rb', buffering=_IO_BUFFER_SIZE) as fileobj, \
+                 tarfile.open(fileobj=fileobj, mode='r:*') as tar:
                 info['contents'] = tar.getnames()
         except Exception as e:
             logger.error(f"Failed to read backup contents: {e}")
             info['contents'] = []
+        else:
+            self._info_cache[key] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'contents': list(info['contents'])
+            }
+            _DIRTY_INFO_CACHES.add(str(self.backup_dir))
         
         return info
\ No newline at end of file
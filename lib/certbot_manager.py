@@ -1,12 +1,27 @@
+import os
 import subprocess
 import re
-from pathlib import Path
-from typing import List, Tuple, Optional, Dict
+import tempfile
+import threading
+from typing import List, Tuple, Optional, Dict, Iterator
 import logging
+import time
 from datetime import datetime
 
 from .permissions import check_sudo_privileges, InsufficientPermissionsError
 
+# Seconds to wait on certbot before giving up; renewals touch every certificate
+_COMMAND_TIMEOUT = 60
+_RENEW_TIMEOUT = 300
+
+# Patterns for parsing `certbot certificates` output
+_RE_NAME = re.compile(r'Certificate Name:\s*(\S+)')
+_RE_DOMAINS = re.compile(r'Domains:\s*(.+)')
+_RE_EXPIRY = re.compile(r'Expiry Date:\s*([^\(\n]+)')
+_RE_CERTPATH = re.compile(r'Certificate Path:\s*(\S+)')
+_RE_VALID = re.compile(r'\bVALID\b')
+_RE_INVALID = re.compile(r'\b(?:INVALID|EXPIRED)\b')
+
 
 class CertbotManager:
     """Manage SSL certificates with certbot"""
@@ -14,20 +29,138 @@ class CertbotManager:
     def __init__(self, dry_run: bool = False):
         self.dry_run = dry_run
         self.logger = logging.getLogger(__name__)
+        self._cert_cache: Optional[Dict[str, Dict]] = None
+        self._cert_cache_ts: float = 0
+        self._sudo_ok: Optional[bool] = None
+    
+    def _require_sudo(self) -> Optional[str]:
+        """Check sudo privileges once per instance, returning an error message if missing"""
+        if self.dry_run or self._sudo_ok:
+            return None
+        
+        try:
+            check_sudo_privileges()
+        except InsufficientPermissionsError as e:
+            return str(e)
+        
+        self._sudo_ok = True
+        return None
+    
+    def _cert_cache_fresh(self, ttl: float = 30) -> bool:
+        """Whether the parsed `certbot certificates` output is still usable"""
+        return self._cert_cache is not None and time.monotonic() - self._cert_cache_ts < ttl
+    
+    def _invalidate_cert_cache(self):
+        """Drop cached certificate info after certbot changes state"""
+        self._cert_cache = None
+    
+    def _iter_certificates(self) -> Iterator[Dict]:
+        """
+        Stream `certbot certificates` output, yielding one dict per certificate.
+        
+        Raises:
+            subprocess.CalledProcessError: If certbot exits non-zero (after any parsed entries)
+            subprocess.TimeoutExpired: If certbot does not exit within _COMMAND_TIMEOUT seconds
+        """
+        cmd = ['certbot', 'certificates']
+        
+        # stderr goes to a temp file so a chatty certbot can't block on a full pipe
+        with tempfile.TemporaryFile(mode='w+') as stderr:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True, bufsize=1)
+            
+            # Reading stdout blocks until certbot writes or closes it, so a
+            # watchdog kills a hung certbot to enforce the deadline
+            expired = threading.Event()
+            
+            def kill_on_timeout():
+                expired.set()
+                proc.kill()
+            
+            watchdog = threading.Timer(_COMMAND_TIMEOUT, kill_on_timeout)
+            watchdog.daemon = True
+            watchdog.start()
+            try:
+                current = None
+                
+                for line in proc.stdout:
+                    # A new entry starts at each certificate name
+                    name_match = _RE_NAME.search(line)
+                    if name_match:
+                        if current:
+                            yield current
+                        current = {'name': name_match.group(1)}
+                        continue
+                    
+                    if current is None:
+                        continue
+                    
+                    # Extract domains
+                    domains_match = _RE_DOMAINS.search(line)
+                    if domains_match:
+                        current['domains'] = domains_match.group(1).split()
+                    
+                    # Extract expiry date
+                    expiry_match = _RE_EXPIRY.search(line)
+                    if expiry_match:
+                        current['expiry'] = expiry_match.group(1).strip()
+                    
+                    # Extract certificate path
+                    cert_match = _RE_CERTPATH.search(line)
+                    if cert_match:
+                        current['cert_path'] = cert_match.group(1)
+                    
+                    # Check if valid; a VALID marker anywhere in the entry wins
+                    if _RE_VALID.search(line):
+                        current['valid'] = True
+                    elif _RE_INVALID.search(line):
+                        current.setdefault('valid', False)
+                
+                returncode = proc.wait()
+                if expired.is_set():
+                    # The last entry may have been cut short
+                    raise subprocess.TimeoutExpired(cmd, _COMMAND_TIMEOUT)
+                
+                if current:
+                    yield current
+                
+                if returncode != 0:
+                    stderr.seek(0)
+                    raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr.read())
+            finally:
+                watchdog.cancel()
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+    
+    def _load_all_certs(self, ttl: float = 30) -> Dict[str, Dict]:
+        """Run `certbot certificates` once and cache the parsed result by certificate name"""
+        if self._cert_cache_fresh(ttl):
+            return self._cert_cache
+        
+        try:
+            certificates = {cert['name']: cert for cert in self._iter_certificates()}
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"Failed to list certificates: {e.stderr}")
+            return {}
+        
+        self._cert_cache = certificates
+        self._cert_cache_ts = time.monotonic()
+        return certificates
     
     def check_certificate_exists(self, domain: str) -> bool:
         """Check if certificate exists for domain"""
-        cert_path = Path(f'/etc/letsencrypt/live/{domain}/fullchain.pem')
-        return cert_path.exists()
+        # A warm cache answers without touching the filesystem; never spawn certbot here
+        if self._cert_cache_fresh() and domain in self._cert_cache:
+            return True
+        
+        return os.path.isfile(f'/etc/letsencrypt/live/{domain}/fullchain.pem')
     
     def request_certificate(self, domain: str, email: Optional[str] = None, include_www: bool = False) -> Tuple[bool, str]:
         """Request certificate for domain"""
         # Check permissions first (unless dry-run)
-        if not self.dry_run:
-            try:
-                check_sudo_privileges()
-            except InsufficientPermissionsError as e:
-                return False, str(e)
+        err = self._require_sudo()
+        if err:
+            return False, err
         
         if self.check_certificate_exists(domain):
             return True, f"Certificate already exists for {domain}"
@@ -57,8 +190,9 @@ class CertbotManager:
                 cmd,
                 capture_output=True,
                 text=True,
-                timeout=60
+                timeout=_COMMAND_TIMEOUT
             )
+            self._invalidate_cert_cache()
             
             if result.returncode == 0:
                 self.logger.info(f"Certificate obtained for {domain}")
@@ -78,43 +212,8 @@ class CertbotManager:
             return None
         
         try:
-            result = subprocess.run(
-                ['certbot', 'certificates', '-d', domain],
-                capture_output=True,
-                text=True
-            )
-            
-            if result.returncode != 0:
-                self.logger.error(f"Failed to get certificate info: {result.stderr}")
-                return None
-            
-            # Parse output for certificate info
-            output = result.stdout
-            info = {}
-            
-            # Extract expiry date
-            expiry_match = re.search(r'Expiry Date:\s*(\S+\s+\S+)', output)
-            if expiry_match:
-                info['expiry'] = expiry_match.group(1)
-            
-            # Extract certificate path
-            cert_match = re.search(r'Certificate Path:\s*(\S+)', output)
-            if cert_match:
-                info['cert_path'] = cert_match.group(1)
-            
-            # Extract domains
-            domains_match = re.search(r'Domains:\s*(.+)', output)
-            if domains_match:
-                domains_str = domains_match.group(1).strip()
-                info['domains'] = [d.strip() for d in domains_str.split()]
-            
-            # Extract validity status
-            if 'VALID' in output:
-                info['valid'] = True
-            elif 'INVALID' in output or 'EXPIRED' in output:
-                info['valid'] = False
-            
-            return info if info else None
+            info = self._load_all_certs().get(domain)
+            return dict(info) if info else None
             
         except Exception as e:
             self.logger.error(f"Failed to get certificate info: {e}")
@@ -123,11 +222,9 @@ class CertbotManager:
     def renew_certificates(self) -> Tuple[bool, str]:
         """Renew all certificates"""
         # Check permissions first (unless dry-run)
-        if not self.dry_run:
-            try:
-                check_sudo_privileges()
-            except InsufficientPermissionsError as e:
-                return False, str(e)
+        err = self._require_sudo()
+        if err:
+            return False, err
         
         cmd = ['certbot', 'renew']
         
@@ -135,7 +232,8 @@ class CertbotManager:
             cmd.append('--dry-run')
         
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=_RENEW_TIMEOUT)
+            self._invalidate_cert_cache()
             
             if result.returncode == 0:
                 self.logger.info("Certificate renewal completed successfully")
@@ -151,56 +249,7 @@ class CertbotManager:
     def list_certificates(self) -> List[Dict]:
         """List all managed certificates"""
         try:
-            result = subprocess.run(
-                ['certbot', 'certificates'],
-                capture_output=True,
-                text=True
-            )
-            
-            if result.returncode != 0:
-                self.logger.error(f"Failed to list certificates: {result.stderr}")
-                return []
-            
-            output = result.stdout
-            certificates = []
-            
-            # Split output by certificate entries
-            # Look for lines that are mostly dashes (at least 20 dashes)
-            cert_blocks = re.split(r'[\s\-]{20,}', output)
-            
-            for block in cert_blocks:
-                block = block.strip()
-                if not block or 'Certificate Name:' not in block:
-                    continue
-                
-                cert_info = {}
-                
-                # Extract certificate name
-                name_match = re.search(r'Certificate Name:\s*(\S+)', block)
-                if name_match:
-                    cert_info['name'] = name_match.group(1)
-                
-                # Extract domains
-                domains_match = re.search(r'Domains:\s*(.+)', block)
-                if domains_match:
-                    domains_str = domains_match.group(1).strip()
-                    cert_info['domains'] = [d.strip() for d in domains_str.split()]
-                
-                # Extract expiry date
-                expiry_match = re.search(r'Expiry Date:\s*([^\(]+)', block)
-                if expiry_match:
-                    cert_info['expiry'] = expiry_match.group(1).strip()
-                
-                # Check if valid
-                if 'VALID' in block:
-                    cert_info['valid'] = True
-                elif 'INVALID' in block or 'EXPIRED' in block:
-                    cert_info['valid'] = False
-                
-                if cert_info and 'name' in cert_info:
-                    certificates.append(cert_info)
-            
-            return certificates
+            return [dict(info) for info in self._load_all_certs().values()]
             
         except Exception as e:
             self.logger.error(f"Failed to list certificates: {e}")
@@ -209,20 +258,18 @@ class CertbotManager:
     def revoke_certificate(self, domain: str, reason: str = "unspecified") -> Tuple[bool, str]:
         """Revoke a certificate"""
         # Check permissions first (unless dry-run)
-        if not self.dry_run:
-            try:
-                check_sudo_privileges()
-            except InsufficientPermissionsError as e:
-                return False, str(e)
+        err = self._require_sudo()
+        if err:
+            return False, err
         
-        cert_path = Path(f'/etc/letsencrypt/live/{domain}/cert.pem')
+        cert_path = f'/etc/letsencrypt/live/{domain}/cert.pem'
         
-        if not cert_path.exists():
+        if not os.path.isfile(cert_path):
             return False, f"Certificate not found for {domain}"
         
         cmd = [
             'certbot', 'revoke',
-            '--cert-path', str(cert_path),
+            '--cert-path', cert_path,
             '--reason', reason,
             '--non-interactive'
         ]
@@ -235,8 +282,9 @@ class CertbotManager:
                 cmd,
                 capture_output=True,
                 text=True,
-                timeout=60
+                timeout=_COMMAND_TIMEOUT
             )
+            self._invalidate_cert_cache()
             
             if result.returncode == 0:
                 self.logger.info(f"Certificate revoked for {domain}")
@@ -253,11 +301,9 @@ class CertbotManager:
     def delete_certificate(self, domain: str) -> Tuple[bool, str]:
         """Delete a certificate and its renewal configuration"""
         # Check permissions first (unless dry-run)
-        if not self.dry_run:
-            try:
-                check_sudo_privileges()
-            except InsufficientPermissionsError as e:
-                return False, str(e)
+        err = self._require_sudo()
+        if err:
+            return False, err
         
         cmd = [
             'certbot', 'delete',
@@ -273,8 +319,9 @@ class CertbotManager:
                 cmd,
                 capture_output=True,
                 text=True,
-                timeout=60
+                timeout=_COMMAND_TIMEOUT
             )
+            self._invalidate_cert_cache()
             
             if result.returncode == 0:
                 self.logger.info(f"Certificate deleted for {domain}")
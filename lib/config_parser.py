@@ -5,23 +5,44 @@ This module handles loading YAML configuration files and applying
 default values to site configurations.
 """
 
+import os
+import re
 import yaml
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Mapping
 from pathlib import Path
-import copy
+from types import MappingProxyType
+
+# Prefer the LibYAML C parser when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+# Parsed documents by resolved path, stored with the (mtime_ns, size) they
+# were read at; entries are shared and must be treated as read-only
+_YAML_CACHE: Dict[str, tuple] = {}
+
+# Hostname labels, with '*' allowed for wildcard server names; ASCII only,
+# so internationalized names must be written in punycode
+_DOMAIN_RE = re.compile(r'^[A-Za-z0-9*.-]+$')
+
+# HOST:PORT or HOST:PORT/path, where HOST is a name, IPv4 address or [IPv6] literal;
+# the templates add the scheme, so targets carrying one are rejected
+_TARGET_RE = re.compile(r'^(?:\[[0-9A-Fa-f:.]+\]|[A-Za-z0-9.-]+):\d{1,5}(?:/\S*)?$')
 
 
 class ConfigParser:
     """Parse and validate sites configuration with defaults."""
     
-    DEFAULT_CONFIG = {
+    # Read-only so the shared class attribute can't be altered by one caller
+    DEFAULT_CONFIG = MappingProxyType({
         'enabled': True,
         'ws': False,
         'route': '/',
         'proxy_buffering': 'off',
         'include_www': False,
         'backend_https': False
-    }
+    })
     
     def __init__(self, config_path: Path):
         """
@@ -35,14 +56,60 @@ class ConfigParser:
             yaml.YAMLError: If the YAML file is invalid
         """
         self.config_path = config_path
-        self.raw_config = self._load_yaml()
+        self._apply_config(self._load_yaml())
+    
+    @classmethod
+    def from_string(cls, text: str) -> 'ConfigParser':
+        """
+        Create a parser from YAML text instead of a file.
+        
+        The document is parsed directly and never cached; config_path is None.
+        
+        Args:
+            text: YAML configuration document
+        
+        Returns:
+            ConfigParser for the document
+        
+        Raises:
+            yaml.YAMLError: If the YAML is invalid
+        """
+        try:
+            config = yaml.load(text, Loader=_Loader)
+        except yaml.YAMLError as e:
+            raise yaml.YAMLError(f"Invalid YAML configuration: {e}")
+        
+        parser = cls.__new__(cls)
+        parser.config_path = None
+        parser._apply_config(config if config is not None else {})
+        return parser
+    
+    def _apply_config(self, raw_config: Dict):
+        """
+        Apply defaults to a parsed document and index its sites.
+        
+        Args:
+            raw_config: Parsed YAML document
+        """
+        self.raw_config = raw_config
         self.defaults = self._parse_defaults()
+        # Malformed upstreams found while parsing, reported by validate_config
+        self._upstream_errors: Dict[str, List[str]] = {}
         self.sites = self._parse_sites()
+        self._enabled_sites = MappingProxyType({
+            domain: config
+            for domain, config in self.sites.items()
+            if config.get('enabled', True)
+        })
     
     def _load_yaml(self) -> Dict:
         """
         Load YAML configuration file.
         
+        Parsed documents are cached per process and reused while the file's
+        mtime and size are unchanged. The returned dictionary may be shared
+        with other parsers and must not be modified.
+        
         Returns:
             Dictionary containing the parsed YAML
             
@@ -50,17 +117,32 @@ class ConfigParser:
             FileNotFoundError: If the configuration file doesn't exist
             yaml.YAMLError: If the YAML file is invalid
         """
-        if not self.config_path.exists():
+        try:
+            key = str(self.config_path.resolve())
+            st = os.stat(key)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Configuration file not found: {self.config_path}")
+        
+        cached = _YAML_CACHE.get(key)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        
+        try:
+            data = self.config_path.read_bytes()
+        except FileNotFoundError:
             raise FileNotFoundError(f"Configuration file not found: {self.config_path}")
         
-        with open(self.config_path, 'r') as f:
-            try:
-                config = yaml.safe_load(f)
-                if config is None:
-                    return {}
-                return config
-            except yaml.YAMLError as e:
-                raise yaml.YAMLError(f"Invalid YAML in {self.config_path}: {e}")
+        # Hand the raw bytes to the loader; LibYAML decodes them in C
+        try:
+            config = yaml.load(data, Loader=_Loader)
+        except yaml.YAMLError as e:
+            raise yaml.YAMLError(f"Invalid YAML in {self.config_path}: {e}")
+        
+        if config is None:
+            config = {}
+        
+        _YAML_CACHE[key] = (st.st_mtime_ns, st.st_size, config)
+        return config
     
     def _parse_defaults(self) -> Dict:
         """
@@ -69,80 +151,68 @@ class ConfigParser:
         Returns:
             Dictionary containing merged defaults
         """
-        user_defaults = self.raw_config.get('defaults', {})
+        user_defaults = self.raw_config.get('defaults') or {}
         return {**self.DEFAULT_CONFIG, **user_defaults}
     
     def _parse_sites(self) -> Dict:
         """
         Parse sites with defaults applied.
         
+        Applies both site-level defaults and upstream-level defaults to a copy
+        of each site configuration, leaving raw_config untouched. Upstreams
+        that are not a list of mappings are dropped and recorded for
+        validate_config to report.
+        
         Returns:
             Dictionary of site configurations with defaults applied
         """
-        sites = {}
-        for domain, config in self.raw_config.get('sites', {}).items():
-            if config is None:
-                config = {}
-            sites[domain] = self._apply_defaults(config)
-        return sites
-    
-    def _apply_defaults(self, site_config: Dict) -> Dict:
-        """
-        Apply defaults to site configuration.
-        
-        This method applies both site-level defaults and port-level defaults.
+        defaults = self.defaults
+        default_proxy_buffering = defaults.get('proxy_buffering', 'off')
+        site_defaults = {
+            'enabled': defaults['enabled'],
+            'include_www': defaults['include_www'],
+            'backend_https': defaults['backend_https']
+        }
+        upstream_defaults = {
+            'route': defaults['route'],
+            'ws': defaults['ws'],
+            'enabled': True,
+            'proxy_buffering': default_proxy_buffering
+        }
         
-        Args:
-            site_config: Raw site configuration from YAML
+        sites = {}
+        for domain, site_config in (self.raw_config.get('sites') or {}).items():
+            # Merging into new dicts leaves the (cached) raw document intact
+            config = {**site_defaults, **site_config} if site_config else dict(site_defaults)
             
-        Returns:
-            Site configuration with all defaults applied
-        """
-        # Make a deep copy to avoid modifying the original
-        config = copy.deepcopy(site_config) if site_config else {}
-        
-        # Apply site-level defaults
-        if 'enabled' not in config:
-            config['enabled'] = self.defaults['enabled']
-        
-        if 'include_www' not in config:
-            config['include_www'] = self.defaults['include_www']
-        
-        if 'backend_https' not in config:
-            config['backend_https'] = self.defaults['backend_https']
-        
-        # Apply defaults to upstreams if they exist
-        if 'upstreams' in config and isinstance(config['upstreams'], list):
-            for upstream_config in config['upstreams']:
-                # Apply upstream-level defaults
-                if 'route' not in upstream_config:
-                    upstream_config['route'] = self.defaults['route']
-                
-                if 'ws' not in upstream_config:
-                    upstream_config['ws'] = self.defaults['ws']
-                
-                if 'enabled' not in upstream_config:
-                    upstream_config['enabled'] = True
+            if 'upstreams' in config:
+                upstreams = config['upstreams']
+                if not isinstance(upstreams, list):
+                    self._upstream_errors.setdefault(domain, []).append(
+                        f"{domain}: 'upstreams' must be a list")
+                    upstreams = []
                 
-                if 'proxy_buffering' not in upstream_config:
-                    upstream_config['proxy_buffering'] = self.defaults.get('proxy_buffering', 'off')
+                merged_upstreams = []
+                for i, upstream_config in enumerate(upstreams):
+                    if not isinstance(upstream_config, dict):
+                        self._upstream_errors.setdefault(domain, []).append(
+                            f"{domain}: upstream config {i} must be a dictionary")
+                        continue
+                    
+                    upstream_config = {**upstream_defaults, **upstream_config}
+                    
+                    # Ensure headers is a dict, copied so callers can't alter the cached one
+                    headers = upstream_config.get('headers')
+                    upstream_config['headers'] = dict(headers) if isinstance(headers, dict) else {}
+                    merged_upstreams.append(upstream_config)
+                config['upstreams'] = merged_upstreams
                 
-                # Ensure headers is a dict
-                if 'headers' not in upstream_config:
-                    upstream_config['headers'] = {}
-                elif not isinstance(upstream_config['headers'], dict):
-                    upstream_config['headers'] = {}
-        
-        # Handle root-only sites (static sites)
-        if 'root' in config and 'upstreams' not in config:
-            # Static site with no proxy configuration
-            pass
-        
-        # Apply proxy_buffering default at site level if not specified
-        if 'proxy_buffering' not in config and 'upstreams' in config:
-            config['proxy_buffering'] = self.defaults.get('proxy_buffering', 'off')
+                # Apply proxy_buffering default at site level if not specified
+                config.setdefault('proxy_buffering', default_proxy_buffering)
+            
+            sites[domain] = config
         
-        return config
+        return sites
     
     def get_site(self, domain: str) -> Optional[Dict]:
         """
@@ -156,18 +226,16 @@ class ConfigParser:
         """
         return self.sites.get(domain)
     
-    def get_enabled_sites(self) -> Dict[str, Dict]:
+    def get_enabled_sites(self) -> Mapping[str, Dict]:
         """
         Get all enabled sites.
         
+        The mapping is built once when the configuration is loaded.
+        
         Returns:
-            Dictionary of enabled site configurations
+            Read-only mapping of enabled site configurations
         """
-        return {
-            domain: config 
-            for domain, config in self.sites.items() 
-            if config.get('enabled', True)
-        }
+        return self._enabled_sites
     
     def validate_config(self) -> List[str]:
         """
@@ -177,38 +245,31 @@ class ConfigParser:
             List of validation error messages (empty if valid)
         """
         errors = []
+        add_error = errors.append
         
         for domain, config in self.sites.items():
-            # Check for valid domain format (basic check)
-            if not domain or ' ' in domain:
-                errors.append(f"Invalid domain name: '{domain}'")
+            # Check for valid domain format
+            if not isinstance(domain, str) or not _DOMAIN_RE.match(domain):
+                add_error(f"Invalid domain name: '{domain}'")
             
-            # Check upstreams configuration
-            if 'upstreams' in config:
-                if not isinstance(config['upstreams'], list):
-                    errors.append(f"{domain}: 'upstreams' must be a list")
+            # Check upstreams configuration; entries that were not mappings
+            # were dropped by _parse_sites and are reported from there
+            errors.extend(self._upstream_errors.get(domain, ()))
+            for i, upstream_config in enumerate(config.get('upstreams', ())):
+                # Check for required 'target' field
+                if 'target' not in upstream_config:
+                    add_error(f"{domain}: upstream config {i} missing 'target' field")
                 else:
-                    for i, upstream_config in enumerate(config['upstreams']):
-                        if not isinstance(upstream_config, dict):
-                            errors.append(f"{domain}: upstream config {i} must be a dictionary")
-                            continue
-                        
-                        # Check for required 'target' field
-                        if 'target' not in upstream_config:
-                            errors.append(f"{domain}: upstream config {i} missing 'target' field")
-                        else:
-                            # Validate target format (basic check)
-                            target = upstream_config['target']
-                            if not isinstance(target, str) or ':' not in target:
-                                errors.append(f"{domain}: invalid target format '{target}' (expected IP:PORT or IP:PORT/path)")
+                    target = upstream_config['target']
+                    if not isinstance(target, str) or not _TARGET_RE.match(target):
+                        add_error(f"{domain}: invalid target format '{target}' (expected IP:PORT or IP:PORT/path)")
             
             # Check root configuration
-            if 'root' in config:
-                if not isinstance(config['root'], str):
-                    errors.append(f"{domain}: 'root' must be a string path")
+            if 'root' in config and not isinstance(config['root'], str):
+                add_error(f"{domain}: 'root' must be a string path")
             
             # Check that site has either 'upstreams' or 'root'
             if 'upstreams' not in config and 'root' not in config:
-                errors.append(f"{domain}: site must have either 'upstreams' or 'root' configuration")
+                add_error(f"{domain}: site must have either 'upstreams' or 'root' configuration")
         
         return errors
\ No newline at end of file
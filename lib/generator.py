@@ -7,8 +7,35 @@ using Jinja2 templates for consistent and maintainable output.
 
 from jinja2 import Environment, FileSystemLoader, TemplateNotFound
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Iterable
+import os
 import re
+from functools import lru_cache
+
+
+@lru_cache(maxsize=256)
+def _websocket_route(base_route: str) -> str:
+    """
+    Compute the WebSocket route for a base route.
+    
+    Sites commonly share routes such as '/' and '/api/', so results are memoized.
+    
+    Args:
+        base_route: The base route path
+        
+    Returns:
+        WebSocket route path
+    """
+    # If the route is already root, WebSocket connections often use /ws/
+    if base_route == '/':
+        return '/ws/'
+    
+    # For other routes, append ws/ 
+    # e.g., /api/ becomes /api/ws/
+    if base_route.endswith('/'):
+        return f"{base_route}ws/"
+    else:
+        return f"{base_route}/ws/"
 
 
 class NginxGenerator:
@@ -28,11 +55,19 @@ class NginxGenerator:
             raise FileNotFoundError(f"Template directory not found: {template_dir}")
         
         self.template_dir = template_dir
+        # Templates don't change during a run: skip the per-lookup mtime
+        # checks and never evict compiled templates
         self.env = Environment(
             loader=FileSystemLoader(template_dir),
             trim_blocks=True,
-            lstrip_blocks=True
+            lstrip_blocks=True,
+            auto_reload=False,
+            cache_size=-1
         )
+        self._server_template = None
+        # Certificate presence per domain; certbot runs after generation, so
+        # the answer can't change while a generator instance is in use
+        self._ssl_cache: Dict[str, bool] = {}
     
     def generate_site(self, domain: str, config: Dict) -> str:
         """
@@ -48,16 +83,18 @@ class NginxGenerator:
         Raises:
             TemplateNotFound: If required template files are missing
         """
-        try:
-            template = self.env.get_template('server-block.j2')
-        except TemplateNotFound as e:
-            raise TemplateNotFound(f"Required template not found: {e}")
+        # Loaded on first use so a missing template surfaces here, not in __init__
+        if self._server_template is None:
+            try:
+                self._server_template = self.env.get_template('server-block.j2')
+            except TemplateNotFound as e:
+                raise TemplateNotFound(f"Required template not found: {e}")
         
         # Prepare template context
         context = self._prepare_context(domain, config)
         
         # Render template
-        return template.render(**context)
+        return self._server_template.render(**context)
     
     def _prepare_context(self, domain: str, config: Dict) -> Dict:
         """
@@ -138,16 +175,22 @@ class NginxGenerator:
         if not config.get('upstreams'):
             return locations
         
+        get_websocket_route = self._get_websocket_route
+        
         for upstream_config in config['upstreams']:
             if not upstream_config.get('enabled', True):
                 continue
             
+            route = upstream_config.get('route', '/')
+            target = upstream_config['target']
+            headers = upstream_config.get('headers', {})
+            
             # Standard location for the route
             location = {
-                'route': upstream_config.get('route', '/'),
-                'target': upstream_config['target'],
+                'route': route,
+                'target': target,
                 'websocket': False,
-                'headers': upstream_config.get('headers', {})
+                'headers': headers
             }
             locations.append(location)
             
@@ -155,16 +198,16 @@ class NginxGenerator:
             if upstream_config.get('ws', False):
                 # For WebSocket support, we need both regular and WebSocket locations
                 # The WebSocket location typically handles /ws/ path
-                ws_location = {
-                    'route': self._get_websocket_route(upstream_config.get('route', '/')),
-                    'target': upstream_config['target'],
-                    'websocket': True,
-                    'headers': upstream_config.get('headers', {})
-                }
+                ws_route = get_websocket_route(route)
                 
                 # Only add if it's different from the main route
-                if ws_location['route'] != location['route']:
-                    locations.append(ws_location)
+                if ws_route != route:
+                    locations.append({
+                        'route': ws_route,
+                        'target': target,
+                        'websocket': True,
+                        'headers': headers
+                    })
                 else:
                     # If the main route is for WebSocket, mark it as such
                     location['websocket'] = True
@@ -181,16 +224,7 @@ class NginxGenerator:
         Returns:
             WebSocket route path
         """
-        # If the route is already root, WebSocket connections often use /ws/
-        if base_route == '/':
-            return '/ws/'
-        
-        # For other routes, append ws/ 
-        # e.g., /api/ becomes /api/ws/
-        if base_route.endswith('/'):
-            return f"{base_route}ws/"
-        else:
-            return f"{base_route}/ws/"
+        return _websocket_route(base_route)
     
     def _check_ssl_exists(self, domain: str) -> bool:
         """
@@ -202,13 +236,42 @@ class NginxGenerator:
         Returns:
             True if SSL certificates exist, False otherwise (or if permission denied)
         """
+        cached = self._ssl_cache.get(domain)
+        if cached is not None:
+            return cached
+        
         cert_path = Path(f'/etc/letsencrypt/live/{domain}/fullchain.pem')
         try:
-            return cert_path.exists()
+            exists = cert_path.exists()
         except PermissionError:
             # If we can't check due to permissions, assume no SSL for dry-run purposes
             # This allows dry-run to work without sudo privileges
-            return False
+            exists = False
+        
+        self._ssl_cache[domain] = exists
+        return exists
+    
+    def prime_ssl_cache(self, domains: Iterable[str]):
+        """
+        Record domains without certificates using a single directory listing.
+        
+        Domains with a live certificate directory are left for
+        _check_ssl_exists to confirm individually.
+        
+        Args:
+            domains: Domain names about to be generated
+        """
+        try:
+            live = set(os.listdir('/etc/letsencrypt/live'))
+        except (FileNotFoundError, PermissionError):
+            # No certificates, or unreadable (treated as no SSL, as in _check_ssl_exists)
+            live = set()
+        except OSError:
+            return
+        
+        for domain in domains:
+            if domain not in live:
+                self._ssl_cache.setdefault(domain, False)
     
     def generate_all_sites(self, sites_config: Dict[str, Dict]) -> Dict[str, str]:
         """
@@ -222,10 +285,14 @@ class NginxGenerator:
         """
         results = {}
         
-        for domain, config in sites_config.items():
-            if not config.get('enabled', True):
-                continue
-            
+        enabled = {
+            domain: config
+            for domain, config in sites_config.items()
+            if config.get('enabled', True)
+        }
+        self.prime_ssl_cache(enabled)
+        
+        for domain, config in enabled.items():
             try:
                 results[domain] = self.generate_site(domain, config)
             except Exception as e:
@@ -1,7 +1,27 @@
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional
 
+# Tokens inside a server block: a location opening, its first proxy_pass,
+# a websocket Upgrade header, and the closing brace that ends the location
+# (location bodies end at the first '}', as nested braces are not tracked).
+# The proxy_pass target is captured in a lookahead so text it spans is
+# still scanned for other tokens
+_BLOCK_TOKEN_RE = re.compile(
+    r'(?P<location>location\s+(?P<route>[^\s{]+)\s*{)'
+    r'|proxy_pass\s+http://(?=(?P<target>[^;}]+);)'
+    r'|(?P<upgrade>proxy_set_header Upgrade)'
+    r'|(?P<close>})'
+)
+
+# A 'server {' opening at the start of a line (so commented-out blocks are skipped)
+_SERVER_START_RE = re.compile(r'^[ \t]*server\s*\{', re.MULTILINE)
+
+# Directive patterns used when parsing server blocks
+_ROOT_RE = re.compile(r'root\s+([^;]+);')
+
 
 class NginxMigrator:
     """Migrate existing nginx configs to YAML format"""
@@ -12,14 +32,20 @@ class NginxMigrator:
     
     def migrate_all(self) -> Dict:
         """Migrate all sites to configuration dict"""
-        for config_file in self.sites_dir.glob('*'):
-            if config_file.name == 'default':
-                continue
-            
-            domain = config_file.name
-            config = self._parse_nginx_config(config_file)
-            if config:
-                self.sites[domain] = config
+        with os.scandir(self.sites_dir) as it:
+            # Skip the default site and directories
+            config_files = [
+                Path(entry.path) for entry in it
+                if entry.name != 'default' and entry.is_file()
+            ]
+        
+        # Overlap the blocking file reads and stats across files;
+        # map() keeps results in directory order
+        if config_files:
+            with ThreadPoolExecutor(max_workers=min(32, len(config_files))) as executor:
+                for config_file, config in zip(config_files, executor.map(self._parse_nginx_config, config_files)):
+                    if config:
+                        self.sites[config_file.name] = config
         
         return {
             'defaults': self._extract_defaults(),
@@ -57,29 +83,44 @@ class NginxMigrator:
     
     def _extract_server_blocks(self, content: str) -> List[str]:
         """Extract server blocks from nginx config"""
-        # Regex to match server blocks with balanced braces
+        # Jump between braces with str.find, tracking nesting depth; each block
+        # spans from the start of its 'server {' line to the end of the line
+        # holding the matching close brace
         blocks = []
-        lines = content.split('\n')
-        current_block = []
-        brace_count = 0
-        in_server_block = False
+        pos = 0
         
-        for line in lines:
-            stripped = line.strip()
+        while True:
+            match = _SERVER_START_RE.search(content, pos)
+            if not match:
+                break
             
-            if stripped.startswith('server {'):
-                in_server_block = True
-                current_block = [line]
-                brace_count = 1
-            elif in_server_block:
-                current_block.append(line)
-                brace_count += stripped.count('{')
-                brace_count -= stripped.count('}')
+            line_start = match.start()
+            depth = 1
+            i = match.end()
+            while depth:
+                close = content.find('}', i)
+                if close == -1:
+                    break
                 
-                if brace_count == 0:
-                    blocks.append('\n'.join(current_block))
-                    current_block = []
-                    in_server_block = False
+                opening = content.find('{', i, close)
+                if opening != -1:
+                    depth += 1
+                    i = opening + 1
+                else:
+                    depth -= 1
+                    i = close + 1
+            
+            if depth:
+                # Unterminated block; start over at the next 'server {'
+                pos = match.end()
+                continue
+            
+            line_end = content.find('\n', i)
+            if line_end == -1:
+                line_end = len(content)
+            
+            blocks.append(content[line_start:line_end])
+            pos = line_end
         
         return blocks
     
@@ -92,37 +133,40 @@ class NginxMigrator:
     
     def _extract_proxy_configs(self, block: str) -> List[Dict]:
         """Extract proxy configurations from server block"""
-        configs = []
-        websocket_routes = {}  # Track websocket routes by target
+        proxied = []  # (route, upstream target, has websocket headers) in file order
+        websocket_routes = set()  # Targets with a websocket /ws/ location
         
-        # Find all location blocks
-        location_pattern = r'location\s+([^\s{]+)\s*{([^}]*)}'
-        locations = re.findall(location_pattern, block, re.DOTALL)
+        # Single scan over the block, tracking the location currently open
+        route = None
+        upstream_target = None
+        has_websocket = False
         
-        # First pass: identify all websocket routes
-        for route, location_content in locations:
-            proxy_match = re.search(r'proxy_pass\s+http://([^;]+);', location_content)
-            if not proxy_match:
-                continue
-            
-            # Extract the upstream target (could include path, e.g. "192.168.1.1:8080/api/")
-            upstream_target = proxy_match.group(1)
-            has_websocket = 'proxy_set_header Upgrade' in location_content
+        for token in _BLOCK_TOKEN_RE.finditer(block):
+            kind = token.lastgroup
             
-            if has_websocket and route == '/ws/':
-                websocket_routes[upstream_target] = True
-        
-        # Second pass: build configurations
-        for route, location_content in locations:
-            # Extract proxy_pass
-            proxy_match = re.search(r'proxy_pass\s+http://([^;]+);', location_content)
-            if not proxy_match:
+            if route is None:
+                if kind == 'location':
+                    route = token.group('route')
+                    upstream_target = None
+                    has_websocket = False
                 continue
             
-            # Extract the upstream target (could include path, e.g. "192.168.1.1:8080/api/")
-            upstream_target = proxy_match.group(1)
-            has_websocket = 'proxy_set_header Upgrade' in location_content
-            
+            if kind == 'target':
+                # Extract the upstream target (could include path, e.g. "192.168.1.1:8080/api/")
+                if upstream_target is None:
+                    upstream_target = token.group('target')
+            elif kind == 'upgrade':
+                has_websocket = True
+            elif kind == 'close':
+                if upstream_target is not None:
+                    if has_websocket and route == '/ws/':
+                        websocket_routes.add(upstream_target)
+                    proxied.append((route, upstream_target, has_websocket))
+                route = None
+        
+        # Build configurations once all websocket routes are known
+        configs = []
+        for route, upstream_target, has_websocket in proxied:
             # Skip /ws/ routes if there's a corresponding / route for the same target
             if route == '/ws/' and upstream_target in websocket_routes:
                 continue
@@ -135,7 +179,7 @@ class NginxMigrator:
             
             # Mark as websocket if this is the main route and there's a /ws/ route for same target
             # OR if this route itself has websocket headers
-            if (route == '/' and upstream_target in websocket_routes) or (has_websocket and route == '/'):
+            if route == '/' and (upstream_target in websocket_routes or has_websocket):
                 upstream_config['ws'] = True
             
             configs.append(upstream_config)
@@ -144,7 +188,7 @@ class NginxMigrator:
     
     def _extract_root(self, block: str) -> Optional[str]:
         """Extract root directive if present"""
-        match = re.search(r'root\s+([^;]+);', block)
+        match = _ROOT_RE.search(block)
         if match:
             root = match.group(1).strip()
             # Only return non-default roots
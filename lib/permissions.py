@@ -10,22 +10,28 @@ import subprocess
 from pathlib import Path
 from typing import List, Tuple
 
+# Successful probes, cached for the life of the process so a passing
+# sudo/systemctl check forks at most once; failures are re-probed, since
+# e.g. a sudo timestamp may have been refreshed in the meantime
+_SUDO_OK = False
+_SYSTEMCTL_OK = False
+
 
 class InsufficientPermissionsError(Exception):
     """Raised when insufficient permissions are detected for required operations."""
     pass
 
 
-def check_sudo_privileges() -> None:
+def _probe_sudo() -> bool:
     """
-    Check if the current process has sudo privileges.
+    Determine whether the process is root or can use passwordless sudo.
     
-    Raises:
-        InsufficientPermissionsError: If sudo privileges are not available
+    Returns:
+        True if elevated privileges are available, False otherwise
     """
-    # Method 1: Check if running as root
-    if os.getuid() == 0:
-        return
+    # Method 1: Check if running as root (no subprocess needed)
+    if os.geteuid() == 0:
+        return True
     
     # Method 2: Check if sudo is available and working
     try:
@@ -34,10 +40,27 @@ def check_sudo_privileges() -> None:
             capture_output=True,
             timeout=5
         )
-        if result.returncode == 0:
-            return
+        return result.returncode == 0
     except (subprocess.TimeoutExpired, FileNotFoundError):
-        pass
+        return False
+
+
+def check_sudo_privileges() -> None:
+    """
+    Check if the current process has sudo privileges.
+    
+    A successful check is cached for the lifetime of the process.
+    
+    Raises:
+        InsufficientPermissionsError: If sudo privileges are not available
+    """
+    global _SUDO_OK
+    
+    if not _SUDO_OK:
+        _SUDO_OK = _probe_sudo()
+    
+    if _SUDO_OK:
+        return
     
     raise InsufficientPermissionsError(
         "This command requires sudo privileges. Please run with 'sudo' or as root."
@@ -103,18 +126,25 @@ def check_systemctl_permissions() -> bool:
     """
     Check if systemctl can be used to manage nginx service.
     
+    A successful check is cached for the lifetime of the process.
+    
     Returns:
         True if systemctl can be used, False otherwise
     """
-    try:
-        result = subprocess.run(
-            ['sudo', '-n', 'systemctl', 'status', 'nginx'],
-            capture_output=True,
-            timeout=10
-        )
-        return result.returncode in [0, 3]  # 0 = running, 3 = stopped
-    except (subprocess.TimeoutExpired, FileNotFoundError):
-        return False
+    global _SYSTEMCTL_OK
+    
+    if not _SYSTEMCTL_OK:
+        try:
+            result = subprocess.run(
+                ['sudo', '-n', 'systemctl', 'status', 'nginx'],
+                capture_output=True,
+                timeout=10
+            )
+            _SYSTEMCTL_OK = result.returncode in [0, 3]  # 0 = running, 3 = stopped
+        except (subprocess.TimeoutExpired, FileNotFoundError):
+            _SYSTEMCTL_OK = False
+    
+    return _SYSTEMCTL_OK
 
 
 def validate_all_permissions() -> Tuple[bool, List[str]]:
@@ -5,27 +5,80 @@ This module provides functionality to automatically manage DNS records in AWS Ro
 based on the enabled sites in the nginx configuration.
 """
 
+import os
+import json
+import threading
 import boto3
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
 import logging
+from botocore.config import Config
 from botocore.exceptions import ClientError, NoCredentialsError
 
+# Route 53 accepts up to 1000 changes per batch; stay well under the limit
+# since a batch mixing creates and deletes counts each change separately
+_CHANGE_BATCH_SIZE = 500
+
+# Concurrent ChangeResourceRecordSets calls, matching Route 53's 5 req/s quota
+_MAX_WORKERS = 5
+
+# Let botocore back off and pace requests when Route 53 throttles, and keep
+# enough pooled connections for concurrent batch submission
+_CLIENT_CONFIG = Config(
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    max_pool_connections=20
+)
+
+
+def _zone_cache_path() -> Path:
+    """Get the file caching discovered hosted zone IDs, keyed by "<profile>:<zone name>"
+    
+    Resolved on each use so HOME is read when the cache is touched (e.g. under sudo),
+    not when the module is imported.
+    """
+    return Path.home() / '.cache' / 'nginx-configurator' / 'zone_id.json'
+
+
+@lru_cache(maxsize=8)
+def _session_for(profile_name: str):
+    """Get a shared boto3 session for an AWS profile"""
+    return boto3.Session(profile_name=profile_name)
+
+
+@lru_cache(maxsize=8)
+def _client_for(profile_name: str):
+    """Get a shared Route 53 client for an AWS profile"""
+    return _session_for(profile_name).client('route53', config=_CLIENT_CONFIG)
+
+
+def _is_missing_zone(error: ClientError) -> bool:
+    """Whether a Route 53 error means the hosted zone no longer exists"""
+    return error.response.get('Error', {}).get('Code') == 'NoSuchHostedZone'
+
 
 class Route53Manager:
     """Manage DNS records in AWS Route 53"""
     
     def __init__(self, hosted_zone_id: Optional[str] = None, profile_name: str = 'route53'):
-        self.hosted_zone_id = hosted_zone_id or self._find_hosted_zone(profile_name)
         self.profile_name = profile_name
-        self.route53 = None
         self.logger = logging.getLogger(__name__)
+        # Only a zone ID read from the local cache may be stale and worth refreshing
+        self._zone_from_cache = False
+        # Serializes refreshes when concurrent batch submissions hit a stale zone
+        self._zone_lock = threading.Lock()
+        self.hosted_zone_id = (hosted_zone_id
+                               or os.environ.get('ROUTE53_HOSTED_ZONE_ID')
+                               or self._cached_hosted_zone(profile_name))
+        self.route53 = None
+        self._records_cache = None  # Last get_existing_records result
         
     def _get_client(self):
         """Get Route 53 client with error handling"""
         if not self.route53:
             try:
-                session = boto3.Session(profile_name=self.profile_name)
-                self.route53 = session.client('route53')
+                self.route53 = _client_for(self.profile_name)
             except NoCredentialsError:
                 raise Exception(f"AWS credentials not configured for profile '{self.profile_name}'. Run 'aws configure --profile {self.profile_name}' first.")
             except Exception as e:
@@ -34,11 +87,74 @@ class Route53Manager:
                 raise Exception(f"Failed to create AWS client: {e}")
         return self.route53
         
+    def _cached_hosted_zone(self, profile_name: str) -> Optional[str]:
+        """Get hosted zone ID from the local cache, looking it up on a miss"""
+        key = f"{profile_name}:jakekausler.com."
+        cache = self._read_zone_cache()
+        
+        if cache.get(key):
+            self._zone_from_cache = True
+            return cache[key]
+        
+        zone_id = self._find_hosted_zone(profile_name)
+        cache[key] = zone_id
+        self._write_zone_cache(cache)
+        return zone_id
+        
+    def _read_zone_cache(self) -> Dict[str, str]:
+        """Read the hosted zone ID cache, treating a missing or corrupt file as empty"""
+        try:
+            cache = json.loads(_zone_cache_path().read_text())
+        except (OSError, ValueError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
+        
+    def _write_zone_cache(self, cache: Dict[str, str]):
+        """Atomically replace the hosted zone ID cache"""
+        cache_path = _zone_cache_path()
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+            tmp_path.write_text(json.dumps(cache))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            # Cache is an optimisation only
+            self.logger.debug(f"Failed to write hosted zone cache: {e}")
+        
+    def _refresh_hosted_zone(self, error: ClientError, stale_id: str) -> bool:
+        """Replace a cached hosted zone ID that Route 53 no longer knows
+        
+        Safe to call from concurrent batch submissions: the first caller looks
+        the zone up again and later callers retry with the ID it found.
+        
+        Args:
+            error: Error raised by the failed call
+            stale_id: Hosted zone ID the failed call used
+        
+        Returns: True if the call should be retried with the current hosted zone ID
+        """
+        if not _is_missing_zone(error):
+            return False
+        
+        with self._zone_lock:
+            if self.hosted_zone_id != stale_id:
+                return True  # Already refreshed by another call
+            if not self._zone_from_cache:
+                return False
+            
+            self.logger.info(f"Cached hosted zone {stale_id} no longer exists, looking it up again")
+            cache = self._read_zone_cache()
+            cache.pop(f"{self.profile_name}:jakekausler.com.", None)
+            self._write_zone_cache(cache)
+            
+            self._zone_from_cache = False
+            self.hosted_zone_id = self._cached_hosted_zone(self.profile_name)
+            return True
+        
     def _find_hosted_zone(self, profile_name: str) -> Optional[str]:
         """Find hosted zone ID for jakekausler.com"""
         try:
-            session = boto3.Session(profile_name=profile_name)
-            client = session.client('route53')
+            client = _client_for(profile_name)
             response = client.list_hosted_zones()
             for zone in response['HostedZones']:
                 if zone['Name'] == 'jakekausler.com.':
@@ -53,196 +169,277 @@ class Route53Manager:
                 raise Exception(f"AWS profile '{profile_name}' not found. Run 'aws configure --profile {profile_name}' first.")
             raise Exception(f"Failed to create AWS client: {e}")
 
+    def iter_records(self) -> Iterator[Tuple[str, str, Dict]]:
+        """Lazily yield (name, value, full_record) for jakekausler.com A records
+        
+        The value is the IP address for plain A records and "ALIAS:<target>"
+        for ALIAS records. Pages are fetched only as the caller consumes them.
+        """
+        client = self._get_client()
+        
+        while True:
+            zone_id = self.hosted_zone_id
+            try:
+                yield from self._iter_zone_records(client, zone_id)
+                return
+            except ClientError as e:
+                # A missing zone fails on the first page, before anything is yielded
+                if not self._refresh_hosted_zone(e, zone_id):
+                    raise Exception(f"Failed to get existing records: {e}")
+
+    def _iter_zone_records(self, client, zone_id: str) -> Iterator[Tuple[str, str, Dict]]:
+        """Page through the hosted zone's jakekausler.com A records for iter_records"""
+        # Records are listed in reversed-label order, so starting at the
+        # apex yields jakekausler.com and then its whole subtree
+        paginator = client.get_paginator('list_resource_record_sets')
+        pages = paginator.paginate(
+            HostedZoneId=zone_id,
+            StartRecordName='jakekausler.com.',
+            StartRecordType='A'
+        )
+        for page in pages:
+            for record in page['ResourceRecordSets']:
+                name = record['Name'].rstrip('.')
+                if name != 'jakekausler.com' and not name.endswith('.jakekausler.com'):
+                    return  # Left the jakekausler.com subtree
+                
+                if record['Type'] != 'A':
+                    continue
+                
+                # Handle regular A records with IP addresses
+                if 'ResourceRecords' in record and len(record['ResourceRecords']) > 0:
+                    yield name, record['ResourceRecords'][0]['Value'], record
+                
+                # Handle ALIAS records pointing to other domains
+                elif 'AliasTarget' in record:
+                    alias_target = record['AliasTarget']['DNSName'].rstrip('.')
+                    yield name, f"ALIAS:{alias_target}", record
+
     def get_existing_records(self) -> Dict[str, str]:
         """Get existing A records and ALIAS records from Route 53"""
-        client = self._get_client()
         records = {}
-        self._full_records = {}  # Store full record details for accurate deletion
+        full_records = {}  # Full record details for accurate deletion
+        for name, value, record in self.iter_records():
+            records[name] = value
+            full_records[name] = record
         
-        try:
-            paginator = client.get_paginator('list_resource_record_sets')
-            for page in paginator.paginate(HostedZoneId=self.hosted_zone_id):
-                for record in page['ResourceRecordSets']:
-                    if record['Type'] == 'A':
-                        name = record['Name'].rstrip('.')
-                        
-                        # Store full record for accurate deletion
-                        self._full_records[name] = record
-                        
-                        # Handle regular A records with IP addresses
-                        if 'ResourceRecords' in record and len(record['ResourceRecords']) > 0:
-                            ip = record['ResourceRecords'][0]['Value']
-                            records[name] = ip
-                        
-                        # Handle ALIAS records pointing to other domains
-                        elif 'AliasTarget' in record:
-                            alias_target = record['AliasTarget']['DNSName'].rstrip('.')
-                            records[name] = f"ALIAS:{alias_target}"
-            return records
-        except ClientError as e:
-            raise Exception(f"Failed to get existing records: {e}")
+        self._full_records = full_records
+        self._records_cache = records
+        return records
+
+    def _get_record(self, name: str, rtype: str) -> Optional[Dict]:
+        """Get a single record set by exact name and type"""
+        client = self._get_client()
+        
+        while True:
+            zone_id = self.hosted_zone_id
+            try:
+                response = client.list_resource_record_sets(
+                    HostedZoneId=zone_id,
+                    StartRecordName=name + '.',
+                    StartRecordType=rtype,
+                    MaxItems='1'
+                )
+                break
+            except ClientError as e:
+                if not self._refresh_hosted_zone(e, zone_id):
+                    raise Exception(f"Failed to get {rtype} record for {name}: {e}")
+        
+        # The listing starts at the requested position, so the first record
+        # is the next one in sort order when the requested one doesn't exist
+        for record in response['ResourceRecordSets'][:1]:
+            if record['Name'].rstrip('.') == name and record['Type'] == rtype:
+                return record
+        return None
 
     def get_main_domain_ip(self) -> str:
         """Get current IP of jakekausler.com A record"""
-        records = self.get_existing_records()
-        if 'jakekausler.com' not in records:
+        if self._records_cache is not None:
+            # Reuse a listing already fetched by get_existing_records
+            main_record = self._records_cache.get('jakekausler.com')
+            if main_record is None:
+                raise Exception("jakekausler.com A record not found")
+            if main_record.startswith('ALIAS:'):
+                raise Exception("jakekausler.com is an ALIAS record, expected A record with IP address")
+            return main_record
+        
+        record = self._get_record('jakekausler.com', 'A')
+        if record is None:
             raise Exception("jakekausler.com A record not found")
         
-        main_record = records['jakekausler.com']
-        if main_record.startswith('ALIAS:'):
+        if 'AliasTarget' in record or not record.get('ResourceRecords'):
             raise Exception("jakekausler.com is an ALIAS record, expected A record with IP address")
         
-        return main_record
+        return record['ResourceRecords'][0]['Value']
 
-    def sync_dns_records(self, enabled_domains: List[str]) -> Tuple[int, int]:
+    def sync_dns_records(self, enabled_domains: List[str], create_only: bool = False) -> Tuple[int, int]:
         """Sync DNS records with enabled sites
         
         Args:
             enabled_domains: List of domain names that should have DNS records
+            create_only: Upsert ALIAS records for all enabled domains without listing
+                existing records; nothing is deleted. Existing records for those
+                names are overwritten, and the first count is then the number
+                of records upserted rather than newly created
         
         Returns: (created_count, deleted_count)
         """
-        current_records = self.get_existing_records()
-        
         # Preserve essential records
         essential_records = {'jakekausler.com'}
         
         # Determine what should exist (only enabled jakekausler.com subdomains)
-        target_records = essential_records.copy()
-        for domain in enabled_domains:
-            if domain.endswith('.jakekausler.com') or domain == 'jakekausler.com':
-                target_records.add(domain)
-        
-        # Find records to create and delete (only process jakekausler.com domains)
-        jakekausler_records = {
-            domain: value for domain, value in current_records.items() 
+        target_records = essential_records | {
+            domain for domain in enabled_domains
             if domain == 'jakekausler.com' or domain.endswith('.jakekausler.com')
         }
         
-        to_create = target_records - set(jakekausler_records.keys())
-        to_delete = set(jakekausler_records.keys()) - target_records
+        if create_only:
+            # UPSERT is idempotent, so existing records need not be listed
+            current_records = {}
+            to_create = target_records
+            to_delete = set()
+        else:
+            current_records = self.get_existing_records()
+            
+            # Find records to create and delete (only process jakekausler.com domains)
+            current_set = {
+                domain for domain in current_records
+                if domain == 'jakekausler.com' or domain.endswith('.jakekausler.com')
+            }
+            
+            to_create = target_records - current_set
+            to_delete = current_set - target_records
+        
+        # Create missing records as ALIAS records pointing to jakekausler.com
+        create_kind = 'upsert' if create_only else 'create'
+        changes = [
+            (domain, create_kind, self._alias_change('UPSERT', domain, 'jakekausler.com'))
+            for domain in sorted(to_create)
+            if domain != 'jakekausler.com'  # Don't create main domain
+        ]
+        
+        # Delete obsolete records using their exact details from Route 53
+        changes += [
+            (domain, 'delete', {'Action': 'DELETE', 'ResourceRecordSet': self._full_records[domain]})
+            for domain in sorted(to_delete)
+        ]
         
         created_count = 0
         deleted_count = 0
         
-        # Create missing records as ALIAS records pointing to jakekausler.com
-        for domain in to_create:
-            if domain != 'jakekausler.com':  # Don't create main domain
-                if self._create_alias_record(domain, 'jakekausler.com'):
+        # Submit changes in batches rather than one API call per record;
+        # syncs spanning several batches send them concurrently
+        chunks = [changes[start:start + _CHANGE_BATCH_SIZE]
+                  for start in range(0, len(changes), _CHANGE_BATCH_SIZE)]
+        batches = [[change for _, _, change in chunk] for chunk in chunks]
+        if len(batches) > 1:
+            self._get_client()  # Create the shared client before fanning out
+            with ThreadPoolExecutor(max_workers=min(_MAX_WORKERS, len(batches))) as executor:
+                results = list(executor.map(self._submit_changes, batches))
+        else:
+            results = [self._submit_changes(batch) for batch in batches]
+        
+        for chunk, ok in zip(chunks, results):
+            if not ok:
+                continue
+            
+            for domain, kind, _ in chunk:
+                if kind == 'create':
                     created_count += 1
                     self.logger.info(f"Created ALIAS record for {domain}")
-        
-        # Delete obsolete records  
-        for domain in to_delete:
-            if self._delete_record_exact(domain):
-                deleted_count += 1
-                record_value = jakekausler_records[domain]
-                record_type = "ALIAS" if record_value.startswith('ALIAS:') else "A"
-                self.logger.info(f"Deleted {record_type} record for {domain}")
+                elif kind == 'upsert':
+                    created_count += 1
+                    self.logger.info(f"Upserted ALIAS record for {domain}")
+                else:
+                    deleted_count += 1
+                    record_value = current_records[domain]
+                    record_type = "ALIAS" if record_value.startswith('ALIAS:') else "A"
+                    self.logger.info(f"Deleted {record_type} record for {domain}")
         
         return created_count, deleted_count
 
-    def _create_a_record(self, domain: str, ip: str) -> bool:
-        """Create A record for domain"""
-        client = self._get_client()
-        
-        try:
-            response = client.change_resource_record_sets(
-                HostedZoneId=self.hosted_zone_id,
-                ChangeBatch={
-                    'Changes': [{
-                        'Action': 'CREATE',
-                        'ResourceRecordSet': {
-                            'Name': domain,
-                            'Type': 'A',
-                            'TTL': 300,
-                            'ResourceRecords': [{'Value': ip}]
-                        }
-                    }]
+    def _a_change(self, action: str, domain: str, ip: str) -> Dict:
+        """Build a change entry for an A record with an IP address"""
+        return {
+            'Action': action,
+            'ResourceRecordSet': {
+                'Name': domain,
+                'Type': 'A',
+                'TTL': 300,
+                'ResourceRecords': [{'Value': ip}]
+            }
+        }
+
+    def _alias_change(self, action: str, domain: str, target_domain: str) -> Dict:
+        """Build a change entry for an ALIAS record pointing to target domain"""
+        return {
+            'Action': action,
+            'ResourceRecordSet': {
+                'Name': domain,
+                'Type': 'A',
+                'AliasTarget': {
+                    'DNSName': target_domain,
+                    'EvaluateTargetHealth': False,
+                    'HostedZoneId': self.hosted_zone_id
                 }
-            )
-            return response['ResponseMetadata']['HTTPStatusCode'] == 200
-        except ClientError as e:
-            self.logger.error(f"Failed to create A record for {domain}: {e}")
+            }
+        }
+
+    def _change_applied(self, response: Dict) -> bool:
+        """Check a change response, invalidating cached records on success"""
+        if response['ResponseMetadata']['HTTPStatusCode'] != 200:
             return False
+        self._records_cache = None
+        return True
 
-    def _delete_a_record(self, domain: str, ip: str) -> bool:
-        """Delete A record for domain"""
+    def _submit_changes(self, changes: List[Dict], action: Optional[str] = None) -> bool:
+        """Submit a batch of changes in a single ChangeResourceRecordSets call
+        
+        Args:
+            changes: Change entries to apply
+            action: Description of the change for error logging
+        """
         client = self._get_client()
         
-        try:
-            response = client.change_resource_record_sets(
-                HostedZoneId=self.hosted_zone_id,
-                ChangeBatch={
-                    'Changes': [{
-                        'Action': 'DELETE',
-                        'ResourceRecordSet': {
-                            'Name': domain,
-                            'Type': 'A',
-                            'TTL': 300,
-                            'ResourceRecords': [{'Value': ip}]
-                        }
-                    }]
-                }
-            )
-            return response['ResponseMetadata']['HTTPStatusCode'] == 200
-        except ClientError as e:
-            self.logger.error(f"Failed to delete A record for {domain}: {e}")
-            return False
+        while True:
+            stale_id = self.hosted_zone_id
+            try:
+                response = client.change_resource_record_sets(
+                    HostedZoneId=stale_id,
+                    ChangeBatch={'Changes': changes}
+                )
+                return self._change_applied(response)
+            except ClientError as e:
+                if self._refresh_hosted_zone(e, stale_id):
+                    # ALIAS targets were built against the stale zone too
+                    for change in changes:
+                        target = change['ResourceRecordSet'].get('AliasTarget')
+                        if target and target.get('HostedZoneId') == stale_id:
+                            target['HostedZoneId'] = self.hosted_zone_id
+                    continue
+                action = action or f"apply batch of {len(changes)} record changes"
+                self.logger.error(f"Failed to {action}: {e}")
+                return False
+
+    def _create_a_record(self, domain: str, ip: str) -> bool:
+        """Create A record for domain"""
+        return self._submit_changes([self._a_change('CREATE', domain, ip)],
+                                    f"create A record for {domain}")
+
+    def _delete_a_record(self, domain: str, ip: str) -> bool:
+        """Delete A record for domain"""
+        return self._submit_changes([self._a_change('DELETE', domain, ip)],
+                                    f"delete A record for {domain}")
 
     def _create_alias_record(self, domain: str, target_domain: str) -> bool:
         """Create ALIAS record for domain pointing to target domain"""
-        client = self._get_client()
-        
-        try:
-            response = client.change_resource_record_sets(
-                HostedZoneId=self.hosted_zone_id,
-                ChangeBatch={
-                    'Changes': [{
-                        'Action': 'CREATE',
-                        'ResourceRecordSet': {
-                            'Name': domain,
-                            'Type': 'A',
-                            'AliasTarget': {
-                                'DNSName': target_domain,
-                                'EvaluateTargetHealth': False,
-                                'HostedZoneId': self.hosted_zone_id
-                            }
-                        }
-                    }]
-                }
-            )
-            return response['ResponseMetadata']['HTTPStatusCode'] == 200
-        except ClientError as e:
-            self.logger.error(f"Failed to create ALIAS record for {domain}: {e}")
-            return False
+        return self._submit_changes([self._alias_change('UPSERT', domain, target_domain)],
+                                    f"create ALIAS record for {domain}")
 
     def _delete_alias_record(self, domain: str, target_domain: str) -> bool:
         """Delete ALIAS record for domain"""
-        client = self._get_client()
-        
-        try:
-            response = client.change_resource_record_sets(
-                HostedZoneId=self.hosted_zone_id,
-                ChangeBatch={
-                    'Changes': [{
-                        'Action': 'DELETE',
-                        'ResourceRecordSet': {
-                            'Name': domain,
-                            'Type': 'A',
-                            'AliasTarget': {
-                                'DNSName': target_domain,
-                                'EvaluateTargetHealth': False,
-                                'HostedZoneId': self.hosted_zone_id
-                            }
-                        }
-                    }]
-                }
-            )
-            return response['ResponseMetadata']['HTTPStatusCode'] == 200
-        except ClientError as e:
-            self.logger.error(f"Failed to delete ALIAS record for {domain}: {e}")
-            return False
+        return self._submit_changes([self._alias_change('DELETE', domain, target_domain)],
+                                    f"delete ALIAS record for {domain}")
 
     def _delete_record_exact(self, domain: str) -> bool:
         """Delete a record using its exact details from Route 53"""
@@ -250,23 +447,8 @@ class Route53Manager:
             self.logger.error(f"No full record details available for {domain}")
             return False
         
-        client = self._get_client()
-        original_record = self._full_records[domain]
-        
-        try:
-            response = client.change_resource_record_sets(
-                HostedZoneId=self.hosted_zone_id,
-                ChangeBatch={
-                    'Changes': [{
-                        'Action': 'DELETE',
-                        'ResourceRecordSet': original_record
-                    }]
-                }
-            )
-            return response['ResponseMetadata']['HTTPStatusCode'] == 200
-        except ClientError as e:
-            self.logger.error(f"Failed to delete record for {domain}: {e}")
-            return False
+        change = {'Action': 'DELETE', 'ResourceRecordSet': self._full_records[domain]}
+        return self._submit_changes([change], f"delete record for {domain}")
 
     def list_dns_records(self) -> Dict[str, str]:
         """List all DNS records for debugging purposes"""
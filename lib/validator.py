@@ -5,14 +5,50 @@ Nginx configuration validation and reload utilities.
 Provides validation of nginx configurations and safe reload operations.
 """
 
+import os
+import mmap
+import asyncio
+import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple, Optional, List
+from typing import Dict, Iterator, Tuple, Optional, List
 import logging
 import re
 
 logger = logging.getLogger(__name__)
 
+# Block size for reading the error log backwards
+_TAIL_CHUNK_SIZE = 8192
+
+# Message returned by a successful nginx -t, whose output is not decoded
+_VALIDATION_OK = "nginx: configuration file test is successful"
+
+# Validate then reload in one shell; the binaries are passed as positional
+# arguments so they never need quoting. A failed nginx -t exits with
+# _VALIDATION_FAILED so it can be told apart from a failed reload.
+_VALIDATION_FAILED = 254
+# Exit status of the shell when exec cannot find the systemctl binary
+_COMMAND_NOT_FOUND = 127
+_RELOAD_SCRIPT = f'"$1" -t 2>&1 || exit {_VALIDATION_FAILED}; exec "$2" reload nginx'
+
+_RE_NGINX_VERSION = re.compile(r'nginx/(\S+)')
+# Module arguments in nginx -V output; each must start a whitespace-separated word
+_RE_BUILD_MODULE = re.compile(rb'(?<!\S)--(with-|add-module=)(\S+)')
+# Block structure and server_name directives, for per-block counting.
+# server_name is anchored to the start of a line so commented-out directives
+# are skipped, and its value stops at a brace so a missing semicolon cannot
+# make the match run on through later blocks.
+_RE_BLOCK_TOKENS = re.compile(
+    r'(?P<server>\bserver\s*\{)|(?P<server_name>^[ \t]*server_name\s[^;{}]*;)'
+    r'|(?P<open>\{)|(?P<close>\})',
+    re.MULTILINE
+)
+# Lines holding a directive that must end with a semicolon
+_RE_SITE_DIRECTIVES = re.compile(
+    r'^\s*(server_name|listen|root|index|proxy_pass|return|proxy_set_header|add_header)\b[^\n]*'
+)
+
 
 class NginxValidator:
     """Validate and manage nginx configurations."""
@@ -27,6 +63,38 @@ class NginxValidator:
         """
         self.nginx_binary = nginx_binary
         self.systemctl_binary = systemctl_binary
+        self._error_log = Path('/var/log/nginx/error.log')
+        self._sites_enabled = Path('/etc/nginx/sites-enabled')
+        
+        # Build info is fixed for a given binary, so cache it per binary path
+        self._version_cache: Dict[str, str] = {}
+        self._modules_cache: Dict[str, List[str]] = {}
+    
+    @property
+    def nginx_binary(self) -> str:
+        """nginx binary as configured."""
+        return self._nginx_binary
+    
+    @nginx_binary.setter
+    def nginx_binary(self, value: str) -> None:
+        # Resolve against PATH once rather than on every spawn
+        self._nginx_binary = value
+        self._nginx_path = shutil.which(value) or value
+    
+    @property
+    def systemctl_binary(self) -> str:
+        """systemctl binary as configured."""
+        return self._systemctl_binary
+    
+    @systemctl_binary.setter
+    def systemctl_binary(self, value: str) -> None:
+        self._systemctl_binary = value
+        self._systemctl_path = shutil.which(value) or value
+    
+    def invalidate_caches(self) -> None:
+        """Forget cached nginx version and module information."""
+        self._version_cache.clear()
+        self._modules_cache.clear()
     
     def validate_config(self) -> Tuple[bool, str]:
         """
@@ -37,21 +105,19 @@ class NginxValidator:
         """
         try:
             result = subprocess.run(
-                [self.nginx_binary, '-t'],
+                [self._nginx_path, '-t'],
                 capture_output=True,
-                text=True,
                 timeout=10
             )
             
-            # nginx -t writes to stderr even on success
-            output = result.stderr if result.stderr else result.stdout
-            
             if result.returncode == 0:
                 logger.info("Nginx configuration is valid")
-                return True, output
-            else:
-                logger.error(f"Nginx configuration is invalid: {output}")
-                return False, output
+                return True, _VALIDATION_OK
+            
+            # nginx -t writes to stderr; only decode it when reporting a failure
+            output = (result.stderr or result.stdout).decode('utf-8', errors='replace')
+            logger.error(f"Nginx configuration is invalid: {output}")
+            return False, output
                 
         except subprocess.TimeoutExpired:
             msg = "Nginx validation timed out after 10 seconds"
@@ -66,27 +132,77 @@ class NginxValidator:
             logger.error(msg)
             return False, msg
     
-    def reload_nginx(self) -> Tuple[bool, str]:
+    async def validate_config_async(self) -> Tuple[bool, str]:
         """
-        Reload nginx service using systemctl.
+        Validate nginx configuration using nginx -t without blocking the event loop.
+        
+        Lets callers run validation alongside other I/O with asyncio.gather.
         
         Returns:
             Tuple of (success: bool, message: str)
         """
-        # Always validate before reload
-        valid, validation_msg = self.validate_config()
-        if not valid:
-            return False, f"Configuration validation failed: {validation_msg}"
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                self._nginx_path, '-t',
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=10)
+            except asyncio.TimeoutError:
+                proc.kill()
+                await proc.wait()
+                raise
+            
+            if proc.returncode == 0:
+                logger.info("Nginx configuration is valid")
+                return True, _VALIDATION_OK
+            
+            # nginx -t writes to stderr; only decode it when reporting a failure
+            output = (stderr or stdout).decode('utf-8', errors='replace')
+            logger.error(f"Nginx configuration is invalid: {output}")
+            return False, output
+                
+        except asyncio.TimeoutError:
+            msg = "Nginx validation timed out after 10 seconds"
+            logger.error(msg)
+            return False, msg
+        except FileNotFoundError:
+            msg = f"Nginx binary not found: {self.nginx_binary}"
+            logger.error(msg)
+            return False, msg
+        except Exception as e:
+            msg = f"Failed to validate nginx configuration: {str(e)}"
+            logger.error(msg)
+            return False, msg
+    
+    def reload_nginx(self) -> Tuple[bool, str]:
+        """
+        Validate the configuration and reload nginx service using systemctl.
+        
+        Both steps run in a single shell so only one process is spawned;
+        the reload only happens if nginx -t succeeds.
         
+        Returns:
+            Tuple of (success: bool, message: str)
+        """
         try:
             result = subprocess.run(
-                [self.systemctl_binary, 'reload', 'nginx'],
+                ['sh', '-c', _RELOAD_SCRIPT, 'sh', self._nginx_path, self._systemctl_path],
                 capture_output=True,
                 text=True,
-                timeout=10
+                timeout=20
             )
             
-            if result.returncode == 0:
+            if result.returncode == _VALIDATION_FAILED:
+                # nginx -t output is redirected to stdout by the script
+                logger.error(f"Nginx configuration is invalid: {result.stdout}")
+                return False, f"Configuration validation failed: {result.stdout}"
+            elif result.returncode == _COMMAND_NOT_FOUND:
+                msg = f"systemctl binary not found: {self.systemctl_binary}"
+                logger.error(msg)
+                return False, msg
+            elif result.returncode == 0:
                 logger.info("Nginx reloaded successfully")
                 return True, "Nginx reloaded successfully"
             else:
@@ -95,11 +211,7 @@ class NginxValidator:
                 return False, output
                 
         except subprocess.TimeoutExpired:
-            msg = "Nginx reload timed out after 10 seconds"
-            logger.error(msg)
-            return False, msg
-        except FileNotFoundError:
-            msg = f"systemctl binary not found: {self.systemctl_binary}"
+            msg = "Nginx reload timed out after 20 seconds"
             logger.error(msg)
             return False, msg
         except Exception as e:
@@ -123,7 +235,7 @@ class NginxValidator:
         try:
             # Use nginx -t with -c to test specific config
             result = subprocess.run(
-                [self.nginx_binary, '-t', '-c', str(config_file)],
+                [self._nginx_path, '-t', '-c', str(config_file)],
                 capture_output=True,
                 text=True,
                 timeout=10
@@ -146,9 +258,12 @@ class NginxValidator:
         Returns:
             Version string or None if unable to determine
         """
+        if self.nginx_binary in self._version_cache:
+            return self._version_cache[self.nginx_binary]
+        
         try:
             result = subprocess.run(
-                [self.nginx_binary, '-v'],
+                [self._nginx_path, '-v'],
                 capture_output=True,
                 text=True,
                 timeout=5
@@ -158,11 +273,11 @@ class NginxValidator:
             output = result.stderr if result.stderr else result.stdout
             
             # Extract version from output
-            match = re.search(r'nginx/(\S+)', output)
-            if match:
-                return match.group(1)
+            match = _RE_NGINX_VERSION.search(output)
+            version = match.group(1) if match else output.strip()
             
-            return output.strip()
+            self._version_cache[self.nginx_binary] = version
+            return version
             
         except Exception as e:
             logger.error(f"Failed to get nginx version: {e}")
@@ -175,30 +290,30 @@ class NginxValidator:
         Returns:
             List of module names
         """
+        if self.nginx_binary in self._modules_cache:
+            return list(self._modules_cache[self.nginx_binary])
+        
         try:
             result = subprocess.run(
-                [self.nginx_binary, '-V'],
+                [self._nginx_path, '-V'],
                 capture_output=True,
-                text=True,
                 timeout=5
             )
             
             # nginx writes build info to stderr
             output = result.stderr if result.stderr else result.stdout
             
+            # Extract module names from --with-* and --add-module=* arguments
             modules = []
-            for line in output.split('\n'):
-                if '--with-' in line or '--add-module=' in line:
-                    # Extract module names
-                    for item in line.split():
-                        if item.startswith('--with-'):
-                            module = item.replace('--with-', '').replace('_module', '')
-                            modules.append(module)
-                        elif item.startswith('--add-module='):
-                            module = Path(item.replace('--add-module=', '')).name
-                            modules.append(module)
+            for match in _RE_BUILD_MODULE.finditer(output):
+                value = match.group(2).decode('utf-8', errors='replace')
+                if match.group(1) == b'with-':
+                    modules.append(value.replace('_module', ''))
+                else:
+                    modules.append(value.rstrip('/').rpartition('/')[2])
             
-            return modules
+            self._modules_cache[self.nginx_binary] = modules
+            return list(modules)
             
         except Exception as e:
             logger.error(f"Failed to get loaded modules: {e}")
@@ -221,34 +336,42 @@ class NginxValidator:
         
         # Read the config to check for common issues
         try:
-            content = site_config.read_text()
+            data = site_config.read_bytes()
+            content = data.decode('utf-8', errors='replace')
             
             # Check for common issues
             issues = []
             
-            # Check for duplicate server_name directives
-            server_names = re.findall(r'server_name\s+([^;]+);', content)
-            if len(server_names) > 1:
-                # Check if they're in different server blocks
-                server_blocks = content.count('server {')
-                if len(server_names) > server_blocks:
-                    issues.append("Multiple server_name directives in same server block")
+            # Check for duplicate server_name directives, tracking which
+            # block each one belongs to in a single pass over the content
+            blocks = []  # Stack of server_name counts; None for non-server blocks
+            for token in _RE_BLOCK_TOKENS.finditer(content):
+                kind = token.lastgroup
+                if kind == 'server':
+                    blocks.append(0)
+                elif kind == 'open':
+                    blocks.append(None)
+                elif kind == 'close':
+                    if blocks:
+                        blocks.pop()
+                elif blocks and blocks[-1] is not None:
+                    blocks[-1] += 1
+                    if blocks[-1] == 2:
+                        issues.append("Multiple server_name directives in same server block")
+                        break
             
             # Check for missing semicolons (common syntax error)
-            lines = content.split('\n')
-            for i, line in enumerate(lines, 1):
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    # Check if line should end with semicolon
-                    if any(line.startswith(d) for d in ['server_name', 'listen', 'root', 
-                                                          'index', 'proxy_pass', 'return',
-                                                          'proxy_set_header', 'add_header']):
-                        if not line.endswith(';') and not line.endswith('{'):
-                            issues.append(f"Line {i}: Missing semicolon")
+            # Comment lines never match since the directive must follow
+            # leading whitespace directly
+            for i, line in enumerate(content.splitlines(), 1):
+                # Check if line should end with semicolon
+                match = _RE_SITE_DIRECTIVES.match(line)
+                if match and not match.group(0).rstrip().endswith((';', '{')):
+                    issues.append(f"Line {i}: Missing semicolon")
             
             # Check for unclosed braces
-            open_braces = content.count('{')
-            close_braces = content.count('}')
+            open_braces = data.count(b'{')
+            close_braces = data.count(b'}')
             if open_braces != close_braces:
                 issues.append(f"Unmatched braces: {open_braces} open, {close_braces} close")
             
@@ -271,39 +394,24 @@ class NginxValidator:
         conflicts = []
         port_map = {}  # port -> list of sites
         
-        sites_dir = Path('/etc/nginx/sites-enabled')
-        if not sites_dir.exists():
+        try:
+            # DirEntry type checks use the cached d_type, so no per-file stat
+            with os.scandir(self._sites_enabled) as entries:
+                site_files = [entry for entry in entries
+                              if entry.is_file(follow_symlinks=False) or entry.is_symlink()]
+        except FileNotFoundError:
             return conflicts
         
-        for site_file in sites_dir.iterdir():
-            if site_file.is_file() or site_file.is_symlink():
-                try:
-                    content = site_file.read_text()
-                    
-                    # Find all listen directives
-                    listen_matches = re.findall(r'listen\s+(\S+)(?:\s+(\S+))?;', content)
-                    
-                    for match in listen_matches:
-                        port_spec = match[0]
-                        
-                        # Extract port number
-                        if ':' in port_spec:
-                            port = port_spec.split(':')[-1]
-                        else:
-                            port = port_spec
-                        
-                        # Handle default ports
-                        if match[1] == 'ssl':
-                            port = port if port.isdigit() else '443'
-                        elif not port.isdigit():
-                            port = '80'
-                        
+        # Overlap the blocking file reads across sites; map() keeps results
+        # in directory order
+        if site_files:
+            site_paths = [entry.path for entry in site_files]
+            with ThreadPoolExecutor(max_workers=min(32, len(site_files))) as executor:
+                for site_file, ports in zip(site_files, executor.map(self._listen_ports, site_paths)):
+                    for port in ports:
                         if port not in port_map:
                             port_map[port] = []
                         port_map[port].append(site_file.name)
-                        
-                except Exception as e:
-                    logger.error(f"Failed to check {site_file}: {e}")
         
         # Check for conflicts (multiple sites on same port without server_name)
         for port, sites in port_map.items():
@@ -314,6 +422,71 @@ class NginxValidator:
         
         return conflicts
     
+    def _listen_ports(self, site_file: str) -> List[str]:
+        """
+        Get the ports a site file listens on.
+        
+        Args:
+            site_file: Path to the site configuration
+            
+        Returns:
+            Port of each listen directive, in file order
+        """
+        ports = []
+        try:
+            for line in self._listen_lines(site_file):
+                # Find all listen directives; a line may hold several
+                # statements, e.g. "server { listen 80; }"
+                for statement in line.partition('#')[0].split(';')[:-1]:
+                    args = statement.rpartition('{')[2].rpartition('}')[2].split()
+                    if len(args) < 2 or args[0] != 'listen':
+                        continue
+                    port_spec = args[1]
+                    
+                    # Extract port number
+                    if ':' in port_spec:
+                        port = port_spec.split(':')[-1]
+                    else:
+                        port = port_spec
+                    
+                    # Handle default ports
+                    if len(args) > 2 and args[2] == 'ssl':
+                        port = port if port.isdigit() else '443'
+                    elif not port.isdigit():
+                        port = '80'
+                    
+                    ports.append(port)
+                    
+        except Exception as e:
+            logger.error(f"Failed to check {site_file}: {e}")
+        
+        return ports
+    
+    def _listen_lines(self, site_file: str) -> Iterator[str]:
+        """
+        Yield the lines of a site file that mention listen.
+        
+        The file is memory-mapped and searched for b'listen' directly, so
+        lines without it are never copied or decoded.
+        
+        Args:
+            site_file: Path to the site configuration
+        """
+        with open(site_file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return  # Empty files cannot be mapped
+            
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = mm.find(b'listen')
+                while pos >= 0:
+                    start = mm.rfind(b'\n', 0, pos) + 1
+                    end = mm.find(b'\n', pos)
+                    if end < 0:
+                        end = size
+                    yield mm[start:end].decode('utf-8', errors='replace')
+                    pos = mm.find(b'listen', end)
+    
     def get_error_log_recent(self, lines: int = 20) -> List[str]:
         """
         Get recent lines from nginx error log.
@@ -324,23 +497,28 @@ class NginxValidator:
         Returns:
             List of log lines
         """
-        error_log = Path('/var/log/nginx/error.log')
-        
-        if not error_log.exists():
+        if lines <= 0 or not self._error_log.exists():
             return []
         
         try:
-            result = subprocess.run(
-                ['tail', '-n', str(lines), str(error_log)],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
+            # Read backwards from the end until enough newlines are seen
+            with open(self._error_log, 'rb') as f:
+                pos = f.seek(0, os.SEEK_END)
+                chunks = []
+                newlines = 0
+                while pos > 0 and newlines <= lines:
+                    size = min(_TAIL_CHUNK_SIZE, pos)
+                    pos -= size
+                    f.seek(pos)
+                    chunk = f.read(size)
+                    chunks.append(chunk)
+                    newlines += chunk.count(b'\n')
             
-            if result.returncode == 0:
-                return result.stdout.strip().split('\n')
+            data = b''.join(reversed(chunks))
+            return [line.decode('utf-8', errors='replace')
+                    for line in data.splitlines()[-lines:]]
             
         except Exception as e:
             logger.error(f"Failed to read error log: {e}")
         
-        return []
\ No newline at end of file
+        return []
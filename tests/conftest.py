@@ -0,0 +1,45 @@
+"""
+Shared fixtures for the nginx-sites test suite.
+"""
+
+import importlib.machinery
+import importlib.util
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+CLI_PATH = Path(__file__).parent.parent / 'nginx-sites'
+
+
+def _load_cli_module():
+    """Import the extension-less nginx-sites script as a module."""
+    loader = importlib.machinery.SourceFileLoader('nginx_sites', str(CLI_PATH))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def cli_path():
+    """Path to the nginx-sites script."""
+    return CLI_PATH
+
+
+@pytest.fixture(scope='session')
+def cli_module():
+    """The nginx-sites script module, imported once per test session."""
+    return _load_cli_module()
+
+
+@pytest.fixture(scope='session')
+def cli(cli_module):
+    """The nginx-sites click group."""
+    return cli_module.cli
+
+
+@pytest.fixture(scope='session')
+def runner():
+    """Click runner for invoking the CLI in-process."""
+    return CliRunner()
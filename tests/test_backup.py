@@ -5,8 +5,6 @@ Unit tests for backup management functionality.
 
 import pytest
 import tarfile
-import tempfile
-import shutil
 from pathlib import Path
 from datetime import datetime
 from unittest.mock import Mock, patch, MagicMock
@@ -14,18 +12,25 @@ from unittest.mock import Mock, patch, MagicMock
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from lib import backup
 from lib.backup import BackupManager
 
 
 class TestBackupManager:
     """Test cases for BackupManager class."""
     
+    @pytest.fixture(autouse=True)
+    def reset_info_caches(self, monkeypatch):
+        """Start every test with no archive contents cached in memory."""
+        monkeypatch.setattr(backup, '_INFO_CACHES', {})
+        monkeypatch.setattr(backup, '_DIRTY_INFO_CACHES', set())
+    
     @pytest.fixture
-    def temp_backup_dir(self):
+    def temp_backup_dir(self, tmp_path):
         """Create a temporary directory for backups."""
-        temp_dir = Path(tempfile.mkdtemp())
-        yield temp_dir
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        temp_dir = tmp_path / 'backups'
+        temp_dir.mkdir()
+        return temp_dir
     
     @pytest.fixture
     def backup_manager(self, temp_backup_dir):
@@ -58,6 +63,17 @@ class TestBackupManager:
             'nginx_conf': nginx_conf
         }
     
+    @pytest.fixture
+    def nginx_paths(self, mock_nginx_dirs):
+        """Point the /etc/nginx paths used by create_backup at the mock directories."""
+        redirects = {
+            '/etc/nginx/sites-available': mock_nginx_dirs['sites_available'],
+            '/etc/nginx/sites-enabled': mock_nginx_dirs['sites_enabled'],
+            '/etc/nginx/nginx.conf': mock_nginx_dirs['nginx_conf'],
+        }
+        with patch('lib.backup.Path', side_effect=lambda p: redirects.get(p, Path(p))):
+            yield mock_nginx_dirs
+    
     def test_init_creates_backup_directory(self, tmp_path):
         """Test that BackupManager creates backup directory if it doesn't exist."""
         backup_dir = tmp_path / 'new_backup_dir'
@@ -66,31 +82,79 @@ class TestBackupManager:
         BackupManager(backup_dir)
         assert backup_dir.exists()
     
-    def test_create_backup_basic(self, backup_manager, mock_nginx_dirs):
+    def test_create_backup_basic(self, backup_manager, nginx_paths):
         """Test basic backup creation."""
-        with patch('lib.backup.Path') as mock_path:
-            # Mock the nginx paths to point to our test directories
-            def path_side_effect(path_str):
-                if path_str == '/etc/nginx/sites-available':
-                    return mock_nginx_dirs['sites_available']
-                elif path_str == '/etc/nginx/sites-enabled':
-                    return mock_nginx_dirs['sites_enabled']
-                elif path_str == '/etc/nginx/nginx.conf':
-                    return mock_nginx_dirs['nginx_conf']
-                return Path(path_str)
-            
-            mock_path.side_effect = path_side_effect
-            
+        backup_path = backup_manager.create_backup()
+        
+        assert backup_path.exists()
+        assert backup_path.suffix == '.gz'
+        assert 'nginx_backup_' in backup_path.name
+        
+        # Verify backup contains expected files
+        with tarfile.open(backup_path, 'r:gz') as tar:
+            names = tar.getnames()
+            assert 'sites-available' in names or any('sites-available' in n for n in names)
+    
+    def test_create_backup_without_native_compressor(self, backup_manager, nginx_paths):
+        """Test backup creation falls back to tarfile when pigz/gzip are missing."""
+        with patch('lib.backup._find_compressor', return_value=None):
             backup_path = backup_manager.create_backup()
             
-            assert backup_path.exists()
-            assert backup_path.suffix == '.gz'
-            assert 'nginx_backup_' in backup_path.name
-            
-            # Verify backup contains expected files
             with tarfile.open(backup_path, 'r:gz') as tar:
                 names = tar.getnames()
-                assert 'sites-available' in names or any('sites-available' in n for n in names)
+                assert 'sites-available/test.com' in names
+                assert 'sites-enabled/test.com' in names
+                assert 'nginx.conf' in names
+    
+    def test_create_backup_uncompressed(self, backup_manager, nginx_paths):
+        """Test that compress=False writes a plain .tar archive."""
+        backup_path = backup_manager.create_backup(compress=False)
+        
+        assert backup_path.name.endswith('.tar')
+        with tarfile.open(backup_path, 'r:') as tar:
+            assert 'nginx.conf' in tar.getnames()
+        assert backup_path in backup_manager.list_backups()
+    
+    def test_create_backup_skips_unchanged_config(self, backup_manager, nginx_paths):
+        """Test that an unchanged config reuses the last backup unless forced."""
+        first = backup_manager.create_backup('first')
+        assert backup_manager.create_backup('second') == first
+        assert 'forced' in backup_manager.create_backup('forced', force=True).name
+        
+        (nginx_paths['sites_available'] / 'new.com').write_text('server {}')
+        assert 'changed' in backup_manager.create_backup('changed').name
+    
+    def test_create_backup_reuse_respects_compress(self, backup_manager, nginx_paths):
+        """Test that an unchanged config is not reused across compressed and plain formats."""
+        compressed = backup_manager.create_backup('compressed')
+        
+        plain = backup_manager.create_backup('plain', compress=False)
+        assert plain != compressed
+        assert plain.name.endswith('.tar')
+        
+        again = backup_manager.create_backup('again')
+        assert again.name.endswith('.tar.gz')
+        assert again != plain
+    
+    def test_forced_backup_not_reused(self, backup_manager, nginx_paths):
+        """Test that a forced safety backup is never returned for a later unforced backup."""
+        first = backup_manager.create_backup('first')
+        safety = backup_manager.create_backup('pre_restore_safety', compress=False, force=True)
+        
+        assert safety != first
+        assert backup_manager.create_backup('pre_generate') == first
+    
+    def test_forced_backup_skips_fingerprint(self, backup_manager, nginx_paths):
+        """Test that a forced backup does not hash the config it will not compare."""
+        with patch('lib.backup._fingerprint') as mock_fingerprint:
+            backup_manager.create_backup('manual', force=True)
+        
+        mock_fingerprint.assert_not_called()
+    
+    def test_create_backup_invalid_compresslevel(self, backup_manager):
+        """Test that an out-of-range compression level is rejected."""
+        with pytest.raises(ValueError):
+            backup_manager.create_backup(compresslevel=0)
     
     def test_create_backup_with_description(self, backup_manager):
         """Test backup creation with description."""
@@ -108,6 +172,28 @@ class TestBackupManager:
             assert 'test_backup_with_spaces' in backup_path.name
             assert '/' not in backup_path.stem
     
+    @staticmethod
+    def _failing_tar(cmd, **kwargs):
+        """Stand-in for native tar that writes part of the archive, then fails."""
+        Path(cmd[cmd.index('-cf') + 1]).write_bytes(b'partial')
+        return Mock(returncode=2, stderr='tar: disk full')
+    
+    @pytest.mark.parametrize('native', [True, False], ids=['native-tar', 'tarfile'])
+    def test_create_backup_failure_leaves_no_partial_file(self, backup_manager, temp_backup_dir,
+                                                          nginx_paths, native):
+        """Test that a failed backup leaves neither the archive nor its temp file."""
+        with patch('lib.backup.shutil.which', return_value='/usr/bin/tar' if native else None), \
+                patch('lib.backup._find_compressor', return_value=['gzip'] if native else None), \
+                patch('lib.backup.subprocess.run', side_effect=self._failing_tar) as mock_run, \
+                patch('lib.backup.tarfile.open', side_effect=OSError('disk full')) as mock_tarfile:
+            with pytest.raises(IOError, match='disk full'):
+                backup_manager.create_backup('broken')
+        
+        # Exactly one branch ran and failed
+        assert mock_run.called is native
+        assert mock_tarfile.called is not native
+        assert not any(temp_backup_dir.glob('nginx_backup_*'))
+    
     def test_list_backups_empty(self, backup_manager):
         """Test listing backups when none exist."""
         backups = backup_manager.list_backups()
@@ -178,11 +264,7 @@ class TestBackupManager:
         
         assert 'Backup not found' in str(exc_info.value)
     
-    @patch('lib.backup.shutil.rmtree')
-    @patch('lib.backup.shutil.copytree')
-    @patch('lib.backup.shutil.copy2')
-    def test_restore_backup_success(self, mock_copy2, mock_copytree, mock_rmtree, 
-                                   backup_manager, temp_backup_dir):
+    def test_restore_backup_success(self, backup_manager, temp_backup_dir, tmp_path):
         """Test successful backup restoration."""
         # Create a mock backup file
         backup_file = temp_backup_dir / 'test_backup.tar.gz'
@@ -190,35 +272,46 @@ class TestBackupManager:
         # Create a simple tar file with test content
         with tarfile.open(backup_file, 'w:gz') as tar:
             # Create temporary files to add to tar
-            temp_dir = Path(tempfile.mkdtemp())
+            temp_dir = tmp_path / 'archive-src'
             sites_available = temp_dir / 'sites-available'
-            sites_available.mkdir()
+            sites_available.mkdir(parents=True)
             (sites_available / 'test.com').write_text('test config')
+            (temp_dir / 'extra.conf').write_text('not managed')
             
             tar.add(sites_available, arcname='sites-available')
-            shutil.rmtree(temp_dir)
+            tar.add(temp_dir / 'extra.conf', arcname='extra.conf')
+        
+        # Live nginx directory with a stale site that the restore should remove
+        nginx_dir = tmp_path / 'nginx'
+        (nginx_dir / 'sites-available').mkdir(parents=True)
+        (nginx_dir / 'sites-available' / 'stale.com').write_text('stale config')
         
         # Mock the create_backup method to avoid actual backup during restore
-        with patch.object(backup_manager, 'create_backup') as mock_create:
+        with patch.object(backup_manager, 'create_backup') as mock_create, \
+             patch('lib.backup.Path', side_effect=lambda p: nginx_dir if p == '/etc/nginx' else Path(p)):
             mock_create.return_value = Path('/tmp/safety_backup.tar.gz')
             
             result = backup_manager.restore_backup(backup_file)
             
             assert result is True
-            mock_create.assert_called_once_with('pre_restore_safety')
+            mock_create.assert_called_once_with('pre_restore_safety', compress=False, force=True)
+        
+        assert (nginx_dir / 'sites-available' / 'test.com').read_text() == 'test config'
+        assert not (nginx_dir / 'sites-available' / 'stale.com').exists()
+        assert not (nginx_dir / 'extra.conf').exists()
     
-    def test_restore_backup_cleanup_on_error(self, backup_manager, temp_backup_dir):
-        """Test that temporary directory is cleaned up even on error."""
+    def test_restore_backup_invalid_archive(self, backup_manager, temp_backup_dir):
+        """Test that an invalid archive is rejected before the live config is touched."""
         backup_file = temp_backup_dir / 'test_backup.tar.gz'
         backup_file.touch()  # Create empty file (invalid tar)
         
-        with patch('lib.backup.shutil.rmtree') as mock_rmtree:
+        with patch('lib.backup.shutil.rmtree') as mock_rmtree, \
+             patch.object(backup_manager, 'create_backup') as mock_create:
             with pytest.raises(IOError):
                 backup_manager.restore_backup(backup_file)
             
-            # Verify cleanup was attempted
-            calls = [str(call[0][0]) for call in mock_rmtree.call_args_list]
-            assert any('/tmp/nginx_restore' in call for call in calls)
+            mock_create.assert_not_called()
+            mock_rmtree.assert_not_called()
     
     def test_get_backup_info(self, backup_manager, temp_backup_dir):
         """Test getting backup information."""
@@ -261,4 +354,56 @@ class TestBackupManager:
         
         # Should still return basic info even if can't read contents
         assert info['name'] == backup_file.name
-        assert info['contents'] == []  # Empty due to read error
\ No newline at end of file
+        assert info['contents'] == []  # Empty due to read error
+    
+    def test_get_backup_info_cached_across_instances(self, backup_manager, temp_backup_dir):
+        """Test that archive contents are cached and reused by a new manager."""
+        backup_file = temp_backup_dir / 'nginx_backup_20240115_143022.tar.gz'
+        
+        with tarfile.open(backup_file, 'w:gz') as tar:
+            temp_file = temp_backup_dir / 'test.txt'
+            temp_file.write_text('test')
+            tar.add(temp_file, arcname='sites-available/test.com')
+            temp_file.unlink()
+        
+        backup_manager.get_backup_info(backup_file)
+        backup._save_info_caches()
+        assert (temp_backup_dir / '.info_cache.json').exists()
+        
+        # Forget the in-memory cache, as a new process would
+        backup._INFO_CACHES.clear()
+        with patch('lib.backup.tarfile.open') as mock_open:
+            info = BackupManager(temp_backup_dir).get_backup_info(backup_file)
+        
+        mock_open.assert_not_called()
+        assert info['contents'] == ['sites-available/test.com']
+    
+    def test_info_cache_shared_between_managers(self, backup_manager, temp_backup_dir):
+        """Test that managers for one directory share a cache that is written once."""
+        backup_file = temp_backup_dir / 'nginx_backup_20240115_143022.tar'
+        with tarfile.open(backup_file, 'w'):
+            pass
+        
+        other = BackupManager(temp_backup_dir)
+        backup_manager.get_backup_info(backup_file)
+        
+        assert other._info_cache is backup_manager._info_cache
+        assert not (temp_backup_dir / '.info_cache.json').exists()
+        
+        with patch('lib.backup.json.dump') as mock_dump:
+            backup._save_info_caches()
+            backup._save_info_caches()
+        
+        mock_dump.assert_called_once()
+    
+    def test_get_backup_info_uncompressed_name(self, backup_manager, temp_backup_dir):
+        """Test filename parsing for uncompressed backups with underscored descriptions."""
+        backup_file = temp_backup_dir / 'nginx_backup_20240115_143022_pre_restore_safety.tar'
+        
+        with tarfile.open(backup_file, 'w'):
+            pass
+        
+        info = backup_manager.get_backup_info(backup_file)
+        
+        assert info['timestamp_str'] == '20240115_143022'
+        assert info['description'] == 'pre_restore_safety'
@@ -1,11 +1,72 @@
 import pytest
-from unittest.mock import Mock, patch, MagicMock
-from pathlib import Path
+from unittest.mock import MagicMock
+from dataclasses import dataclass
+from types import SimpleNamespace
 import subprocess
+import io
+import sys
+import time
 
+from lib import certbot_manager
 from lib.certbot_manager import CertbotManager
 from lib.permissions import InsufficientPermissionsError
 
+# Canned `certbot certificates` / `certbot renew` output
+_CERT_INFO_OUTPUT = """
+        Certificate Name: example.com
+        Domains: example.com www.example.com
+        Expiry Date: 2024-03-15 12:00:00
+        Certificate Path: /etc/letsencrypt/live/example.com/cert.pem
+        VALID: Expiry Date
+        """
+
+_LIST_OUTPUT = """- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+Certificate Name: example.com
+Domains: example.com www.example.com
+Expiry Date: 2024-03-15 (VALID: 89 days)
+- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+Certificate Name: test.com
+Domains: test.com
+Expiry Date: 2024-01-15 (EXPIRED)
+- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -"""
+
+_RENEW_OUTPUT = 'Renewal successful'
+
+
+def _ok(stdout=''):
+    """Build a successful subprocess.run result"""
+    return SimpleNamespace(returncode=0, stdout=stdout, stderr='')
+
+
+def _popen(output, returncode=0):
+    """Build a Popen mock that streams output on stdout"""
+    return MagicMock(stdout=io.StringIO(output), wait=MagicMock(return_value=returncode))
+
+
+@dataclass
+class CertbotMocks:
+    """Stand-ins for the external calls made by certbot_manager"""
+    run: MagicMock
+    popen: MagicMock
+    sudo: MagicMock
+    isfile: MagicMock
+
+
+@pytest.fixture
+def certbot_mocks(monkeypatch):
+    """Replace subprocess, sudo and certificate-file checks in certbot_manager"""
+    mocks = CertbotMocks(
+        run=MagicMock(),
+        popen=MagicMock(),
+        sudo=MagicMock(return_value=None),
+        isfile=MagicMock(return_value=False),
+    )
+    monkeypatch.setattr('lib.certbot_manager.subprocess.run', mocks.run)
+    monkeypatch.setattr('lib.certbot_manager.subprocess.Popen', mocks.popen)
+    monkeypatch.setattr('lib.certbot_manager.check_sudo_privileges', mocks.sudo)
+    monkeypatch.setattr('lib.certbot_manager.os.path.isfile', mocks.isfile)
+    return mocks
+
 
 class TestCertbotManager:
     """Test suite for CertbotManager class"""
@@ -15,165 +76,113 @@ class TestCertbotManager:
         self.certbot = CertbotManager(dry_run=True)
         self.certbot_prod = CertbotManager(dry_run=False)
     
-    def test_check_certificate_exists(self):
+    def test_check_certificate_exists(self, certbot_mocks):
         """Test certificate existence checking"""
-        with patch('lib.certbot_manager.Path.exists') as mock_exists:
-            mock_exists.return_value = True
-            assert self.certbot.check_certificate_exists('example.com') is True
-            
-            mock_exists.return_value = False
-            assert self.certbot.check_certificate_exists('example.com') is False
-    
-    @patch('lib.certbot_manager.subprocess.run')
-    @patch('lib.certbot_manager.check_sudo_privileges')
-    def test_request_certificate_success(self, mock_sudo, mock_run):
-        """Test successful certificate request without www"""
-        mock_sudo.return_value = None
-        mock_run.return_value = MagicMock(returncode=0, stdout='Certificate obtained')
-        
-        with patch.object(self.certbot_prod, 'check_certificate_exists', return_value=False):
-            success, message = self.certbot_prod.request_certificate('example.com', 'admin@example.com')
-            
-            assert success is True
-            assert 'Certificate obtained' in message
-            
-            # Verify command construction
-            mock_run.assert_called_once()
-            cmd = mock_run.call_args[0][0]
-            assert 'certbot' in cmd
-            assert '--nginx' in cmd
-            assert '-d' in cmd
-            assert 'example.com' in cmd
-            assert 'www.example.com' not in cmd  # Should not include www by default
-            assert '--email' in cmd
-            assert 'admin@example.com' in cmd
-
-    @patch('lib.certbot_manager.subprocess.run')
-    @patch('lib.certbot_manager.check_sudo_privileges')
-    def test_request_certificate_with_www(self, mock_sudo, mock_run):
-        """Test successful certificate request with www"""
-        mock_sudo.return_value = None
-        mock_run.return_value = MagicMock(returncode=0, stdout='Certificate obtained')
-        
-        with patch.object(self.certbot_prod, 'check_certificate_exists', return_value=False):
-            success, message = self.certbot_prod.request_certificate('example.com', 'admin@example.com', include_www=True)
-            
-            assert success is True
-            assert 'Certificate obtained' in message
-            
-            # Verify command construction
-            mock_run.assert_called_once()
-            cmd = mock_run.call_args[0][0]
-            assert 'certbot' in cmd
-            assert '--nginx' in cmd
-            assert '-d' in cmd
-            assert 'example.com' in cmd
-            assert 'www.example.com' in cmd  # Should include www when requested
-            assert '--email' in cmd
-            assert 'admin@example.com' in cmd
-    
-    @patch('lib.certbot_manager.subprocess.run')
-    def test_request_certificate_dry_run(self, mock_run):
+        certbot_mocks.isfile.return_value = True
+        assert self.certbot.check_certificate_exists('example.com') is True
+        
+        certbot_mocks.isfile.return_value = False
+        assert self.certbot.check_certificate_exists('example.com') is False
+    
+    @pytest.mark.parametrize('include_www', [False, True], ids=['bare', 'www'])
+    def test_request_certificate(self, certbot_mocks, include_www):
+        """Test successful certificate request, with and without www"""
+        certbot_mocks.run.return_value = _ok('Certificate obtained')
+        
+        success, message = self.certbot_prod.request_certificate(
+            'example.com', 'admin@example.com', include_www=include_www
+        )
+        
+        assert success is True
+        assert 'Certificate obtained' in message
+        
+        # Verify command construction
+        certbot_mocks.run.assert_called_once()
+        cmd = certbot_mocks.run.call_args[0][0]
+        assert 'certbot' in cmd
+        assert '--nginx' in cmd
+        assert '-d' in cmd
+        assert 'example.com' in cmd
+        # www is only included when requested
+        assert ('www.example.com' in cmd) is include_www
+        assert '--email' in cmd
+        assert 'admin@example.com' in cmd
+    
+    def test_request_certificate_dry_run(self, certbot_mocks):
         """Test certificate request in dry-run mode"""
-        mock_run.return_value = MagicMock(returncode=0, stdout='Dry run successful')
-        
-        with patch.object(self.certbot, 'check_certificate_exists', return_value=False):
-            success, message = self.certbot.request_certificate('example.com')
-            
-            assert success is True
-            
-            # Verify dry-run flag is included
-            cmd = mock_run.call_args[0][0]
-            assert '--dry-run' in cmd
-    
-    def test_request_certificate_already_exists(self):
+        certbot_mocks.run.return_value = _ok('Dry run successful')
+        
+        success, message = self.certbot.request_certificate('example.com')
+        
+        assert success is True
+        
+        # Verify dry-run flag is included
+        cmd = certbot_mocks.run.call_args[0][0]
+        assert '--dry-run' in cmd
+    
+    def test_request_certificate_already_exists(self, certbot_mocks):
         """Test certificate request when certificate already exists"""
-        with patch.object(self.certbot, 'check_certificate_exists', return_value=True):
-            success, message = self.certbot.request_certificate('example.com')
-            
-            assert success is True
-            assert 'already exists' in message
-    
-    @patch('lib.certbot_manager.check_sudo_privileges')
-    def test_request_certificate_no_permissions(self, mock_sudo):
-        """Test certificate request without sudo privileges"""
-        mock_sudo.side_effect = InsufficientPermissionsError("No sudo")
+        certbot_mocks.isfile.return_value = True
+        
+        success, message = self.certbot.request_certificate('example.com')
         
-        with patch.object(self.certbot_prod, 'check_certificate_exists', return_value=False):
-            success, message = self.certbot_prod.request_certificate('example.com')
-            
-            assert success is False
-            assert 'No sudo' in message
+        assert success is True
+        assert 'already exists' in message
     
-    @patch('lib.certbot_manager.subprocess.run')
-    def test_get_certificate_info(self, mock_run):
-        """Test getting certificate information"""
-        mock_output = """
-        Certificate Name: example.com
-        Domains: example.com www.example.com
-        Expiry Date: 2024-03-15 12:00:00
-        Certificate Path: /etc/letsencrypt/live/example.com/cert.pem
-        VALID: Expiry Date
-        """
-        mock_run.return_value = MagicMock(returncode=0, stdout=mock_output)
-        
-        with patch.object(self.certbot, 'check_certificate_exists', return_value=True):
-            info = self.certbot.get_certificate_info('example.com')
-            
-            assert info is not None
-            assert 'expiry' in info
-            assert 'cert_path' in info
-            assert 'domains' in info
-            assert info['valid'] is True
-    
-    def test_get_certificate_info_not_exists(self):
-        """Test getting info for non-existent certificate"""
-        with patch.object(self.certbot, 'check_certificate_exists', return_value=False):
-            info = self.certbot.get_certificate_info('example.com')
-            assert info is None
+    def test_request_certificate_no_permissions(self, certbot_mocks):
+        """Test certificate request without sudo privileges"""
+        certbot_mocks.sudo.side_effect = InsufficientPermissionsError("No sudo")
+        
+        success, message = self.certbot_prod.request_certificate('example.com')
+        
+        assert success is False
+        assert 'No sudo' in message
     
-    @patch('lib.certbot_manager.subprocess.run')
-    @patch('lib.certbot_manager.check_sudo_privileges')
-    def test_renew_certificates(self, mock_sudo, mock_run):
-        """Test certificate renewal"""
-        mock_sudo.return_value = None
-        mock_run.return_value = MagicMock(returncode=0, stdout='Renewal successful')
+    def test_sudo_checked_once_per_instance(self, certbot_mocks):
+        """Test that a successful sudo check is reused"""
+        certbot_mocks.run.return_value = _ok('ok')
         
-        success, message = self.certbot_prod.renew_certificates()
+        self.certbot_prod.renew_certificates()
+        self.certbot_prod.delete_certificate('example.com')
         
-        assert success is True
-        assert 'Renewal successful' in message
+        certbot_mocks.sudo.assert_called_once()
+    
+    def test_get_certificate_info(self, certbot_mocks):
+        """Test getting certificate information"""
+        certbot_mocks.popen.return_value = _popen(_CERT_INFO_OUTPUT)
+        certbot_mocks.isfile.return_value = True
         
-        # Verify command
-        cmd = mock_run.call_args[0][0]
-        assert cmd == ['certbot', 'renew']
+        info = self.certbot.get_certificate_info('example.com')
+        
+        assert info is not None
+        assert 'expiry' in info
+        assert 'cert_path' in info
+        assert 'domains' in info
+        assert info['valid'] is True
     
-    @patch('lib.certbot_manager.subprocess.run')
-    def test_renew_certificates_dry_run(self, mock_run):
-        """Test certificate renewal in dry-run mode"""
-        mock_run.return_value = MagicMock(returncode=0, stdout='Dry run successful')
+    def test_get_certificate_info_not_exists(self, certbot_mocks):
+        """Test getting info for non-existent certificate"""
+        info = self.certbot.get_certificate_info('example.com')
+        assert info is None
+    
+    @pytest.mark.parametrize('dry_run', [False, True], ids=['prod', 'dry-run'])
+    def test_renew_certificates(self, certbot_mocks, dry_run):
+        """Test certificate renewal, with and without --dry-run"""
+        certbot_mocks.run.return_value = _ok(_RENEW_OUTPUT)
+        certbot = self.certbot if dry_run else self.certbot_prod
         
-        success, message = self.certbot.renew_certificates()
+        success, message = certbot.renew_certificates()
         
         assert success is True
+        assert _RENEW_OUTPUT in message
         
-        # Verify dry-run flag
-        cmd = mock_run.call_args[0][0]
-        assert '--dry-run' in cmd
+        # Verify command
+        cmd = certbot_mocks.run.call_args[0][0]
+        assert cmd == (['certbot', 'renew', '--dry-run'] if dry_run else ['certbot', 'renew'])
     
-    @patch('lib.certbot_manager.subprocess.run')
-    def test_list_certificates(self, mock_run):
+    def test_list_certificates(self, certbot_mocks):
         """Test listing certificates"""
-        mock_output = """- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-Certificate Name: example.com
-Domains: example.com www.example.com
-Expiry Date: 2024-03-15 (VALID: 89 days)
-- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-Certificate Name: test.com
-Domains: test.com
-Expiry Date: 2024-01-15 (EXPIRED)
-- - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -"""
-        mock_run.return_value = MagicMock(returncode=0, stdout=mock_output)
+        certbot_mocks.popen.return_value = _popen(_LIST_OUTPUT)
         
         certificates = self.certbot.list_certificates()
         
@@ -183,40 +192,83 @@ Expiry Date: 2024-01-15 (EXPIRED)
         assert certificates[1]['name'] == 'test.com'
         assert certificates[1]['valid'] is False
     
-    @patch('lib.certbot_manager.subprocess.run')
-    @patch('lib.certbot_manager.check_sudo_privileges')
-    def test_revoke_certificate(self, mock_sudo, mock_run):
+    @pytest.mark.parametrize('count', [1, 10, 100])
+    def test_list_certificates_many(self, certbot_mocks, count):
+        """Test that every entry in a long listing is parsed from one certbot run"""
+        separator = '- ' * 40 + '\n'
+        blocks = [
+            f"Certificate Name: site{i}.com\nDomains: site{i}.com www.site{i}.com\n"
+            f"Expiry Date: 2024-03-15 (VALID: 89 days)\n"
+            for i in range(count)
+        ]
+        certbot_mocks.popen.return_value = _popen(separator + separator.join(blocks) + separator)
+        
+        certificates = self.certbot.list_certificates()
+        
+        assert [cert['name'] for cert in certificates] == [f'site{i}.com' for i in range(count)]
+        assert all(cert['valid'] for cert in certificates)
+        assert certificates[-1]['domains'] == [f'site{count - 1}.com', f'www.site{count - 1}.com']
+        certbot_mocks.popen.assert_called_once()
+    
+    def test_list_certificates_invalid_not_valid(self, certbot_mocks):
+        """Test that INVALID is not mistaken for VALID"""
+        certbot_mocks.popen.return_value = _popen(
+            "Certificate Name: example.com\nDomains: example.com\nExpiry Date: 2024-03-15 (INVALID: TEST_CERT)\n"
+        )
+        
+        certificates = self.certbot.list_certificates()
+        
+        assert certificates[0]['valid'] is False
+        assert certificates[0]['expiry'] == '2024-03-15'
+    
+    def test_certificates_cached_until_state_change(self, certbot_mocks):
+        """Test that certbot certificates runs once and is re-run after a delete"""
+        certbot_mocks.run.return_value = _ok('Certificate deleted')
+        output = "Certificate Name: example.com\nDomains: example.com\nExpiry Date: 2024-03-15 (VALID: 89 days)\n"
+        certbot_mocks.popen.side_effect = lambda *args, **kwargs: _popen(output)
+        
+        assert len(self.certbot_prod.list_certificates()) == 1
+        assert self.certbot_prod.check_certificate_exists('example.com') is True
+        assert self.certbot_prod.list_certificates()[0]['name'] == 'example.com'
+        assert certbot_mocks.popen.call_count == 1
+        
+        self.certbot_prod.delete_certificate('example.com')
+        self.certbot_prod.list_certificates()
+        assert certbot_mocks.popen.call_count == 2
+    
+    def test_list_certificates_failure(self, certbot_mocks):
+        """Test that a failing certbot yields no certificates"""
+        certbot_mocks.popen.return_value = _popen('', returncode=1)
+        
+        assert self.certbot.list_certificates() == []
+    
+    def test_revoke_certificate(self, certbot_mocks):
         """Test certificate revocation"""
-        mock_sudo.return_value = None
-        mock_run.return_value = MagicMock(returncode=0, stdout='Certificate revoked')
-        
-        with patch('lib.certbot_manager.Path.exists', return_value=True):
-            success, message = self.certbot_prod.revoke_certificate('example.com', 'keycompromise')
-            
-            assert success is True
-            assert 'Certificate revoked' in message
-            
-            # Verify command
-            cmd = mock_run.call_args[0][0]
-            assert 'certbot' in cmd
-            assert 'revoke' in cmd
-            assert '--reason' in cmd
-            assert 'keycompromise' in cmd
-    
-    def test_revoke_certificate_not_found(self):
+        certbot_mocks.run.return_value = _ok('Certificate revoked')
+        certbot_mocks.isfile.return_value = True
+        
+        success, message = self.certbot_prod.revoke_certificate('example.com', 'keycompromise')
+        
+        assert success is True
+        assert 'Certificate revoked' in message
+        
+        # Verify command
+        cmd = certbot_mocks.run.call_args[0][0]
+        assert 'certbot' in cmd
+        assert 'revoke' in cmd
+        assert '--reason' in cmd
+        assert 'keycompromise' in cmd
+    
+    def test_revoke_certificate_not_found(self, certbot_mocks):
         """Test revoking non-existent certificate"""
-        with patch('lib.certbot_manager.Path.exists', return_value=False):
-            success, message = self.certbot.revoke_certificate('example.com')
-            
-            assert success is False
-            assert 'not found' in message
-    
-    @patch('lib.certbot_manager.subprocess.run')
-    @patch('lib.certbot_manager.check_sudo_privileges')
-    def test_delete_certificate(self, mock_sudo, mock_run):
+        success, message = self.certbot.revoke_certificate('example.com')
+        
+        assert success is False
+        assert 'not found' in message
+    
+    def test_delete_certificate(self, certbot_mocks):
         """Test certificate deletion"""
-        mock_sudo.return_value = None
-        mock_run.return_value = MagicMock(returncode=0, stdout='Certificate deleted')
+        certbot_mocks.run.return_value = _ok('Certificate deleted')
         
         success, message = self.certbot_prod.delete_certificate('example.com')
         
@@ -224,30 +276,44 @@ Expiry Date: 2024-01-15 (EXPIRED)
         assert 'Certificate deleted' in message
         
         # Verify command
-        cmd = mock_run.call_args[0][0]
+        cmd = certbot_mocks.run.call_args[0][0]
         assert 'certbot' in cmd
         assert 'delete' in cmd
         assert '--cert-name' in cmd
         assert 'example.com' in cmd
     
-    @patch('lib.certbot_manager.subprocess.run')
-    def test_command_timeout(self, mock_run):
+    def test_command_timeout(self, certbot_mocks):
         """Test handling of command timeout"""
-        mock_run.side_effect = subprocess.TimeoutExpired('certbot', 60)
+        # Raised straight from the mock; the timeout value is only metadata
+        certbot_mocks.run.side_effect = subprocess.TimeoutExpired('certbot', 0)
+        
+        success, message = self.certbot.request_certificate('example.com')
+        
+        assert success is False
+        assert 'timed out' in message
+        assert certbot_mocks.run.call_args.kwargs['timeout'] == certbot_manager._COMMAND_TIMEOUT
+    
+    def test_certificate_listing_timeout(self, monkeypatch):
+        """Test that a certbot that stops writing without closing stdout is killed"""
+        # A child that prints one entry, then stalls well past the deadline
+        hung = [sys.executable, '-c',
+                'import sys, time; print("Certificate Name: example.com", flush=True); time.sleep(10)']
+        popen = subprocess.Popen
+        monkeypatch.setattr('lib.certbot_manager.subprocess.Popen',
+                            lambda cmd, **kwargs: popen(hung, **kwargs))
+        monkeypatch.setattr(certbot_manager, '_COMMAND_TIMEOUT', 0.5)
+        
+        started = time.monotonic()
+        with pytest.raises(subprocess.TimeoutExpired):
+            list(self.certbot._iter_certificates())
         
-        with patch.object(self.certbot, 'check_certificate_exists', return_value=False):
-            success, message = self.certbot.request_certificate('example.com')
-            
-            assert success is False
-            assert 'timed out' in message
+        assert time.monotonic() - started < 5
     
-    @patch('lib.certbot_manager.subprocess.run')
-    def test_command_failure(self, mock_run):
+    def test_command_failure(self, certbot_mocks):
         """Test handling of command failure"""
-        mock_run.return_value = MagicMock(returncode=1, stderr='Error: Invalid domain')
+        certbot_mocks.run.return_value = SimpleNamespace(returncode=1, stdout='', stderr='Error: Invalid domain')
+        
+        success, message = self.certbot.request_certificate('invalid-domain')
         
-        with patch.object(self.certbot, 'check_certificate_exists', return_value=False):
-            success, message = self.certbot.request_certificate('invalid-domain')
-            
-            assert success is False
-            assert 'Invalid domain' in message
\ No newline at end of file
+        assert success is False
+        assert 'Invalid domain' in message
\ No newline at end of file
@@ -6,30 +6,43 @@ Simple tests that verify the CLI is working without complex mocking.
 """
 
 import subprocess
-import tempfile
+import click
 import yaml
-from pathlib import Path
 import pytest
 
 
+# Text each command's help must contain
+HELP_EXPECTATIONS = {
+    'generate': ['Generate nginx configurations from YAML', '--dry-run', '--no-backup',
+                 '--force', '--sync-dns', '--aws-profile'],
+    'migrate': ['Import existing nginx configurations to YAML format', '--output', '--dry-run'],
+    'ssl': ['Request SSL certificate for domain', '--email', '--dry-run'],
+    'backup': ['Backup and restore nginx configurations', 'create', 'list', 'restore'],
+    'sync-dns': ['Sync DNS records with enabled sites', '--dry-run', '--aws-profile',
+                 '--create-only'],
+}
+
+
+@pytest.fixture(scope='session')
+def command_help(cli):
+    """Help text for every top-level command, rendered once from the click tree."""
+    root = click.Context(cli, info_name='nginx-sites')
+    return {
+        name: command.get_help(click.Context(command, info_name=name, parent=root))
+        for name, command in cli.commands.items()
+    }
+
+
 class TestCLIBasic:
     """Basic CLI functionality tests."""
     
-    def setup_method(self):
-        """Setup test environment"""
-        self.cli_path = Path(__file__).parent.parent / 'nginx-sites'
-        self.temp_dir = Path(tempfile.mkdtemp())
-        
-    def teardown_method(self):
-        """Cleanup test environment"""
-        import shutil
-        shutil.rmtree(self.temp_dir, ignore_errors=True)
-    
-    def test_help_command(self):
-        """Test that help command works"""
+    def test_help_command(self, cli_path):
+        """Test that help command works when the script is run directly"""
+        # Only stdout is checked, so stderr skips the pipe
         result = subprocess.run(
-            ['python3', str(self.cli_path), '--help'],
-            capture_output=True,
+            ['python3', str(cli_path), '--help'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
             text=True
         )
         
@@ -42,114 +55,40 @@ class TestCLIBasic:
         assert 'validate' in result.stdout
         assert 'status' in result.stdout
     
-    def test_generate_help(self):
-        """Test generate command help"""
-        result = subprocess.run(
-            ['python3', str(self.cli_path), 'generate', '--help'],
-            capture_output=True,
-            text=True
-        )
-        
-        assert result.returncode == 0
-        assert 'Generate nginx configurations from YAML' in result.stdout
-        assert '--dry-run' in result.stdout
-        assert '--no-backup' in result.stdout
-        assert '--force' in result.stdout
-        assert '--sync-dns' in result.stdout
-        assert '--aws-profile' in result.stdout
-    
-    def test_migrate_help(self):
-        """Test migrate command help"""
-        result = subprocess.run(
-            ['python3', str(self.cli_path), 'migrate', '--help'],
-            capture_output=True,
-            text=True
-        )
-        
-        assert result.returncode == 0
-        assert 'Import existing nginx configurations to YAML format' in result.stdout
-        assert '--output' in result.stdout
-        assert '--dry-run' in result.stdout
-    
-    def test_ssl_help(self):
-        """Test SSL command help"""
-        result = subprocess.run(
-            ['python3', str(self.cli_path), 'ssl', '--help'],
-            capture_output=True,
-            text=True
-        )
-        
-        assert result.returncode == 0
-        assert 'Request SSL certificate for domain' in result.stdout
-        assert '--email' in result.stdout
-        assert '--dry-run' in result.stdout
+    @pytest.mark.parametrize('command, expected', HELP_EXPECTATIONS.items(),
+                             ids=list(HELP_EXPECTATIONS))
+    def test_command_help(self, command_help, command, expected):
+        """Test each command's help text"""
+        for text in expected:
+            assert text in command_help[command]
     
-    def test_backup_help(self):
-        """Test backup command help"""
-        result = subprocess.run(
-            ['python3', str(self.cli_path), 'backup', '--help'],
-            capture_output=True,
-            text=True
-        )
-        
-        assert result.returncode == 0
-        assert 'Backup and restore nginx configurations' in result.stdout
-        assert 'create' in result.stdout
-        assert 'list' in result.stdout
-        assert 'restore' in result.stdout
-
-    def test_sync_dns_help(self):
-        """Test sync-dns command help"""
-        result = subprocess.run(
-            ['python3', str(self.cli_path), 'sync-dns', '--help'],
-            capture_output=True,
-            text=True
-        )
-        
-        assert result.returncode == 0
-        assert 'Sync DNS records with enabled sites' in result.stdout
-        assert '--dry-run' in result.stdout
-        assert '--aws-profile' in result.stdout
-    
-    def test_status_command(self):
+    def test_status_command(self, cli, runner):
         """Test status command (should work without sudo)"""
-        result = subprocess.run(
-            ['python3', str(self.cli_path), 'status'],
-            capture_output=True,
-            text=True
-        )
+        result = runner.invoke(cli, ['status'])
         
         # Status command should run, even if it reports errors due to permissions
         assert 'Nginx Status:' in result.stdout
         assert 'Configuration Status:' in result.stdout
         assert 'Backup Status:' in result.stdout
     
-    def test_validate_command(self):
+    def test_validate_command(self, cli, runner):
         """Test validate command"""
-        result = subprocess.run(
-            ['python3', str(self.cli_path), 'validate'],
-            capture_output=True,
-            text=True
-        )
+        result = runner.invoke(cli, ['validate'])
         
         # Validate should run and try to validate nginx config
         assert 'Validating nginx configuration' in result.stdout
     
-    def test_generate_missing_config(self):
+    def test_generate_missing_config(self, cli, runner, tmp_path):
         """Test generate with missing configuration file"""
-        missing_config = self.temp_dir / 'missing.yaml'
+        missing_config = tmp_path / 'missing.yaml'
         
-        result = subprocess.run(
-            ['python3', str(self.cli_path), '-c', str(missing_config), 'generate'],
-            capture_output=True,
-            text=True
-        )
+        result = runner.invoke(cli, ['-c', str(missing_config), 'generate'])
         
         # Click validates the path exists before the command runs
-        assert result.returncode == 2
+        assert result.exit_code == 2
         assert 'does not exist' in result.stderr
     
-    def test_generate_dry_run_with_config(self):
+    def test_generate_dry_run_with_config(self, cli, runner, tmp_path):
         """Test generate with dry-run and valid config"""
         # Create a simple test configuration
         test_config = {
@@ -161,44 +100,32 @@ class TestCLIBasic:
             }
         }
         
-        config_file = self.temp_dir / 'test.yaml'
+        config_file = tmp_path / 'test.yaml'
         with open(config_file, 'w') as f:
             yaml.dump(test_config, f)
         
-        result = subprocess.run(
-            ['python3', str(self.cli_path), '-c', str(config_file), 'generate', '--dry-run'],
-            capture_output=True,
-            text=True
-        )
+        result = runner.invoke(cli, ['-c', str(config_file), 'generate', '--dry-run'])
         
-        assert result.returncode == 0
+        assert result.exit_code == 0
         assert 'test.example.com' in result.stdout
         assert 'Dry run complete' in result.stdout
     
-    def test_migrate_dry_run(self):
+    def test_migrate_dry_run(self, cli, runner):
         """Test migrate command with dry-run (should work if /etc/nginx/sites-available exists)"""
-        result = subprocess.run(
-            ['python3', str(self.cli_path), 'migrate', '--dry-run'],
-            capture_output=True,
-            text=True
-        )
+        result = runner.invoke(cli, ['migrate', '--dry-run'])
         
         # Migration should either work or fail gracefully
-        if result.returncode == 0:
+        if result.exit_code == 0:
             assert 'Migration preview:' in result.stdout
         else:
             # If it fails, it should be due to missing directory
             assert 'does not exist' in result.stdout
     
-    def test_backup_list_empty(self):
+    def test_backup_list_empty(self, cli, runner):
         """Test backup list command with empty backup directory"""
-        result = subprocess.run(
-            ['python3', str(self.cli_path), 'backup', 'list'],
-            capture_output=True,
-            text=True
-        )
+        result = runner.invoke(cli, ['backup', 'list'])
         
-        assert result.returncode == 0
+        assert result.exit_code == 0
         assert 'No backups found' in result.stdout or 'backup(s):' in result.stdout
 
 
@@ -1,28 +1,24 @@
 """
-Simple CLI integration tests using subprocess calls.
+Simple CLI integration tests.
 
-These tests verify the nginx-sites command-line interface by executing
-the script as a subprocess, which is more realistic than importing it.
+These tests drive the nginx-sites command-line interface in-process through
+Click's CliRunner; a single help check still executes the script directly to
+cover the shebang entry point.
 """
 
+import logging
 import pytest
 import subprocess
-import tempfile
 import yaml
-from pathlib import Path
+from unittest.mock import MagicMock
 
 
 class TestCLIIntegration:
-    """Test CLI functionality through subprocess calls."""
+    """Test CLI functionality through the click runner."""
     
-    @pytest.fixture
-    def nginx_sites_script(self):
-        """Path to the nginx-sites script."""
-        return Path(__file__).parent.parent / "nginx-sites"
-    
-    @pytest.fixture
-    def temp_config(self):
-        """Create temporary configuration file for testing."""
+    @pytest.fixture(scope="session")
+    def temp_config(self, tmp_path_factory):
+        """Create temporary configuration file for testing (read-only, shared by all tests)."""
         config_content = {
             'defaults': {
                 'enabled': True,
@@ -50,15 +46,19 @@ class TestCLIIntegration:
             }
         }
         
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as f:
-            yaml.dump(config_content, f, default_flow_style=False)
-            return f.name
+        # Per-session directory keeps parallel (pytest-xdist) workers apart
+        config_file = tmp_path_factory.mktemp('config') / 'config.yaml'
+        with open(config_file, 'w') as f:
+            yaml.dump(config_content, f, Dumper=yaml.CSafeDumper, default_flow_style=False)
+        return str(config_file)
     
-    def test_help_command(self, nginx_sites_script):
+    def test_help_command(self, cli_path):
         """Test that help command works."""
+        # Only stdout is checked, so stderr skips the pipe
         result = subprocess.run(
-            [str(nginx_sites_script), '--help'], 
-            capture_output=True, 
+            [str(cli_path), '--help'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
             text=True
         )
         
@@ -66,166 +66,214 @@ class TestCLIIntegration:
         assert 'Nginx Sites Configuration Manager' in result.stdout
         assert 'generate' in result.stdout
     
-    def test_generate_dry_run(self, nginx_sites_script, temp_config):
+    def test_generate_dry_run(self, cli, runner, temp_config):
         """Test generate command with dry-run."""
-        result = subprocess.run([
-            str(nginx_sites_script), 
+        result = runner.invoke(cli, [
             '--config', temp_config,
             'generate', '--dry-run'
-        ], capture_output=True, text=True)
+        ])
         
         # Should work even without sudo since it's dry-run
-        assert result.returncode == 0
+        assert result.exit_code == 0
         assert 'test.example.com' in result.stdout
         assert 'websocket.example.com' in result.stdout
         assert 'disabled.example.com' not in result.stdout
         assert 'Dry run complete' in result.stdout
     
-    def test_validate_command(self, nginx_sites_script, temp_config):
+    def test_generate_primes_ssl_cache(self, cli, runner, temp_config, monkeypatch):
+        """Test that generate checks certificates with one listing for all enabled sites."""
+        primed = []
+        monkeypatch.setattr('lib.generator.NginxGenerator.prime_ssl_cache',
+                            lambda self, domains: primed.append(sorted(domains)))
+        
+        result = runner.invoke(cli, [
+            '--config', temp_config,
+            'generate', '--dry-run'
+        ])
+        
+        assert result.exit_code == 0
+        assert primed == [['test.example.com', 'websocket.example.com']]
+    
+    def test_validate_command(self, cli, runner, temp_config):
         """Test validate command."""
-        result = subprocess.run([
-            str(nginx_sites_script),
+        result = runner.invoke(cli, [
             '--config', temp_config,
             'validate'
-        ], capture_output=True, text=True)
+        ])
         
         # Should validate YAML successfully (nginx validation may fail)
         # Return code 0 or 1 is acceptable depending on nginx availability
-        assert result.returncode in [0, 1]
+        assert result.exit_code in [0, 1]
         assert 'YAML configuration is valid' in result.stdout or 'Error' in result.stderr
     
-    def test_status_command(self, nginx_sites_script, temp_config):
+    def test_status_command(self, cli, runner, temp_config):
         """Test status command."""
-        result = subprocess.run([
-            str(nginx_sites_script),
+        result = runner.invoke(cli, [
             '--config', temp_config,
             'status'
-        ], capture_output=True, text=True)
+        ])
         
         # Should run without error
-        assert result.returncode == 0
+        assert result.exit_code == 0
         assert 'Configuration Status:' in result.stdout
     
-    def test_migrate_dry_run(self, nginx_sites_script):
+    def test_migrate_dry_run(self, cli, cli_module, runner, tmp_path, monkeypatch):
         """Test migrate command with dry-run."""
-        result = subprocess.run([
-            str(nginx_sites_script),
+        # Point the command at a scratch sites-available instead of /etc/nginx
+        sites_available = tmp_path / 'sites-available'
+        sites_available.mkdir()
+        (sites_available / 'test.example.com').write_text(
+            'server {\n'
+            '    listen 443 ssl;\n'
+            '    server_name test.example.com;\n'
+            '    location / {\n'
+            '        proxy_pass http://127.0.0.1:8080;\n'
+            '    }\n'
+            '}\n'
+        )
+        monkeypatch.setattr(cli_module, 'SITES_AVAILABLE', sites_available)
+        
+        result = runner.invoke(cli, [
             'migrate', '--dry-run'
-        ], capture_output=True, text=True)
+        ])
         
-        # Should complete without error even if no sites found
-        assert result.returncode == 0
+        assert result.exit_code == 0
+        assert 'Migration preview:' in result.stdout
+        assert 'test.example.com' in result.stdout
     
-    def test_backup_list(self, nginx_sites_script):
+    def test_backup_list(self, cli, runner):
         """Test backup list command."""
-        result = subprocess.run([
-            str(nginx_sites_script),
+        result = runner.invoke(cli, [
             'backup', 'list'
-        ], capture_output=True, text=True)
+        ])
         
         # Should run without error
-        assert result.returncode == 0
+        assert result.exit_code == 0
         # May show no backups or list existing ones
         assert 'backup' in result.stdout.lower() or 'no backups' in result.stdout.lower()
     
-    def test_invalid_command(self, nginx_sites_script):
+    def test_invalid_command(self, cli, runner):
         """Test invalid command handling."""
-        result = subprocess.run([
-            str(nginx_sites_script),
+        result = runner.invoke(cli, [
             'nonexistent-command'
-        ], capture_output=True, text=True)
+        ])
         
-        assert result.returncode != 0
+        assert result.exit_code != 0
         assert 'No such command' in result.stderr or 'Usage:' in result.stderr
     
-    def test_verbose_flag(self, nginx_sites_script, temp_config):
+    def test_verbose_flag(self, cli, runner, temp_config):
         """Test verbose flag."""
-        result = subprocess.run([
-            str(nginx_sites_script),
-            '--verbose',
-            '--config', temp_config,
-            'status'
-        ], capture_output=True, text=True)
+        root_logger = logging.getLogger()
+        level = root_logger.level
+        try:
+            result = runner.invoke(cli, [
+                '--verbose',
+                '--config', temp_config,
+                'status'
+            ])
+        finally:
+            # --verbose lowers the root logger level process-wide
+            root_logger.setLevel(level)
         
         # Should run successfully
-        assert result.returncode == 0
+        assert result.exit_code == 0
     
-    def test_missing_config_file(self, nginx_sites_script):
+    def test_missing_config_file(self, cli, runner):
         """Test behavior with missing configuration file."""
-        result = subprocess.run([
-            str(nginx_sites_script),
+        result = runner.invoke(cli, [
             '--config', '/nonexistent/config.yaml',
             'generate', '--dry-run'
-        ], capture_output=True, text=True)
+        ])
         
-        assert result.returncode == 2  # Click returns 2 for invalid options
+        assert result.exit_code == 2  # Click returns 2 for invalid options
         assert 'does not exist' in result.stderr
 
-    def test_sync_dns_missing_config(self, nginx_sites_script):
+    def test_sync_dns_missing_config(self, cli, runner):
         """Test sync-dns with missing config file."""
-        result = subprocess.run([
-            str(nginx_sites_script),
+        result = runner.invoke(cli, [
             '--config', '/nonexistent/config.yaml',
             'sync-dns', '--dry-run'
-        ], capture_output=True, text=True)
+        ])
         
-        assert result.returncode == 2  # Click returns 2 for invalid options
+        assert result.exit_code == 2  # Click returns 2 for invalid options
         assert 'does not exist' in result.stderr
 
-    def test_sync_dns_dry_run(self, nginx_sites_script, temp_config):
+    def test_sync_dns_dry_run(self, cli, runner, temp_config):
         """Test sync-dns dry-run command."""
-        result = subprocess.run([
-            str(nginx_sites_script),
+        result = runner.invoke(cli, [
             '--config', temp_config,
             'sync-dns', '--dry-run'
-        ], capture_output=True, text=True)
+        ])
         
         # Should either find no jakekausler.com domains or fail due to AWS credentials
-        assert (result.returncode == 0 and 'No jakekausler.com domains found' in result.stdout) or \
+        assert (result.exit_code == 0 and 'No jakekausler.com domains found' in result.stdout) or \
                'AWS credentials not configured' in result.stderr or \
                'AWS profile' in result.stderr
 
+    def test_sync_dns_create_only_dry_run_lists_overwrites(self, cli, runner, tmp_path, monkeypatch):
+        """Test create-only dry-run previews every upsert, flagging records it would replace."""
+        config_file = tmp_path / 'config.yaml'
+        config_file.write_text(yaml.dump({
+            'sites': {
+                'new.jakekausler.com': {'upstreams': [{'target': '127.0.0.1:8080'}]},
+                'old.jakekausler.com': {'upstreams': [{'target': '127.0.0.1:8081'}]},
+            }
+        }, Dumper=yaml.CSafeDumper))
+
+        client = MagicMock()
+        client.get_paginator.return_value.paginate.return_value = [{
+            'ResourceRecordSets': [
+                {'Name': 'jakekausler.com.', 'Type': 'A', 'TTL': 300,
+                 'ResourceRecords': [{'Value': '1.2.3.4'}]},
+                {'Name': 'old.jakekausler.com.', 'Type': 'A', 'TTL': 300,
+                 'ResourceRecords': [{'Value': '9.9.9.9'}]},
+            ]
+        }]
+        monkeypatch.setenv('ROUTE53_HOSTED_ZONE_ID', 'Z123456789ABCDEF')
+        monkeypatch.setattr('lib.route53_manager._client_for', lambda profile_name: client)
+
+        result = runner.invoke(cli, [
+            '--config', str(config_file),
+            'sync-dns', '--dry-run', '--create-only'
+        ])
+
+        assert result.exit_code == 0
+        assert 'Would upsert records for:' in result.stdout
+        assert 'new.jakekausler.com → 1.2.3.4\n' in result.stdout
+        assert 'old.jakekausler.com → 1.2.3.4 (overwrites 9.9.9.9)' in result.stdout
+        assert 'Would delete' not in result.stdout
+
 
 class TestCLIWorkflow:
     """Test complete CLI workflows."""
     
-    def test_help_hierarchy(self):
+    def test_help_hierarchy(self, cli, runner):
         """Test that all main commands have help."""
-        script = Path(__file__).parent.parent / "nginx-sites"
-        
         # Test main help
-        result = subprocess.run([str(script), '--help'], capture_output=True, text=True)
-        assert result.returncode == 0
+        result = runner.invoke(cli, ['--help'])
+        assert result.exit_code == 0
         
-        # Test subcommand help
-        commands_to_test = ['generate', 'migrate', 'validate', 'status', 'sync-dns']
-        
-        for command in commands_to_test:
-            result = subprocess.run([str(script), command, '--help'], capture_output=True, text=True)
+        # Test subcommand help for every registered command
+        assert {'generate', 'migrate', 'validate', 'status', 'sync-dns'} <= set(cli.commands)
+        for command in cli.commands:
+            result = runner.invoke(cli, [command, '--help'])
             # Should show help for each command
-            assert result.returncode == 0
-            assert '--help' in result.stdout
+            assert result.exit_code == 0
+            assert '--help' in result.output
     
-    def test_config_validation_workflow(self):
+    def test_config_validation_workflow(self, cli, runner, tmp_path):
         """Test the configuration validation workflow."""
-        script = Path(__file__).parent.parent / "nginx-sites"
-        
         # Create invalid YAML
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as f:
-            f.write("invalid: yaml: content: [")
-            invalid_config = f.name
+        invalid_config = tmp_path / 'invalid.yaml'
+        invalid_config.write_text("invalid: yaml: content: [")
         
         # Should fail validation
-        result = subprocess.run([
-            str(script),
-            '--config', invalid_config,
+        result = runner.invoke(cli, [
+            '--config', str(invalid_config),
             'validate'
-        ], capture_output=True, text=True)
-        
-        assert result.returncode == 1
+        ], catch_exceptions=False)
         
-        # Clean up
-        Path(invalid_config).unlink()
+        assert result.exit_code == 1
 
 
 if __name__ == '__main__':
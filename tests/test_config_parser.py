@@ -12,6 +12,12 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from lib.config_parser import ConfigParser
 
+# Write fixtures with the LibYAML C emitter when PyYAML was built with it
+try:
+    from yaml import CSafeDumper as _Dumper
+except ImportError:
+    from yaml import SafeDumper as _Dumper
+
 
 class TestConfigParser:
     """Test suite for ConfigParser class."""
@@ -34,7 +40,7 @@ class TestConfigParser:
                     }
                 }
             }
-            yaml.dump(config, f)
+            yaml.dump(config, f, Dumper=_Dumper)
             temp_path = Path(f.name)
         
         yield temp_path
@@ -43,11 +49,16 @@ class TestConfigParser:
         if temp_path.exists():
             temp_path.unlink()
     
-    @pytest.fixture
-    def fixture_config(self):
+    @pytest.fixture(scope="session")
+    def fixture_config_path(self):
         """Return path to the test fixture configuration."""
         return Path(__file__).parent / 'fixtures' / 'test-config.yaml'
     
+    @pytest.fixture(scope="session")
+    def fixture_parser(self, fixture_config_path):
+        """Parse the test fixture configuration once; tests must not modify it."""
+        return ConfigParser(fixture_config_path)
+    
     def test_load_valid_config(self, temp_config_file):
         """Test loading a valid configuration file."""
         parser = ConfigParser(temp_config_file)
@@ -57,9 +68,9 @@ class TestConfigParser:
         assert len(parser.sites['test.example.com']['upstreams']) == 1
         assert parser.sites['test.example.com']['upstreams'][0]['target'] == '127.0.0.1:8080'
     
-    def test_load_fixture_config(self, fixture_config):
+    def test_load_fixture_config(self, fixture_parser):
         """Test loading the fixture configuration file."""
-        parser = ConfigParser(fixture_config)
+        parser = fixture_parser
         
         # Check that all sites are loaded
         expected_sites = [
@@ -74,9 +85,9 @@ class TestConfigParser:
         for site in expected_sites:
             assert site in parser.sites
     
-    def test_apply_defaults(self, fixture_config):
+    def test_apply_defaults(self, fixture_parser):
         """Test that defaults are properly applied."""
-        parser = ConfigParser(fixture_config)
+        parser = fixture_parser
         
         # Check app.example.com has defaults applied
         app_site = parser.sites['app.example.com']
@@ -85,17 +96,17 @@ class TestConfigParser:
         assert app_site['upstreams'][0]['ws'] is False
         assert app_site['upstreams'][0]['proxy_buffering'] == 'off'
     
-    def test_websocket_configuration(self, fixture_config):
+    def test_websocket_configuration(self, fixture_parser):
         """Test WebSocket configuration parsing."""
-        parser = ConfigParser(fixture_config)
+        parser = fixture_parser
         
         # Check chat.example.com has WebSocket enabled
         chat_site = parser.sites['chat.example.com']
         assert chat_site['upstreams'][0]['ws'] is True
     
-    def test_custom_headers(self, fixture_config):
+    def test_custom_headers(self, fixture_parser):
         """Test custom headers parsing."""
-        parser = ConfigParser(fixture_config)
+        parser = fixture_parser
         
         # Check custom.example.com has headers
         custom_site = parser.sites['custom.example.com']
@@ -103,26 +114,26 @@ class TestConfigParser:
         assert custom_site['upstreams'][0]['headers']['X-Custom-Header'] == 'value'
         assert custom_site['upstreams'][0]['headers']['X-Another-Header'] == 'another-value'
     
-    def test_disabled_site(self, fixture_config):
+    def test_disabled_site(self, fixture_parser):
         """Test disabled site configuration."""
-        parser = ConfigParser(fixture_config)
+        parser = fixture_parser
         
         # Check disabled.example.com is marked as disabled
         disabled_site = parser.sites['disabled.example.com']
         assert disabled_site['enabled'] is False
     
-    def test_static_site(self, fixture_config):
+    def test_static_site(self, fixture_parser):
         """Test static site with root directory."""
-        parser = ConfigParser(fixture_config)
+        parser = fixture_parser
         
         # Check static.example.com has root but no ports
         static_site = parser.sites['static.example.com']
         assert static_site['root'] == '/var/www/static.example.com/html'
         assert 'upstreams' not in static_site
     
-    def test_multiple_routes(self, fixture_config):
+    def test_multiple_routes(self, fixture_parser):
         """Test site with multiple routes."""
-        parser = ConfigParser(fixture_config)
+        parser = fixture_parser
         
         # Check api.example.com has multiple routes
         api_site = parser.sites['api.example.com']
@@ -132,9 +143,9 @@ class TestConfigParser:
         assert api_site['upstreams'][1]['route'] == '/'
         assert api_site['upstreams'][1]['target'] == '192.168.2.148:8745'
     
-    def test_get_site(self, fixture_config):
+    def test_get_site(self, fixture_parser):
         """Test getting a specific site configuration."""
-        parser = ConfigParser(fixture_config)
+        parser = fixture_parser
         
         site = parser.get_site('app.example.com')
         assert site is not None
@@ -144,9 +155,9 @@ class TestConfigParser:
         site = parser.get_site('nonexistent.example.com')
         assert site is None
     
-    def test_get_enabled_sites(self, fixture_config):
+    def test_get_enabled_sites(self, fixture_parser):
         """Test getting only enabled sites."""
-        parser = ConfigParser(fixture_config)
+        parser = fixture_parser
         
         enabled_sites = parser.get_enabled_sites()
         
@@ -155,18 +166,21 @@ class TestConfigParser:
         assert 'app.example.com' in enabled_sites
         assert 'static.example.com' in enabled_sites
     
-    def test_empty_config(self):
+    def test_empty_config(self, tmp_path):
         """Test handling of empty configuration file."""
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as f:
-            f.write('')
-            temp_path = Path(f.name)
+        # Loaded from disk so the file loader's empty-document branch is covered
+        config_file = tmp_path / 'empty.yaml'
+        config_file.write_text('')
         
-        try:
-            parser = ConfigParser(temp_path)
-            assert parser.sites == {}
-            assert parser.defaults == ConfigParser.DEFAULT_CONFIG
-        finally:
-            temp_path.unlink()
+        parser = ConfigParser(config_file)
+        assert parser.sites == {}
+        assert parser.defaults == ConfigParser.DEFAULT_CONFIG
+    
+    def test_from_string_empty(self):
+        """Test handling of an empty configuration string."""
+        parser = ConfigParser.from_string('')
+        assert parser.sites == {}
+        assert parser.defaults == ConfigParser.DEFAULT_CONFIG
     
     def test_missing_config_file(self):
         """Test handling of missing configuration file."""
@@ -187,132 +201,223 @@ class TestConfigParser:
         finally:
             temp_path.unlink()
     
-    def test_validate_config(self, fixture_config):
+    def test_from_string_matches_file(self, temp_config_file):
+        """Test that parsing YAML text gives the same sites as loading the file."""
+        parser = ConfigParser.from_string(temp_config_file.read_text())
+        
+        assert parser.config_path is None
+        assert parser.sites == ConfigParser(temp_config_file).sites
+        assert parser.get_enabled_sites() == {'test.example.com': parser.sites['test.example.com']}
+    
+    def test_from_string_invalid_yaml(self):
+        """Test that invalid YAML text raises YAMLError."""
+        with pytest.raises(yaml.YAMLError):
+            ConfigParser.from_string('invalid: yaml: syntax: here')
+    
+    def test_validate_config(self, fixture_parser):
         """Test configuration validation."""
-        parser = ConfigParser(fixture_config)
+        parser = fixture_parser
         
         errors = parser.validate_config()
         assert len(errors) == 0  # Fixture config should be valid
     
     def test_validate_invalid_domain(self):
         """Test validation with invalid domain name."""
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as f:
-            config = {
-                'sites': {
-                    'invalid domain with spaces': {
-                        'upstreams': [{'target': '127.0.0.1:8080'}]
-                    }
+        config = {
+            'sites': {
+                'invalid domain with spaces': {
+                    'upstreams': [{'target': '127.0.0.1:8080'}]
                 }
             }
-            yaml.dump(config, f)
-            temp_path = Path(f.name)
+        }
         
-        try:
-            parser = ConfigParser(temp_path)
-            errors = parser.validate_config()
-            assert len(errors) > 0
-            assert any('Invalid domain name' in error for error in errors)
-        finally:
-            temp_path.unlink()
+        parser = ConfigParser.from_string(yaml.dump(config, Dumper=_Dumper))
+        errors = parser.validate_config()
+        assert len(errors) > 0
+        assert any('Invalid domain name' in error for error in errors)
     
     def test_validate_missing_port(self):
         """Test validation with missing port field."""
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as f:
-            config = {
-                'sites': {
-                    'test.example.com': {
-                        'upstreams': [
-                            {'route': '/'}  # Missing 'target' field
-                        ]
-                    }
+        config = {
+            'sites': {
+                'test.example.com': {
+                    'upstreams': [
+                        {'route': '/'}  # Missing 'target' field
+                    ]
                 }
             }
-            yaml.dump(config, f)
-            temp_path = Path(f.name)
+        }
         
-        try:
-            parser = ConfigParser(temp_path)
-            errors = parser.validate_config()
-            assert len(errors) > 0
-            assert any("missing 'target' field" in error for error in errors)
-        finally:
-            temp_path.unlink()
+        parser = ConfigParser.from_string(yaml.dump(config, Dumper=_Dumper))
+        errors = parser.validate_config()
+        assert len(errors) > 0
+        assert any("missing 'target' field" in error for error in errors)
     
     def test_validate_invalid_port_format(self):
         """Test validation with invalid port format."""
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as f:
-            config = {
-                'sites': {
-                    'test.example.com': {
-                        'upstreams': [
-                            {'target': '8080'}  # Missing IP address
-                        ]
-                    }
+        config = {
+            'sites': {
+                'test.example.com': {
+                    'upstreams': [
+                        {'target': '8080'}  # Missing IP address
+                    ]
                 }
             }
-            yaml.dump(config, f)
-            temp_path = Path(f.name)
+        }
         
-        try:
-            parser = ConfigParser(temp_path)
-            errors = parser.validate_config()
-            assert len(errors) > 0
-            assert any('invalid target format' in error for error in errors)
-        finally:
-            temp_path.unlink()
+        parser = ConfigParser.from_string(yaml.dump(config, Dumper=_Dumper))
+        errors = parser.validate_config()
+        assert len(errors) > 0
+        assert any('invalid target format' in error for error in errors)
+    
+    def test_validate_target_formats(self):
+        """Test that target validation checks the port, not just for a colon."""
+        config = {
+            'sites': {
+                'test.example.com': {
+                    'upstreams': [
+                        {'target': '127.0.0.1:8080/api'},
+                        {'target': '[::1]:8080'},
+                        {'target': '127.0.0.1:'}
+                    ]
+                }
+            }
+        }
+        
+        parser = ConfigParser.from_string(yaml.dump(config, Dumper=_Dumper))
+        errors = parser.validate_config()
+        assert errors == ["test.example.com: invalid target format '127.0.0.1:' (expected IP:PORT or IP:PORT/path)"]
+    
+    @pytest.mark.parametrize('target', [
+        'http://127.0.0.1:8080',  # Scheme is added by the templates
+        'backend.local',          # No port
+        '[::1]',                  # IPv6 literal without a port
+    ])
+    def test_validate_target_rejected(self, target):
+        """Test target forms the baseline colon check accepted but validation now rejects."""
+        parser = ConfigParser.from_string(yaml.dump(
+            {'sites': {'test.example.com': {'upstreams': [{'target': target}]}}}, Dumper=_Dumper))
+        
+        assert parser.validate_config() == [
+            f"test.example.com: invalid target format '{target}' (expected IP:PORT or IP:PORT/path)"
+        ]
+    
+    @pytest.mark.parametrize('domain, valid', [
+        ('*.example.com', True),
+        ('xn--bcher-kva.example.com', True),  # Punycode form of an internationalized name
+        ('bücher.example.com', False),
+        ('under_score.example.com', False),
+    ])
+    def test_validate_domain_charset(self, domain, valid):
+        """Test that domain names are limited to ASCII hostname characters and wildcards."""
+        parser = ConfigParser.from_string(yaml.dump(
+            {'sites': {domain: {'upstreams': [{'target': '127.0.0.1:8080'}]}}}, Dumper=_Dumper, allow_unicode=True))
+        
+        assert (parser.validate_config() == []) is valid
     
     def test_validate_no_config(self):
         """Test validation with site having neither ports nor root."""
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as f:
-            config = {
-                'sites': {
-                    'test.example.com': {
-                        'enabled': True
-                    }
+        config = {
+            'sites': {
+                'test.example.com': {
+                    'enabled': True
                 }
             }
-            yaml.dump(config, f)
-            temp_path = Path(f.name)
+        }
         
-        try:
-            parser = ConfigParser(temp_path)
-            errors = parser.validate_config()
-            assert len(errors) > 0
-            assert any("must have either 'upstreams' or 'root'" in error for error in errors)
-        finally:
-            temp_path.unlink()
+        parser = ConfigParser.from_string(yaml.dump(config, Dumper=_Dumper))
+        errors = parser.validate_config()
+        assert len(errors) > 0
+        assert any("must have either 'upstreams' or 'root'" in error for error in errors)
     
     def test_custom_defaults(self):
         """Test custom default values override system defaults."""
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.yaml', delete=False) as f:
-            config = {
-                'defaults': {
-                    'enabled': False,
-                    'ws': True,
-                    'route': '/custom/',
-                    'proxy_buffering': 'on'
-                },
-                'sites': {
-                    'test.example.com': {
-                        'upstreams': [{'target': '127.0.0.1:8080'}]
-                    }
+        config = {
+            'defaults': {
+                'enabled': False,
+                'ws': True,
+                'route': '/custom/',
+                'proxy_buffering': 'on'
+            },
+            'sites': {
+                'test.example.com': {
+                    'upstreams': [{'target': '127.0.0.1:8080'}]
                 }
             }
-            yaml.dump(config, f)
-            temp_path = Path(f.name)
+        }
         
-        try:
-            parser = ConfigParser(temp_path)
-            
-            # Check that custom defaults are applied
-            site = parser.sites['test.example.com']
-            assert site['enabled'] is False
-            assert site['upstreams'][0]['ws'] is True
-            assert site['upstreams'][0]['route'] == '/custom/'
-            assert site['upstreams'][0]['proxy_buffering'] == 'on'
-        finally:
-            temp_path.unlink()
-
+        parser = ConfigParser.from_string(yaml.dump(config, Dumper=_Dumper))
+        
+        # Check that custom defaults are applied
+        site = parser.sites['test.example.com']
+        assert site['enabled'] is False
+        assert site['upstreams'][0]['ws'] is True
+        assert site['upstreams'][0]['route'] == '/custom/'
+        assert site['upstreams'][0]['proxy_buffering'] == 'on'
+    
+    def test_yaml_cached_until_file_changes(self, temp_config_file):
+        """Test that an unchanged file is parsed once and a modified file is re-read."""
+        first = ConfigParser(temp_config_file)
+        assert ConfigParser(temp_config_file).raw_config is first.raw_config
+        
+        temp_config_file.write_text(yaml.dump({'sites': {'new.example.com': {'root': '/var/www'}}}, Dumper=_Dumper))
+        
+        parser = ConfigParser(temp_config_file)
+        assert list(parser.sites) == ['new.example.com']
+        # Sites are copies, so the cached document is never modified
+        assert 'enabled' not in parser.raw_config['sites']['new.example.com']
+    
+    def test_defaults_do_not_modify_raw_config(self, temp_config_file):
+        """Test that applying defaults leaves the parsed YAML document untouched."""
+        parser = ConfigParser(temp_config_file)
+        
+        assert parser.sites['test.example.com']['upstreams'][0]['route'] == '/'
+        raw_site = parser.raw_config['sites']['test.example.com']
+        assert raw_site == {'upstreams': [{'target': '127.0.0.1:8080'}]}
+    
+    def test_site_headers_do_not_alias_cached_yaml(self, tmp_path):
+        """Test that mutating a site's upstream headers leaves later parsers unaffected."""
+        config_file = tmp_path / 'config.yaml'
+        config_file.write_text(yaml.dump({
+            'sites': {
+                'test.example.com': {
+                    'upstreams': [{'target': '127.0.0.1:8080', 'headers': {'X-Test': 'yes'}}]
+                }
+            }
+        }, Dumper=_Dumper))
+        
+        first = ConfigParser(config_file)
+        first.get_site('test.example.com')['upstreams'][0]['headers']['X-Injected'] = 'oops'
+        
+        second = ConfigParser(config_file)
+        assert second.raw_config is first.raw_config  # Served from the YAML cache
+        assert second.get_site('test.example.com')['upstreams'][0]['headers'] == {'X-Test': 'yes'}
+    
+    @pytest.mark.parametrize('upstreams, message', [
+        (['127.0.0.1:8080'], 'upstream config 0 must be a dictionary'),
+        ('127.0.0.1:8080', "'upstreams' must be a list"),
+    ])
+    def test_malformed_upstreams_reported(self, upstreams, message):
+        """Test that malformed upstreams are reported by validation instead of failing the load."""
+        parser = ConfigParser.from_string(yaml.dump({
+            'sites': {
+                'bad.example.com': {'upstreams': upstreams},
+                'test.example.com': {'upstreams': [{'target': 'nowhere'}]}
+            }
+        }, Dumper=_Dumper))
+        
+        # Bad entries are dropped so the rest of the config still loads
+        assert parser.sites['bad.example.com']['upstreams'] == []
+        errors = parser.validate_config()
+        assert f"bad.example.com: {message}" in errors
+        # Errors from other sites are still collected alongside
+        assert any('invalid target format' in error for error in errors)
+    
+    def test_null_defaults_and_sites(self):
+        """Test that empty 'defaults:' and 'sites:' keys are treated as empty mappings."""
+        parser = ConfigParser.from_string('defaults:\nsites:\n')
+        assert parser.sites == {}
+        assert parser.defaults == dict(ConfigParser.DEFAULT_CONFIG)
 
 if __name__ == '__main__':
     # Run tests with pytest
@@ -328,6 +328,30 @@ ssl_certificate_key /etc/letsencrypt/live/{{ domain }}/privkey.pem;
         result = generator._check_ssl_exists('nonexistent.example.com')
         assert result is False
     
+    @patch('pathlib.Path.exists')
+    def test_check_ssl_exists_cached(self, mock_exists, temp_template_dir):
+        """Test that each domain's certificate is only looked up once."""
+        generator = NginxGenerator(temp_template_dir)
+        mock_exists.reset_mock()
+        mock_exists.return_value = True
+        
+        assert generator._check_ssl_exists('example.com') is True
+        assert generator._check_ssl_exists('example.com') is True
+        
+        mock_exists.assert_called_once()
+    
+    @patch('lib.generator.os.listdir', return_value=['secure.example.com'])
+    def test_prime_ssl_cache(self, mock_listdir, temp_template_dir):
+        """Test that domains without a live certificate directory skip the per-domain check."""
+        generator = NginxGenerator(temp_template_dir)
+        generator.prime_ssl_cache(['secure.example.com', 'plain.example.com'])
+        
+        with patch('pathlib.Path.exists', return_value=True) as mock_exists:
+            assert generator._check_ssl_exists('plain.example.com') is False
+            mock_exists.assert_not_called()
+            
+            assert generator._check_ssl_exists('secure.example.com') is True
+    
     @patch('lib.generator.NginxGenerator._check_ssl_exists')
     def test_generate_all_sites(self, mock_ssl_check, temp_template_dir):
         """Test generating configurations for multiple sites."""
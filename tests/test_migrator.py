@@ -161,6 +161,54 @@ server {
     assert 'proxy_pass' in blocks[1]
 
 
+@pytest.mark.parametrize('opening', ['server{', 'server\n{', 'server {'],
+                         ids=['no-space', 'next-line', 'spaced'])
+def test_extract_server_blocks_opening_styles(opening):
+    """Test that server blocks are found however the opening brace is written"""
+    content = f"""
+{opening}
+    listen 443 ssl;
+    location / {{
+        proxy_pass http://localhost:8080;
+    }}
+}}
+server {{ listen 80; return 301 https://$host$request_uri; }}
+"""
+    
+    migrator = NginxMigrator(Path('/tmp'))
+    blocks = migrator._extract_server_blocks(content)
+    
+    assert len(blocks) == 2
+    assert blocks[0].startswith(opening)
+    assert blocks[0].rstrip().endswith('}') and 'proxy_pass' in blocks[0]
+    # A block opened and closed on one line
+    assert blocks[1] == 'server { listen 80; return 301 https://$host$request_uri; }'
+
+
+def test_extract_server_blocks_unterminated():
+    """Test that an unterminated block is dropped and scanning resumes at the next server"""
+    content = """
+server {
+    listen 80;
+    location / {
+        proxy_pass http://localhost:8000;
+
+server {
+    listen 443 ssl;
+    location / {
+        proxy_pass http://localhost:8080;
+    }
+}
+"""
+    
+    migrator = NginxMigrator(Path('/tmp'))
+    blocks = migrator._extract_server_blocks(content)
+    
+    assert len(blocks) == 1
+    assert 'listen 443' in blocks[0]
+    assert 'listen 80' not in blocks[0]
+
+
 def test_find_https_block():
     """Test finding HTTPS server block"""
     blocks = [
@@ -269,4 +317,25 @@ def test_handle_invalid_files(tmp_path):
     config = migrator._parse_nginx_config(config_file)
     
     # Should return None for configs without valid server blocks
-    assert config is None
\ No newline at end of file
+    assert config is None
+
+def test_migrate_all_listing(tmp_path):
+    """Test that hidden site files are migrated while the default site and directories are skipped"""
+    site = """
+server {
+    listen 443 ssl;
+    location / {
+        proxy_pass http://127.0.0.1:8080;
+    }
+}"""
+    (tmp_path / '.hidden.example.com').write_text(site)
+    (tmp_path / 'visible.example.com').write_text(site)
+    (tmp_path / 'default').write_text(site)
+    # A directory, even one holding a config, is not a site
+    (tmp_path / 'snippets').mkdir()
+    (tmp_path / 'snippets' / 'nested.example.com').write_text(site)
+    
+    migrator = NginxMigrator(tmp_path)
+    result = migrator.migrate_all()
+    
+    assert sorted(result['sites']) == ['.hidden.example.com', 'visible.example.com']
@@ -0,0 +1,97 @@
+"""
+Tests for permission checking utilities
+"""
+
+import subprocess
+import pytest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from lib import permissions
+from lib.permissions import (
+    InsufficientPermissionsError,
+    check_sudo_privileges,
+    check_systemctl_permissions,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_probe_cache(monkeypatch):
+    """Start every test with no cached sudo/systemctl probe results"""
+    monkeypatch.setattr(permissions, '_SUDO_OK', False)
+    monkeypatch.setattr(permissions, '_SYSTEMCTL_OK', False)
+
+
+@pytest.fixture
+def mock_run(monkeypatch):
+    """Replace subprocess.run as used by the permissions module"""
+    run = MagicMock()
+    monkeypatch.setattr(permissions.subprocess, 'run', run)
+    return run
+
+
+class TestCheckSudoPrivileges:
+    """Test cases for check_sudo_privileges"""
+
+    def test_root_skips_subprocess(self, monkeypatch, mock_run):
+        """Test that running as root passes without probing sudo"""
+        monkeypatch.setattr(permissions.os, 'geteuid', lambda: 0)
+
+        check_sudo_privileges()
+
+        mock_run.assert_not_called()
+
+    def test_success_probed_once(self, monkeypatch, mock_run):
+        """Test that a successful sudo probe is reused by later checks"""
+        monkeypatch.setattr(permissions.os, 'geteuid', lambda: 1000)
+        mock_run.return_value = SimpleNamespace(returncode=0)
+
+        check_sudo_privileges()
+        check_sudo_privileges()
+
+        mock_run.assert_called_once()
+        assert mock_run.call_args[0][0] == ['sudo', '-n', 'true']
+
+    def test_failure_not_cached(self, monkeypatch, mock_run):
+        """Test that a failed sudo probe is retried on the next check"""
+        monkeypatch.setattr(permissions.os, 'geteuid', lambda: 1000)
+        mock_run.return_value = SimpleNamespace(returncode=1)
+
+        with pytest.raises(InsufficientPermissionsError):
+            check_sudo_privileges()
+
+        mock_run.return_value = SimpleNamespace(returncode=0)
+        check_sudo_privileges()
+
+        assert mock_run.call_count == 2
+
+    def test_missing_sudo(self, monkeypatch, mock_run):
+        """Test that a missing sudo binary is reported as insufficient privileges"""
+        monkeypatch.setattr(permissions.os, 'geteuid', lambda: 1000)
+        mock_run.side_effect = FileNotFoundError
+
+        with pytest.raises(InsufficientPermissionsError):
+            check_sudo_privileges()
+
+
+class TestCheckSystemctlPermissions:
+    """Test cases for check_systemctl_permissions"""
+
+    @pytest.mark.parametrize('returncode', [0, 3])
+    def test_success_probed_once(self, mock_run, returncode):
+        """Test that a running or stopped nginx counts as usable and is cached"""
+        mock_run.return_value = SimpleNamespace(returncode=returncode)
+
+        assert check_systemctl_permissions() is True
+        assert check_systemctl_permissions() is True
+
+        mock_run.assert_called_once()
+
+    def test_failure_not_cached(self, mock_run):
+        """Test that a failed systemctl probe is retried on the next check"""
+        mock_run.side_effect = [subprocess.TimeoutExpired('sudo', 10), SimpleNamespace(returncode=0)]
+
+        assert check_systemctl_permissions() is False
+        assert check_systemctl_permissions() is True
+
+        assert mock_run.call_count == 2
@@ -3,15 +3,27 @@ Tests for Route 53 DNS manager
 """
 
 import pytest
+import threading
 from unittest.mock import Mock, patch, MagicMock
 from botocore.exceptions import ClientError, NoCredentialsError
 
+from lib import route53_manager
 from lib.route53_manager import Route53Manager
 
 
 class TestRoute53Manager:
     """Test cases for Route53Manager"""
 
+    @pytest.fixture(autouse=True)
+    def isolated_zone_cache(self, tmp_path, monkeypatch):
+        """Keep the hosted zone ID cache out of the user's home directory"""
+        monkeypatch.setenv('HOME', str(tmp_path))
+        cache_file = tmp_path / '.cache' / 'nginx-configurator' / 'zone_id.json'
+        monkeypatch.delenv('ROUTE53_HOSTED_ZONE_ID', raising=False)
+        route53_manager._session_for.cache_clear()
+        route53_manager._client_for.cache_clear()
+        return cache_file
+
     @pytest.fixture
     def mock_boto3_session(self):
         """Mock boto3.Session for testing"""
@@ -95,6 +107,166 @@ class TestRoute53Manager:
         
         assert manager.hosted_zone_id == 'Z123456789ABCDEF'
 
+    def test_hosted_zone_id_cached(self, mock_boto3_session, sample_hosted_zones, isolated_zone_cache):
+        """Test hosted zone ID is looked up once and then read from the cache"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        
+        Route53Manager()
+        manager = Route53Manager()
+        
+        assert manager.hosted_zone_id == 'Z123456789ABCDEF'
+        assert mock_client.list_hosted_zones.call_count == 1
+        assert isolated_zone_cache.exists()
+        
+        # Cache is per profile
+        Route53Manager(profile_name='other')
+        assert mock_client.list_hosted_zones.call_count == 2
+
+    def test_hosted_zone_id_cache_hit(self, mock_boto3_session, isolated_zone_cache):
+        """Test a cached hosted zone ID is used without listing zones"""
+        mock_session, mock_client = mock_boto3_session
+        isolated_zone_cache.parent.mkdir(parents=True)
+        isolated_zone_cache.write_text('{"route53:jakekausler.com.": "ZCACHED"}')
+        
+        manager = Route53Manager()
+        
+        assert manager.hosted_zone_id == 'ZCACHED'
+        mock_client.list_hosted_zones.assert_not_called()
+
+    def test_hosted_zone_cache_write_failure(self, mock_boto3_session, sample_hosted_zones, tmp_path):
+        """Test an unwritable cache still yields the looked-up zone ID"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        (tmp_path / '.cache').write_text('not a directory')
+        
+        assert Route53Manager().hosted_zone_id == 'Z123456789ABCDEF'
+        assert Route53Manager().hosted_zone_id == 'Z123456789ABCDEF'
+        assert mock_client.list_hosted_zones.call_count == 2
+
+    def test_zone_cache_path_follows_home(self, monkeypatch, tmp_path):
+        """Test the cache location is resolved from HOME when used, not at import"""
+        monkeypatch.setenv('HOME', str(tmp_path / 'elsewhere'))
+        
+        assert route53_manager._zone_cache_path() == \
+            tmp_path / 'elsewhere' / '.cache' / 'nginx-configurator' / 'zone_id.json'
+
+    def test_stale_cached_zone_refreshed(self, mock_boto3_session, sample_hosted_zones,
+                                         sample_record_sets, isolated_zone_cache):
+        """Test a cached zone ID that no longer exists is dropped and looked up again"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        isolated_zone_cache.parent.mkdir(parents=True)
+        isolated_zone_cache.write_text('{"route53:jakekausler.com.": "ZSTALE"}')
+        
+        mock_paginator = Mock()
+        mock_paginator.paginate.side_effect = [
+            ClientError({'Error': {'Code': 'NoSuchHostedZone', 'Message': 'No hosted zone'}},
+                        'ListResourceRecordSets'),
+            sample_record_sets
+        ]
+        mock_client.get_paginator.return_value = mock_paginator
+        
+        manager = Route53Manager()
+        assert manager.hosted_zone_id == 'ZSTALE'
+        
+        records = manager.get_existing_records()
+        
+        assert records['jakekausler.com'] == '1.2.3.4'
+        assert manager.hosted_zone_id == 'Z123456789ABCDEF'
+        assert mock_paginator.paginate.call_args.kwargs['HostedZoneId'] == 'Z123456789ABCDEF'
+        assert 'Z123456789ABCDEF' in isolated_zone_cache.read_text()
+        assert 'ZSTALE' not in isolated_zone_cache.read_text()
+
+    def test_stale_cached_zone_refreshed_on_change(self, mock_boto3_session, sample_hosted_zones,
+                                                   isolated_zone_cache):
+        """Test a change batch is retried against the refreshed zone, ALIAS targets included"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        isolated_zone_cache.parent.mkdir(parents=True)
+        isolated_zone_cache.write_text('{"route53:jakekausler.com.": "ZSTALE"}')
+        mock_client.change_resource_record_sets.side_effect = [
+            ClientError({'Error': {'Code': 'NoSuchHostedZone', 'Message': 'No hosted zone'}},
+                        'ChangeResourceRecordSets'),
+            {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        ]
+        
+        manager = Route53Manager()
+        assert manager._create_alias_record('new.jakekausler.com', 'jakekausler.com') is True
+        
+        kwargs = mock_client.change_resource_record_sets.call_args.kwargs
+        assert kwargs['HostedZoneId'] == 'Z123456789ABCDEF'
+        alias = kwargs['ChangeBatch']['Changes'][0]['ResourceRecordSet']['AliasTarget']
+        assert alias['HostedZoneId'] == 'Z123456789ABCDEF'
+
+    def test_stale_cached_zone_refreshed_once_for_concurrent_batches(self, mock_boto3_session,
+                                                                      sample_hosted_zones,
+                                                                      isolated_zone_cache):
+        """Test concurrent batches that all hit a stale zone share a single refresh"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        isolated_zone_cache.parent.mkdir(parents=True)
+        isolated_zone_cache.write_text('{"route53:jakekausler.com.": "ZSTALE"}')
+        
+        # Every batch fails against the stale zone before any of them refreshes it
+        stale_calls = threading.Barrier(3, timeout=5)
+        def change_records(HostedZoneId, ChangeBatch):
+            if HostedZoneId == 'ZSTALE':
+                stale_calls.wait()
+                raise ClientError({'Error': {'Code': 'NoSuchHostedZone', 'Message': 'No hosted zone'}},
+                                  'ChangeResourceRecordSets')
+            return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        mock_client.change_resource_record_sets.side_effect = change_records
+        
+        manager = Route53Manager()
+        enabled_domains = [f'site{i:04d}.jakekausler.com' for i in range(1200)]
+        
+        created, deleted = manager.sync_dns_records(enabled_domains, create_only=True)
+        
+        assert (created, deleted) == (1200, 0)
+        mock_client.list_hosted_zones.assert_called_once()
+        assert mock_client.change_resource_record_sets.call_count == 6
+        assert manager.hosted_zone_id == 'Z123456789ABCDEF'
+    
+    def test_missing_zone_not_retried_without_cache(self, mock_boto3_session):
+        """Test an explicitly supplied zone ID is not replaced on NoSuchHostedZone"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.change_resource_record_sets.side_effect = ClientError(
+            {'Error': {'Code': 'NoSuchHostedZone', 'Message': 'No hosted zone'}},
+            'ChangeResourceRecordSets'
+        )
+        
+        manager = Route53Manager(hosted_zone_id='ZEXPLICIT')
+        
+        assert manager._create_a_record('new.jakekausler.com', '1.2.3.4') is False
+        mock_client.change_resource_record_sets.assert_called_once()
+        mock_client.list_hosted_zones.assert_not_called()
+
+    def test_session_shared_across_instances(self, mock_boto3_session, sample_hosted_zones):
+        """Test boto3 session and client are created once per profile"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        
+        first = Route53Manager()
+        second = Route53Manager()
+        
+        assert first._get_client() is second._get_client()
+        mock_session.assert_called_once_with(profile_name='route53')
+        
+        # Client retries throttled requests with adaptive backoff
+        config = mock_session.return_value.client.call_args.kwargs['config']
+        assert config.retries == {'max_attempts': 10, 'mode': 'adaptive'}
+
+    def test_hosted_zone_id_from_environment(self, mock_boto3_session, monkeypatch):
+        """Test hosted zone ID can be supplied via the environment"""
+        mock_session, mock_client = mock_boto3_session
+        monkeypatch.setenv('ROUTE53_HOSTED_ZONE_ID', 'ZENV123')
+        
+        manager = Route53Manager()
+        
+        assert manager.hosted_zone_id == 'ZENV123'
+        mock_client.list_hosted_zones.assert_not_called()
+
     def test_find_hosted_zone_not_found(self, mock_boto3_session):
         """Test hosted zone not found"""
         mock_session, mock_client = mock_boto3_session
@@ -138,34 +310,144 @@ class TestRoute53Manager:
         }
         assert records == expected_records
 
-    def test_get_main_domain_ip(self, mock_boto3_session, sample_hosted_zones, sample_record_sets):
-        """Test getting main domain IP address"""
+    def test_get_existing_records_stops_after_subtree(self, mock_boto3_session, sample_hosted_zones):
+        """Test listing starts at jakekausler.com and stops once past its subtree"""
         mock_session, mock_client = mock_boto3_session
         mock_client.list_hosted_zones.return_value = sample_hosted_zones
         
         mock_paginator = Mock()
-        mock_paginator.paginate.return_value = sample_record_sets
+        mock_paginator.paginate.return_value = [
+            {'ResourceRecordSets': [
+                {'Name': 'jakekausler.com.', 'Type': 'A', 'TTL': 300,
+                 'ResourceRecords': [{'Value': '1.2.3.4'}]},
+                {'Name': 'a.jakekausler.com.', 'Type': 'A', 'TTL': 300,
+                 'ResourceRecords': [{'Value': '1.2.3.4'}]},
+                {'Name': 'jakekauslerx.com.', 'Type': 'A', 'TTL': 300,
+                 'ResourceRecords': [{'Value': '5.6.7.8'}]},
+            ]},
+            {'ResourceRecordSets': [
+                {'Name': 'z.jakekausler.com.', 'Type': 'A', 'TTL': 300,
+                 'ResourceRecords': [{'Value': '1.2.3.4'}]},
+            ]},
+        ]
         mock_client.get_paginator.return_value = mock_paginator
         
+        manager = Route53Manager()
+        records = manager.get_existing_records()
+        
+        assert records == {'jakekausler.com': '1.2.3.4', 'a.jakekausler.com': '1.2.3.4'}
+        mock_paginator.paginate.assert_called_once_with(
+            HostedZoneId='Z123456789ABCDEF',
+            StartRecordName='jakekausler.com.',
+            StartRecordType='A'
+        )
+
+    def test_iter_records_is_lazy(self, mock_boto3_session, sample_hosted_zones, sample_record_sets):
+        """Test iter_records fetches pages only as they are consumed"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        
+        fetched = []
+        def pages(**kwargs):
+            for page in sample_record_sets * 2:
+                fetched.append(page)
+                yield page
+        mock_paginator = Mock()
+        mock_paginator.paginate.side_effect = pages
+        mock_client.get_paginator.return_value = mock_paginator
+        
+        manager = Route53Manager()
+        name, value, record = next(manager.iter_records())
+        
+        assert (name, value) == ('jakekausler.com', '1.2.3.4')
+        assert record['TTL'] == 300
+        assert len(fetched) == 1
+
+    def test_get_main_domain_ip(self, mock_boto3_session, sample_hosted_zones, sample_record_sets):
+        """Test getting main domain IP address"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        mock_client.list_resource_record_sets.return_value = {
+            'ResourceRecordSets': sample_record_sets[0]['ResourceRecordSets'][:1]
+        }
+        
         manager = Route53Manager()
         ip = manager.get_main_domain_ip()
         
         assert ip == '1.2.3.4'
+        # Single-record lookup rather than a zone listing
+        mock_client.list_resource_record_sets.assert_called_once_with(
+            HostedZoneId='Z123456789ABCDEF',
+            StartRecordName='jakekausler.com.',
+            StartRecordType='A',
+            MaxItems='1'
+        )
+        mock_client.get_paginator.assert_not_called()
 
     def test_get_main_domain_ip_not_found(self, mock_boto3_session, sample_hosted_zones):
         """Test error when main domain IP not found"""
         mock_session, mock_client = mock_boto3_session
         mock_client.list_hosted_zones.return_value = sample_hosted_zones
         
-        mock_paginator = Mock()
-        mock_paginator.paginate.return_value = [{'ResourceRecordSets': []}]
-        mock_client.get_paginator.return_value = mock_paginator
+        # Route 53 returns the next record in sort order when there is no match
+        mock_client.list_resource_record_sets.return_value = {
+            'ResourceRecordSets': [{
+                'Name': 'jakekausler.com.',
+                'Type': 'NS',
+                'TTL': 172800,
+                'ResourceRecords': [{'Value': 'ns1.example.com'}]
+            }]
+        }
         
         manager = Route53Manager()
         
         with pytest.raises(Exception, match="jakekausler.com A record not found"):
             manager.get_main_domain_ip()
 
+    def test_get_main_domain_ip_alias(self, mock_boto3_session, sample_hosted_zones):
+        """Test error when main domain is an ALIAS record"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        mock_client.list_resource_record_sets.return_value = {
+            'ResourceRecordSets': [{
+                'Name': 'jakekausler.com.',
+                'Type': 'A',
+                'AliasTarget': {'DNSName': 'lb.example.com.', 'EvaluateTargetHealth': False,
+                                'HostedZoneId': 'Z1'}
+            }]
+        }
+        
+        manager = Route53Manager()
+        
+        with pytest.raises(Exception, match="is an ALIAS record"):
+            manager.get_main_domain_ip()
+
+    def test_get_main_domain_ip_reuses_listing(self, mock_boto3_session, sample_hosted_zones, sample_record_sets):
+        """Test main domain IP comes from a prior listing until records change"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        
+        mock_paginator = Mock()
+        mock_paginator.paginate.return_value = sample_record_sets
+        mock_client.get_paginator.return_value = mock_paginator
+        mock_client.change_resource_record_sets.return_value = {
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        
+        manager = Route53Manager()
+        manager.get_existing_records()
+        
+        assert manager.get_main_domain_ip() == '1.2.3.4'
+        mock_client.list_resource_record_sets.assert_not_called()
+        
+        # A successful change invalidates the cached listing
+        manager.sync_dns_records(['jakekausler.com', 'new.jakekausler.com'])
+        mock_client.list_resource_record_sets.return_value = {
+            'ResourceRecordSets': sample_record_sets[0]['ResourceRecordSets'][:1]
+        }
+        assert manager.get_main_domain_ip() == '1.2.3.4'
+        mock_client.list_resource_record_sets.assert_called_once()
+
     def test_sync_dns_records_create_only(self, mock_boto3_session, sample_hosted_zones, sample_record_sets):
         """Test syncing DNS records - create new records only"""
         mock_session, mock_client = mock_boto3_session
@@ -187,7 +469,10 @@ class TestRoute53Manager:
         
         assert created == 2  # new.jakekausler.com and another.jakekausler.com
         assert deleted == 1  # test.jakekausler.com should be deleted
-        assert mock_client.change_resource_record_sets.call_count == 3
+        # All changes are submitted in a single batch
+        assert mock_client.change_resource_record_sets.call_count == 1
+        changes = mock_client.change_resource_record_sets.call_args.kwargs['ChangeBatch']['Changes']
+        assert sorted(c['Action'] for c in changes) == ['DELETE', 'UPSERT', 'UPSERT']
 
     def test_sync_dns_records_delete_only(self, mock_boto3_session, sample_hosted_zones, sample_record_sets):
         """Test syncing DNS records - delete obsolete records only"""
@@ -230,6 +515,94 @@ class TestRoute53Manager:
         assert deleted == 0
         assert mock_client.change_resource_record_sets.call_count == 0
 
+    def test_sync_dns_records_create_only_skips_listing(self, mock_boto3_session, sample_hosted_zones):
+        """Test create-only sync upserts enabled domains without listing records"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        mock_client.change_resource_record_sets.return_value = {
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        
+        manager = Route53Manager()
+        enabled_domains = ['jakekausler.com', 'test.jakekausler.com', 'new.jakekausler.com', 'external.com']
+        
+        created, deleted = manager.sync_dns_records(enabled_domains, create_only=True)
+        
+        assert created == 2
+        assert deleted == 0
+        mock_client.get_paginator.assert_not_called()
+        changes = mock_client.change_resource_record_sets.call_args.kwargs['ChangeBatch']['Changes']
+        assert [(c['Action'], c['ResourceRecordSet']['Name']) for c in changes] == [
+            ('UPSERT', 'new.jakekausler.com'),
+            ('UPSERT', 'test.jakekausler.com'),
+        ]
+
+    def test_sync_dns_records_create_only_overwrites_a_record(self, mock_boto3_session, sample_hosted_zones):
+        """Test create-only sync replaces an existing plain A record and counts it as upserted"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        mock_client.change_resource_record_sets.return_value = {
+            'ResponseMetadata': {'HTTPStatusCode': 200}
+        }
+        # test.jakekausler.com already exists as an A record pointing elsewhere
+        mock_client.get_paginator.return_value.paginate.return_value = [{
+            'ResourceRecordSets': [{
+                'Name': 'test.jakekausler.com.',
+                'Type': 'A',
+                'TTL': 300,
+                'ResourceRecords': [{'Value': '9.9.9.9'}]
+            }]
+        }]
+
+        manager = Route53Manager()
+        created, deleted = manager.sync_dns_records(['test.jakekausler.com'], create_only=True)
+
+        assert (created, deleted) == (1, 0)
+        mock_client.get_paginator.assert_not_called()
+        changes = mock_client.change_resource_record_sets.call_args.kwargs['ChangeBatch']['Changes']
+        assert changes == [{
+            'Action': 'UPSERT',
+            'ResourceRecordSet': {
+                'Name': 'test.jakekausler.com',
+                'Type': 'A',
+                'AliasTarget': {
+                    'DNSName': 'jakekausler.com',
+                    'EvaluateTargetHealth': False,
+                    'HostedZoneId': 'Z123456789ABCDEF'
+                }
+            }
+        }]
+
+    def test_sync_dns_records_batches_large_changes(self, mock_boto3_session, sample_hosted_zones, sample_record_sets):
+        """Test that large syncs are split into batches"""
+        mock_session, mock_client = mock_boto3_session
+        mock_client.list_hosted_zones.return_value = sample_hosted_zones
+        
+        mock_paginator = Mock()
+        mock_paginator.paginate.return_value = sample_record_sets
+        mock_client.get_paginator.return_value = mock_paginator
+        
+        # Full batch succeeds, partial batch fails (batches run concurrently)
+        def change_records(HostedZoneId, ChangeBatch):
+            if len(ChangeBatch['Changes']) < 500:
+                raise ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}},
+                                  'ChangeResourceRecordSets')
+            return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        mock_client.change_resource_record_sets.side_effect = change_records
+        
+        manager = Route53Manager()
+        enabled_domains = ['jakekausler.com', 'test.jakekausler.com']
+        enabled_domains += [f'site{i:03d}.jakekausler.com' for i in range(600)]
+        
+        created, deleted = manager.sync_dns_records(enabled_domains)
+        
+        assert mock_client.change_resource_record_sets.call_count == 2
+        batches = [c.kwargs['ChangeBatch']['Changes']
+                   for c in mock_client.change_resource_record_sets.call_args_list]
+        assert sorted(len(b) for b in batches) == [100, 500]
+        assert created == 500
+        assert deleted == 0
+
     def test_create_a_record_success(self, mock_boto3_session, sample_hosted_zones):
         """Test successful A record creation"""
         mock_session, mock_client = mock_boto3_session
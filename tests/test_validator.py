@@ -3,6 +3,7 @@
 Unit tests for nginx validation functionality.
 """
 
+import asyncio
 import pytest
 import subprocess
 from pathlib import Path
@@ -17,6 +18,12 @@ from lib.validator import NginxValidator
 class TestNginxValidator:
     """Test cases for NginxValidator class."""
     
+    @pytest.fixture(autouse=True)
+    def no_path_lookup(self):
+        """Keep binary names as given regardless of what is installed."""
+        with patch('lib.validator.shutil.which', return_value=None):
+            yield
+    
     @pytest.fixture
     def validator(self):
         """Create a NginxValidator instance."""
@@ -40,13 +47,27 @@ class TestNginxValidator:
         assert custom_validator.nginx_binary == '/usr/sbin/nginx'
         assert custom_validator.systemctl_binary == '/usr/bin/systemctl'
     
+    @patch('lib.validator.subprocess.run')
+    def test_binaries_resolved_once(self, mock_run):
+        """Test binaries are resolved on PATH when set, not per call."""
+        mock_run.return_value = MagicMock(returncode=0, stderr=b'', stdout=b'')
+        
+        with patch('lib.validator.shutil.which', side_effect=lambda name: f'/usr/sbin/{name}') as mock_which:
+            validator = NginxValidator()
+            validator.validate_config()
+            validator.validate_config()
+        
+        assert validator.nginx_binary == 'nginx'
+        assert mock_which.call_count == 2  # nginx and systemctl
+        assert mock_run.call_args.args[0] == ['/usr/sbin/nginx', '-t']
+    
     @patch('lib.validator.subprocess.run')
     def test_validate_config_success(self, mock_run, validator):
         """Test successful configuration validation."""
         mock_run.return_value = MagicMock(
             returncode=0,
-            stderr='nginx: configuration file /etc/nginx/nginx.conf test is successful',
-            stdout=''
+            stderr=b'nginx: configuration file /etc/nginx/nginx.conf test is successful',
+            stdout=b''
         )
         
         valid, message = validator.validate_config()
@@ -56,7 +77,6 @@ class TestNginxValidator:
         mock_run.assert_called_once_with(
             ['nginx', '-t'],
             capture_output=True,
-            text=True,
             timeout=10
         )
     
@@ -65,8 +85,8 @@ class TestNginxValidator:
         """Test failed configuration validation."""
         mock_run.return_value = MagicMock(
             returncode=1,
-            stderr='nginx: [emerg] unexpected "}" in /etc/nginx/sites-enabled/test.com:5',
-            stdout=''
+            stderr=b'nginx: [emerg] unexpected "}" in /etc/nginx/sites-enabled/test.com:5',
+            stdout=b''
         )
         
         valid, message = validator.validate_config()
@@ -94,54 +114,116 @@ class TestNginxValidator:
         assert valid is False
         assert 'not found' in message.lower()
     
+    def test_validate_config_async(self, tmp_path):
+        """Test async validation against a stand-in nginx binary."""
+        nginx = tmp_path / 'nginx'
+        nginx.write_text('#!/bin/sh\necho "nginx: configuration file test is successful" >&2\n')
+        nginx.chmod(0o755)
+        validator = NginxValidator(nginx_binary=str(nginx))
+        
+        valid, message = asyncio.run(validator.validate_config_async())
+        
+        assert valid is True
+        assert 'test is successful' in message
+        
+        nginx.write_text('#!/bin/sh\necho "nginx: [emerg] unexpected \\"}\\"" >&2\nexit 1\n')
+        valid, message = asyncio.run(validator.validate_config_async())
+        
+        assert valid is False
+        assert 'unexpected "}"' in message
+    
+    def test_validate_config_async_nginx_not_found(self, tmp_path):
+        """Test async validation when nginx binary is not found."""
+        validator = NginxValidator(nginx_binary=str(tmp_path / 'missing'))
+        
+        valid, message = asyncio.run(validator.validate_config_async())
+        
+        assert valid is False
+        assert 'not found' in message.lower()
+    
     @patch('lib.validator.subprocess.run')
     def test_reload_nginx_success(self, mock_run, validator):
         """Test successful nginx reload."""
-        # Mock both validation and reload calls
-        mock_run.side_effect = [
-            MagicMock(returncode=0, stderr='test is successful', stdout=''),  # validation
-            MagicMock(returncode=0, stderr='', stdout='')  # reload
-        ]
+        mock_run.return_value = MagicMock(returncode=0, stderr='', stdout='test is successful')
         
         success, message = validator.reload_nginx()
         
         assert success is True
         assert 'successfully' in message.lower()
-        assert mock_run.call_count == 2
         
-        # Check both calls
-        calls = mock_run.call_args_list
-        assert calls[0] == call(['nginx', '-t'], capture_output=True, text=True, timeout=10)
-        assert calls[1] == call(['systemctl', 'reload', 'nginx'], capture_output=True, text=True, timeout=10)
+        # Validation and reload share a single shell invocation
+        mock_run.assert_called_once()
+        argv = mock_run.call_args.args[0]
+        assert argv[:2] == ['sh', '-c']
+        assert '"$1" -t' in argv[2]
+        assert argv[3:] == ['sh', 'nginx', 'systemctl']
     
     @patch('lib.validator.subprocess.run')
     def test_reload_nginx_validation_fails(self, mock_run, validator):
         """Test reload aborted when validation fails."""
         mock_run.return_value = MagicMock(
-            returncode=1,
-            stderr='nginx: [emerg] invalid configuration',
-            stdout=''
+            returncode=254,
+            stderr='',
+            stdout='nginx: [emerg] invalid configuration'
         )
         
         success, message = validator.reload_nginx()
         
         assert success is False
         assert 'validation failed' in message.lower()
-        # Should only call validation, not reload
+        assert 'invalid configuration' in message
         mock_run.assert_called_once()
     
     @patch('lib.validator.subprocess.run')
     def test_reload_nginx_reload_fails(self, mock_run, validator):
         """Test handling when reload command fails."""
-        mock_run.side_effect = [
-            MagicMock(returncode=0, stderr='test is successful', stdout=''),  # validation succeeds
-            MagicMock(returncode=1, stderr='Failed to reload nginx.service', stdout='')  # reload fails
-        ]
+        mock_run.return_value = MagicMock(
+            returncode=1,
+            stderr='Failed to reload nginx.service',
+            stdout='test is successful'
+        )
         
         success, message = validator.reload_nginx()
         
         assert success is False
         assert 'Failed to reload' in message
+        assert 'validation failed' not in message.lower()
+    
+    def test_reload_nginx_runs_script(self, tmp_path):
+        """Test the reload script against stand-in binaries."""
+        nginx = tmp_path / 'nginx'
+        nginx.write_text('#!/bin/sh\necho "nginx: [emerg] bad config" >&2\nexit 1\n')
+        nginx.chmod(0o755)
+        systemctl = tmp_path / 'systemctl'
+        systemctl.write_text('#!/bin/sh\ntouch "$0.ran"\n')
+        systemctl.chmod(0o755)
+        
+        validator = NginxValidator(nginx_binary=str(nginx), systemctl_binary=str(systemctl))
+        success, message = validator.reload_nginx()
+        
+        assert success is False
+        assert 'validation failed' in message.lower()
+        assert 'bad config' in message
+        assert not (tmp_path / 'systemctl.ran').exists()
+        
+        nginx.write_text('#!/bin/sh\nexit 0\n')
+        success, message = validator.reload_nginx()
+        
+        assert success is True
+        assert (tmp_path / 'systemctl.ran').exists()
+    
+    def test_reload_nginx_missing_systemctl(self, tmp_path):
+        """Test that a missing systemctl is reported as such rather than as a reload failure."""
+        nginx = tmp_path / 'nginx'
+        nginx.write_text('#!/bin/sh\nexit 0\n')
+        nginx.chmod(0o755)
+        missing = str(tmp_path / 'no-such-systemctl')
+        
+        validator = NginxValidator(nginx_binary=str(nginx), systemctl_binary=missing)
+        success, message = validator.reload_nginx()
+        
+        assert success is False
+        assert message == f"systemctl binary not found: {missing}"
     
     @patch('lib.validator.subprocess.run')
     def test_check_syntax_file_not_found(self, mock_run, validator):
@@ -205,15 +287,37 @@ class TestNginxValidator:
         
         assert version is None
     
+    @patch('lib.validator.subprocess.run')
+    def test_get_nginx_version_cached(self, mock_run, validator):
+        """Test nginx -v runs once per binary."""
+        mock_run.return_value = MagicMock(
+            returncode=0,
+            stderr='nginx version: nginx/1.18.0 (Ubuntu)',
+            stdout=''
+        )
+        
+        assert validator.get_nginx_version() == '1.18.0'
+        assert validator.get_nginx_version() == '1.18.0'
+        assert mock_run.call_count == 1
+        
+        # A different binary is probed separately
+        validator.nginx_binary = '/opt/nginx/sbin/nginx'
+        validator.get_nginx_version()
+        assert mock_run.call_count == 2
+        
+        validator.invalidate_caches()
+        validator.get_nginx_version()
+        assert mock_run.call_count == 3
+    
     @patch('lib.validator.subprocess.run')
     def test_get_loaded_modules(self, mock_run, validator):
         """Test getting loaded nginx modules."""
         mock_run.return_value = MagicMock(
             returncode=0,
-            stderr='''nginx version: nginx/1.18.0
+            stderr=b'''nginx version: nginx/1.18.0
 configure arguments: --with-http_ssl_module --with-http_v2_module --with-http_realip_module
 --add-module=/build/nginx/modules/ngx_http_geoip_module''',
-            stdout=''
+            stdout=b''
         )
         
         modules = validator.get_loaded_modules()
@@ -223,6 +327,21 @@ configure arguments: --with-http_ssl_module --with-http_v2_module --with-http_re
         assert 'http_realip' in modules
         assert 'ngx_http_geoip_module' in modules
     
+    @patch('lib.validator.subprocess.run')
+    def test_get_loaded_modules_cached(self, mock_run, validator):
+        """Test nginx -V runs once and callers get independent lists."""
+        mock_run.return_value = MagicMock(
+            returncode=0,
+            stderr=b'configure arguments: --with-http_ssl_module',
+            stdout=b''
+        )
+        
+        modules = validator.get_loaded_modules()
+        modules.append('mutated')
+        
+        assert validator.get_loaded_modules() == ['http_ssl']
+        mock_run.assert_called_once()
+    
     @patch('lib.validator.subprocess.run')
     def test_get_loaded_modules_error(self, mock_run, validator):
         """Test module retrieval error handling."""
@@ -240,12 +359,12 @@ configure arguments: --with-http_ssl_module --with-http_v2_module --with-http_re
             assert valid is False
             assert 'not found' in message
     
-    @patch('lib.validator.Path.read_text')
+    @patch('lib.validator.Path.read_bytes')
     @patch('lib.validator.Path.exists')
     def test_test_site_config_duplicate_server_name(self, mock_exists, mock_read, validator):
         """Test detection of duplicate server_name directives."""
         mock_exists.return_value = True
-        mock_read.return_value = '''
+        mock_read.return_value = b'''
         server {
             server_name test.com;
             server_name www.test.com;
@@ -258,12 +377,72 @@ configure arguments: --with-http_ssl_module --with-http_v2_module --with-http_re
         assert valid is False
         assert 'Multiple server_name' in message
     
-    @patch('lib.validator.Path.read_text')
+    @patch('lib.validator.NginxValidator.validate_config')
+    @patch('lib.validator.Path.read_bytes')
+    @patch('lib.validator.Path.exists')
+    def test_test_site_config_server_names_per_block(self, mock_exists, mock_read, mock_validate, validator):
+        """Test server_name directives are counted per server block."""
+        mock_exists.return_value = True
+        mock_validate.return_value = (True, 'Configuration is valid')
+        
+        # One server_name in each block, with nested location blocks
+        mock_read.return_value = b'''
+        server {
+            server_name test.com;
+            location / {
+                proxy_pass http://localhost:8080;
+            }
+        }
+        server{
+            listen 443 ssl;
+            server_name www.test.com;
+        }
+        '''
+        valid, message = validator.test_site_config('test.com')
+        assert valid is True
+        
+        # Same totals, but both names in one block
+        mock_read.return_value = b'''
+        server {
+            server_name test.com;
+            location / {
+                proxy_pass http://localhost:8080;
+            }
+            server_name www.test.com;
+        }
+        server {
+            listen 443 ssl;
+        }
+        '''
+        valid, message = validator.test_site_config('test.com')
+        assert valid is False
+        assert 'Multiple server_name' in message
+    
+    @patch('lib.validator.NginxValidator.validate_config')
+    @patch('lib.validator.Path.read_bytes')
+    @patch('lib.validator.Path.exists')
+    def test_test_site_config_server_name_comments(self, mock_exists, mock_read, mock_validate, validator):
+        """Test commented-out server_name directives are not counted."""
+        mock_exists.return_value = True
+        mock_validate.return_value = (True, 'Configuration is valid')
+        mock_read.return_value = b'''
+        server {
+            # server_name old.test.com;
+            server_name test.com www.test.com;
+            listen 80;
+        }
+        '''
+        
+        valid, message = validator.test_site_config('test.com')
+        
+        assert valid is True
+    
+    @patch('lib.validator.Path.read_bytes')
     @patch('lib.validator.Path.exists')
     def test_test_site_config_missing_semicolon(self, mock_exists, mock_read, validator):
         """Test detection of missing semicolons."""
         mock_exists.return_value = True
-        mock_read.return_value = '''
+        mock_read.return_value = b'''
         server {
             server_name test.com
             listen 80;
@@ -275,12 +454,31 @@ configure arguments: --with-http_ssl_module --with-http_v2_module --with-http_re
         assert valid is False
         assert 'Missing semicolon' in message
     
-    @patch('lib.validator.Path.read_text')
+    @patch('lib.validator.NginxValidator.validate_config')
+    @patch('lib.validator.Path.read_bytes')
+    @patch('lib.validator.Path.exists')
+    def test_test_site_config_ignores_comments(self, mock_exists, mock_read, mock_validate, validator):
+        """Test commented-out directives are not checked for semicolons."""
+        mock_exists.return_value = True
+        mock_read.return_value = b'''
+        server {
+            # listen 8080
+            listen 80;\r
+            server_name test.com;
+        }
+        '''
+        mock_validate.return_value = (True, 'Configuration is valid')
+        
+        valid, message = validator.test_site_config('test.com')
+        
+        assert valid is True
+    
+    @patch('lib.validator.Path.read_bytes')
     @patch('lib.validator.Path.exists')
     def test_test_site_config_unmatched_braces(self, mock_exists, mock_read, validator):
         """Test detection of unmatched braces."""
         mock_exists.return_value = True
-        mock_read.return_value = '''
+        mock_read.return_value = b'''
         server {
             server_name test.com;
             location / {
@@ -294,12 +492,12 @@ configure arguments: --with-http_ssl_module --with-http_v2_module --with-http_re
         assert 'Unmatched braces' in message
     
     @patch('lib.validator.NginxValidator.validate_config')
-    @patch('lib.validator.Path.read_text')
+    @patch('lib.validator.Path.read_bytes')
     @patch('lib.validator.Path.exists')
     def test_test_site_config_valid(self, mock_exists, mock_read, mock_validate, validator):
         """Test site config with valid configuration."""
         mock_exists.return_value = True
-        mock_read.return_value = '''
+        mock_read.return_value = b'''
         server {
             server_name test.com;
             listen 80;
@@ -316,24 +514,11 @@ configure arguments: --with-http_ssl_module --with-http_v2_module --with-http_re
         assert valid is True
         mock_validate.assert_called_once()
     
-    @patch('lib.validator.Path.iterdir')
-    @patch('lib.validator.Path.exists')
-    def test_check_port_conflicts(self, mock_exists, mock_iterdir, validator):
+    def test_check_port_conflicts(self, validator, tmp_path):
         """Test port conflict detection."""
-        mock_exists.return_value = True
-        
-        # Create mock site files
-        site1 = MagicMock()
-        site1.name = 'site1.com'
-        site1.is_file.return_value = True
-        site1.read_text.return_value = 'listen 80;'
-        
-        site2 = MagicMock()
-        site2.name = 'site2.com'
-        site2.is_file.return_value = True
-        site2.read_text.return_value = 'listen 80;'
-        
-        mock_iterdir.return_value = [site1, site2]
+        (tmp_path / 'site1.com').write_text('listen 80;')
+        (tmp_path / 'site2.com').write_text('listen 80;')
+        validator._sites_enabled = tmp_path
         
         conflicts = validator.check_port_conflicts()
         
@@ -341,21 +526,96 @@ configure arguments: --with-http_ssl_module --with-http_v2_module --with-http_re
         # but not return as error since they might have different server_names
         assert conflicts == []
     
-    @patch('lib.validator.subprocess.run')
-    def test_get_error_log_recent(self, mock_run, validator):
+    def test_check_port_conflicts_logs_shared_ports(self, validator, tmp_path, caplog):
+        """Test listen directives are parsed line by line across site files."""
+        available = tmp_path / 'sites-available'
+        available.mkdir()
+        (available / 'site1.com').write_text(
+            'server {\n    listen 80;\n}\nserver {\n    listen [::]:443 ssl;\n}\n'
+        )
+        enabled = tmp_path / 'sites-enabled'
+        enabled.mkdir()
+        (enabled / 'site1.com').symlink_to(available / 'site1.com')
+        (enabled / 'site2.com').write_text('server { listen 443 ssl; listen 8080; }\n')
+        (enabled / 'snippets').mkdir()
+        validator._sites_enabled = enabled
+        
+        with caplog.at_level('WARNING', logger='lib.validator'):
+            conflicts = validator.check_port_conflicts()
+        
+        assert conflicts == []
+        assert 'Multiple sites on port 443' in caplog.text
+        assert 'site1.com' in caplog.text and 'site2.com' in caplog.text
+        assert 'port 80:' not in caplog.text
+        assert 'port 8080' not in caplog.text
+    
+    def test_listen_ports(self, validator, tmp_path):
+        """Test listen directive parsing."""
+        site = tmp_path / 'site.com'
+        site.write_text(
+            'server {\n'
+            '    listen 80 default_server;\n'
+            '    # listen 9000;\n'
+            '    listen [::]:443 ssl http2;  # IPv6\n'
+            '    listen 127.0.0.1;\n'
+            '    server_name site.com; listen 8443 ssl;\n'
+            '}\n'
+        )
+        
+        assert validator._listen_ports(str(site)) == ['80', '443', '80', '8443']
+    
+    def test_listen_ports_undecodable_bytes(self, validator, tmp_path):
+        """Test lines without listen directives are never decoded."""
+        site = tmp_path / 'site.com'
+        site.write_bytes(b'# caf\xe9\nserver {\n    listen 8080;\n}\n')
+        
+        assert validator._listen_ports(str(site)) == ['8080']
+    
+    def test_listen_ports_edge_files(self, validator, tmp_path):
+        """Test empty files and a final line without a newline."""
+        empty = tmp_path / 'empty.com'
+        empty.write_bytes(b'')
+        no_newline = tmp_path / 'last.com'
+        no_newline.write_bytes(b'server {\n    listen 8080;\n    listen 443 ssl; }')
+        
+        assert validator._listen_ports(str(empty)) == []
+        assert validator._listen_ports(str(no_newline)) == ['8080', '443']
+    
+    def test_check_port_conflicts_no_sites_dir(self, validator, tmp_path):
+        """Test port check when sites-enabled does not exist."""
+        validator._sites_enabled = tmp_path / 'missing'
+        
+        assert validator.check_port_conflicts() == []
+    
+    def test_get_error_log_recent(self, validator, tmp_path):
         """Test getting recent error log lines."""
-        mock_run.return_value = MagicMock(
-            returncode=0,
-            stdout='2024/01/15 10:00:00 [error] Test error 1\n2024/01/15 10:00:01 [error] Test error 2',
-            stderr=''
+        error_log = tmp_path / 'error.log'
+        error_log.write_text(
+            '2024/01/15 09:59:59 [error] Old error\n'
+            '2024/01/15 10:00:00 [error] Test error 1\n'
+            '2024/01/15 10:00:01 [error] Test error 2\n'
         )
+        validator._error_log = error_log
         
-        with patch('lib.validator.Path.exists', return_value=True):
-            lines = validator.get_error_log_recent(lines=2)
-            
-            assert len(lines) == 2
-            assert 'Test error 1' in lines[0]
-            assert 'Test error 2' in lines[1]
+        lines = validator.get_error_log_recent(lines=2)
+        
+        assert len(lines) == 2
+        assert 'Test error 1' in lines[0]
+        assert 'Test error 2' in lines[1]
+    
+    def test_get_error_log_recent_spans_chunks(self, validator, tmp_path):
+        """Test tail reads back across several blocks of a large log."""
+        error_log = tmp_path / 'error.log'
+        error_log.write_bytes(b''.join(
+            b'%05d [error] ' % i + b'x' * 500 + b'\n' for i in range(200)
+        ))
+        validator._error_log = error_log
+        
+        lines = validator.get_error_log_recent(lines=50)
+        
+        assert len(lines) == 50
+        assert lines[0].startswith('00150 ')
+        assert lines[-1].startswith('00199 ')
     
     def test_get_error_log_recent_no_log(self, validator):
         """Test error log retrieval when log doesn't exist."""
@@ -364,12 +624,11 @@ configure arguments: --with-http_ssl_module --with-http_v2_module --with-http_re
             
             assert lines == []
     
-    @patch('lib.validator.subprocess.run')
-    def test_get_error_log_recent_error(self, mock_run, validator):
+    def test_get_error_log_recent_error(self, validator, tmp_path):
         """Test error log retrieval error handling."""
-        mock_run.side_effect = Exception('Failed to read log')
+        # A directory exists but cannot be opened as a file
+        validator._error_log = tmp_path
         
-        with patch('lib.validator.Path.exists', return_value=True):
-            lines = validator.get_error_log_recent()
-            
-            assert lines == []
\ No newline at end of file
+        lines = validator.get_error_log_recent()
+        
+        assert lines == []